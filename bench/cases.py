@@ -0,0 +1,187 @@
+# Benchmarks of the pure functions behind the quiz, colour and member lookup commands, at the sizes a large
+# guild reaches. Each case's setup builds its inputs once, and returns the function to time.
+from datetime import timedelta
+from functools import lru_cache
+from itertools import cycle
+from random import Random
+from types import SimpleNamespace
+import discord
+from discord.state import ConnectionState
+from cogs.ccolour import BANNED_COLOURS, BoostColour, CustomColours, get_colour, get_target_member, int_to_rgb
+from cogs.quiz import QuizData, ScoreData
+from harness.world import BOT_USER_ID, generate_guilds, user_payload
+from util.timeformatter import highest_denom
+
+PLAYERS = 10_000  # Quiz players answering each round
+MEMBERS = 100_000  # Members in the guild for member lookups
+COLOUR_LINKS = 5_000  # Custom colours in that guild
+OPTIONS = ["🇦", "🇧", "🇨", "🇩"]
+# Sorts and scans over thousands of objects vary more from run to run, with where the objects landed in memory.
+SCAN_TOLERANCE = 0.6
+
+CASES = {}  # {name: (setup, tolerance or None)}
+
+
+def case(name: str, tolerance: float = None):
+    """
+    Registers a benchmark
+    :param name: shown in the results and used as the key in the baseline
+    :param tolerance: the fraction slower than the baseline it may get, if not the default - for noisy cases
+    """
+    def register(setup):
+        CASES[name] = (setup, tolerance)
+        return setup
+    return register
+
+
+def _run_sync(coro):
+    # For coroutines that never actually wait on anything, without the overhead of an event loop.
+    try:
+        coro.send(None)
+    except StopIteration as stop:
+        return stop.value
+    raise RuntimeError("The coroutine waited on something")
+
+
+@lru_cache(maxsize=None)
+def big_guild() -> discord.Guild:
+    """A real discord.Guild with every member cached, built from the load harness's synthetic payloads."""
+    fake_guild = generate_guilds(1, MEMBERS, 100)[0]
+    state = ConnectionState(dispatch=lambda *args: None, handlers={}, hooks={}, syncer=None, http=None, loop=None,
+                            intents=discord.Intents.all(), chunk_guilds_at_startup=False)
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_USER_ID, "6thBot", bot=True))
+    return discord.Guild(data=fake_guild.create_payload(member_limit=len(fake_guild.members)), state=state)
+
+
+@lru_cache(maxsize=None)
+def colour_cog() -> CustomColours:
+    """The colour cog with COLOUR_LINKS colours in big_guild, without a bot to start its tasks or open its store."""
+    guild = big_guild()
+    rng = Random(0)
+    members = rng.sample(guild.members, COLOUR_LINKS * 2)
+    roles = [role for role in guild.roles if not role.is_default()]
+    cog = CustomColours.__new__(CustomColours)
+    cog.banned_colours = list(BANNED_COLOURS)
+    cog.bot = SimpleNamespace(config=SimpleNamespace(role=lambda guild, key: None,
+                                                     value=lambda guild, key, default=None: default))
+    # Half give themselves a colour, half give one to someone else.
+    cog.colour_store = {guild.id: [
+        BoostColour(rng.choice(roles), members[num], members[num] if num % 2 else members[num + COLOUR_LINKS])
+        for num in range(COLOUR_LINKS)
+    ]}
+    return cog
+
+
+def _played_quiz(rounds: int) -> QuizData:
+    rng = Random(0)
+    quiz = QuizData(None, OPTIONS)
+    for _ in range(rounds):
+        for user_id in range(PLAYERS):
+            quiz.set_answer(user_id, rng.choice(OPTIONS))
+        quiz.update_scores(rng.choice(OPTIONS))
+    return quiz
+
+
+@case("quiz.update_scores")
+def update_scores():
+    quiz = _played_quiz(3)
+    rng = Random(1)
+    answers = {user_id: rng.choice(OPTIONS) for user_id in range(PLAYERS)}
+
+    correct = cycle(OPTIONS)  # So streaks keep resetting, and the scores stay the same size however long it runs
+
+    def run():
+        quiz.current_answers = dict(answers)  # update_scores empties it
+        quiz.update_scores(next(correct))
+    return run
+
+
+@case("quiz.top_scores(10)", SCAN_TOLERANCE)
+def top_scores_leaderboard():
+    quiz = _played_quiz(10)
+    return lambda: quiz.top_scores(10)
+
+
+@case("quiz.top_scores", SCAN_TOLERANCE)
+def top_scores_all():
+    quiz = _played_quiz(10)
+    return quiz.top_scores
+
+
+@case("quiz.ScoreData")
+def score_data():
+    results = [Random(0).random() < 0.4 for _ in range(1000)]
+
+    def run():
+        data = ScoreData()
+        for correct in results:
+            if correct:
+                data.add_correct()
+            else:
+                data.add_incorrect()
+    return run
+
+
+@case("ccolour.get_colour")
+def get_colours():
+    rng = Random(0)
+    names = ["red", "Purple", "a69420", "FF8B00", "000000", "notacolour", "ab12", "#ffffff"]
+    inputs = [rng.choice(names) for _ in range(1000)]
+    return lambda: [get_colour(colour_string) for colour_string in inputs]
+
+
+@case("ccolour.int_to_rgb")
+def ints_to_rgb():
+    rng = Random(0)
+    colours = [rng.randrange(0x1000000) for _ in range(1000)]
+    return lambda: [int_to_rgb(colour_int) for colour_int in colours]
+
+
+@case("ccolour.is_colour_valid")
+def colours_valid():
+    cog = CustomColours.__new__(CustomColours)
+    cog.banned_colours = list(BANNED_COLOURS)
+    rng = Random(0)
+    colours = [rng.randrange(0x1000000) for _ in range(1000)]
+    return lambda: [cog.is_colour_valid(colour_int) for colour_int in colours]
+
+
+@case("timeformatter.highest_denom")
+def highest_denoms():
+    rng = Random(0)
+    times = [rng.randrange(10 ** rng.randrange(1, 9)) for _ in range(1000)]
+    times[::2] = [timedelta(seconds=seconds) for seconds in times[::2]]
+    return lambda: [highest_denom(time) for time in times]
+
+
+@case("ccolour.colours_embed", SCAN_TOLERANCE)
+def colours_embed():
+    cog = colour_cog()
+    guild = big_guild()
+    member = cog.colour_store[guild.id][-1].from_member  # At the end of the store, the worst case
+    return lambda: cog.colours_embed(guild, member)
+
+
+@case("ccolour.check_existing_colours", SCAN_TOLERANCE)
+def check_existing_colours():
+    cog = colour_cog()
+    guild = big_guild()
+    author = cog.colour_store[guild.id][-1].from_member
+    ctx = SimpleNamespace(guild=guild, author=author)
+    target = guild.members[0]  # Has no colour, so every link is checked
+    return lambda: _run_sync(cog.check_existing_colours(ctx, target))
+
+
+def _target_member_case(describe):
+    def setup():
+        guild = big_guild()
+        member = guild.members[-1]  # The last one cached, so a name lookup checks everyone before it
+        ctx = SimpleNamespace(guild=guild, message=SimpleNamespace(mentions=[]))
+        user_string = describe(member)
+        return lambda: get_target_member(ctx, user_string)
+    return setup
+
+
+for description, describe in (("name#discrim", str), ("id", lambda member: str(member.id)),
+                              ("unknown", lambda member: "nobody by this name")):
+    case(f"ccolour.get_target_member({description})", SCAN_TOLERANCE)(_target_member_case(describe))
@@ -0,0 +1,112 @@
+# Times the benchmarks in bench/cases.py, and fails if any got slower than the saved baseline allows.
+#
+#   python -m bench.run                   Compare against bench/baseline.json
+#   python -m bench.run --save            Save the results as the new baseline
+#   python -m bench.run --only quiz       Only run cases with "quiz" in the name
+#
+# Run from the repo root. Times are scaled by a fixed calibration workload, timed on the same run, so a
+# baseline saved on one machine still means something on a faster or slower one.
+from argparse import ArgumentParser
+from json import dump, load
+from platform import python_version
+from statistics import median
+from timeit import Timer
+import os.path
+import sys
+from bench.cases import CASES
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+DEFAULT_TOLERANCE = 0.3  # How much slower than the baseline a case may get, as a fraction
+
+
+def _calibration_workload():
+    # Plain Python dict, list and sort work, like most of the cases.
+    values = {num: (num * 7919) % 10007 for num in range(5000)}
+    return sorted(values.items(), key=lambda item: item[1])[:10]
+
+
+def time_per_call(func, repeat: int = 5) -> float:
+    """The median of `repeat` timings, in seconds per call. Steadier from run to run than the fastest, which
+    depends on how lucky one timing got."""
+    timer = Timer(func)
+    number, _ = timer.autorange()
+    return median(timer.repeat(repeat, number)) / number
+
+
+def load_baseline(path: str) -> dict:
+    if not os.path.isfile(path):
+        return {}
+    with open(path, "r", encoding="utf-8") as file:
+        return load(file)
+
+
+def compare(results: dict, calibration: float, baseline: dict, tolerance: float) -> list:
+    """
+    Compares results against the baseline
+    :param results: {name: seconds per call}
+    :param calibration: the calibration workload's seconds per call on this run
+    :return: a list of (name, expected seconds or None, seconds, allowed fraction slower, regressed)
+    """
+    scale = calibration / baseline["calibration"] if baseline.get("calibration") else 1.0
+    rows = []
+    for name, secs in results.items():
+        case_tolerance = CASES[name][1]
+        allowed = tolerance if case_tolerance is None else case_tolerance
+        expected = baseline.get("cases", {}).get(name)
+        if expected is not None:
+            expected *= scale
+        rows.append((name, expected, secs, allowed, expected is not None and secs > expected * (1 + allowed)))
+    return rows
+
+
+def print_rows(rows: list):
+    print(f"{'case':<44} {'baseline':>11} {'now':>11} {'change':>8}")
+    for name, expected, secs, allowed, regressed in rows:
+        if expected is None:
+            print(f"{name:<44} {'-':>11} {secs * 1e6:>9.1f}us {'new':>8}")
+            continue
+        change = secs / expected - 1
+        status = f"  SLOWER (over {allowed:.0%})" if regressed else ""
+        print(f"{name:<44} {expected * 1e6:>9.1f}us {secs * 1e6:>9.1f}us {change:>+8.1%}{status}")
+
+
+def main_cli():
+    parser = ArgumentParser(description="Run the microbenchmarks and compare them with the baseline.")
+    parser.add_argument("--save", action="store_true", help="Save the results as the new baseline")
+    parser.add_argument("--only", help="Only run cases whose names contain this")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE,
+                        help="How much slower than the baseline a case may get, e.g. 0.3 for 30%%")
+    parser.add_argument("--repeat", type=int, default=5, help="Timings per case, of which the median is kept")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline)
+    if baseline.get("python") not in (None, python_version()):
+        print(f"Note: the baseline was saved on Python {baseline['python']}, this is {python_version()}")
+
+    calibration = time_per_call(_calibration_workload, args.repeat)
+    results = {}
+    for name, (setup, _) in CASES.items():
+        if args.only is not None and args.only not in name:
+            continue
+        results[name] = time_per_call(setup(), args.repeat)
+        print(f"  {name}", file=sys.stderr)
+    rows = compare(results, calibration, baseline, args.tolerance)
+    print_rows(rows)
+
+    if args.save:
+        cases = dict(baseline.get("cases", {})) if args.only is not None else {}
+        scale = calibration / baseline["calibration"] if args.only is not None and baseline.get("calibration") else 1
+        # Keeping the cases that weren't run, rescaled to this run's calibration.
+        cases = {name: secs * scale for name, secs in cases.items()}
+        cases.update(results)
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            dump({"python": python_version(), "calibration": calibration, "cases": cases}, file, indent=2)
+            file.write("\n")
+        print(f"Saved the baseline to {args.baseline}")
+    elif any(row[4] for row in rows):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -1,49 +1,255 @@
 # Implements a gif search and steam profile search.
-from discord.ext import commands
-from json import loads
+from discord.ext import commands, tasks
 from discord import Embed
 from datetime import datetime
-from aiohttp import ClientSession
+from asyncio import Event, TimeoutError, ensure_future, gather, wait_for
+from math import ceil
+from util.ttlcache import TTLCache
+from util.web import UpstreamError
+from util.logs import get_logger
 
+log = get_logger(__name__)
+intents = ["guild_reactions"]
+STALE_PROFILES = 6 * 3600  # Seconds old a Steam response can be, to show it while Steam isn't responding
+STEAM_USER_URL = "http://api.steampowered.com/ISteamUser/"
+STEAM_GAMES_URL = "http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/"
+VANITY_CACHE_PATH = "json/steam_vanity.json"
+GAMES_PER_PAGE = 10
+LIBRARY_TIMEOUT = 60.0  # Seconds without a page being turned before the library stops responding to reactions
+SUMMARY_BATCH = 100  # The most steamids GetPlayerSummaries takes in one request
 
-async def get_json_content(url):
-    async with ClientSession() as session:
-        async with session.get(url) as resp:
-            print("Response:" + str(resp.status))
-            json_string = await resp.text()
-    return loads(json_string)
+
+def batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+class LibraryPages:
+    """A player's games, most played first, shown GAMES_PER_PAGE at a time."""
+    def __init__(self, player: dict, games: list):
+        self.player = player
+        self.games = games  # [(playtime, name, appid)], as built by API.fetch_library
+        self.page = 0
+        self.count = max(1, ceil(len(games) / GAMES_PER_PAGE))
+
+    def turn(self, step: int):
+        self.page = (self.page + step) % self.count
+
+    def embed(self) -> Embed:
+        start = self.page * GAMES_PER_PAGE
+        lines = []
+        for num, (playtime, name, appid) in enumerate(self.games[start:start + GAMES_PER_PAGE], start + 1):
+            hours = int(round(int(playtime) / 60))
+            lines.append(f"**{num}.** [{name}](https://store.steampowered.com/app/{appid}) | {hours} Hours")
+        em = Embed(colour=0x8B008B, title=f"Game Library | {self.player['personaname']}",
+                   url=self.player['profileurl'], description="\n".join(lines))
+        em.set_thumbnail(url=self.player['avatarfull'])
+        em.set_footer(text=f"Page {self.page + 1}/{self.count} | {len(self.games)} games | Most played first")
+        return em
 
 
 class API(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
+        # A vanity name rarely changes hands, so is kept for a week, across restarts. Profiles and libraries change
+        # as people play, so are only kept for a few minutes.
+        self.vanity_ids = TTLCache(10_000, 7 * 86400, path=VANITY_CACHE_PATH)  # {vanity name: steamid}
+        self.summaries = TTLCache(2_000, 5 * 60)  # {steamid: player summary}
+        self.libraries = TTLCache(1_000, 10 * 60)  # {steamid: [games owned, unplayed, [[playtime, name, appid]]]}
+        self.game_indexes = TTLCache(200, 10 * 60)  # {steamid: [(playtime, name, appid)]}, for browsing whole libraries
+        # Members' linked accounts, and their summaries - kept warm by refresh_links rather than fetched one by one.
+        self.steam_links = bot.open_store("steam_links")  # {guild_id: {"members": {member_id: steamid}}}
+        self.linked_players = {}  # {steamid: player summary}
+        self.links_refreshed = None
+        self.save_caches.start()
+        self.refresh_links.start()
 
-    @commands.command(pass_context=True)
-    async def steam(self, ctx, *, search):
-        """Returns information about a steam profile, given the id or vanity id.
+    def cog_unload(self):
+        self.save_caches.cancel()
+        self.refresh_links.cancel()
+        # The executor's threads are waited for on exit, so this still finishes if the bot is shutting down.
+        saved = self.vanity_ids.snapshot()
+        if saved is not None:
+            self.bot.loop.run_in_executor(None, self.vanity_ids.write, saved)
 
-        steam [id] --> returns publicly available steam account info.
+    @property
+    def caches(self) -> dict:
+        return {"steam vanity": self.vanity_ids, "steam summary": self.summaries, "steam library": self.libraries,
+                "steam game index": self.game_indexes}
+
+    @tasks.loop(minutes=10)
+    async def save_caches(self):
+        # Copied on the loop, then serialised and written in the executor so thousands of entries don't block it.
+        saved = self.vanity_ids.snapshot()
+        if saved is not None:
+            await self.bot.loop.run_in_executor(None, self.vanity_ids.write, saved)
+
+    @tasks.loop(minutes=5)
+    async def refresh_links(self):
+        steamids = {steamid for links in self.steam_links.values() for steamid in links.get("members", {}).values()}
+        if not steamids:
+            self.linked_players = {}
+            return
+        players = {}
+        try:
+            for batch in batches(sorted(steamids), SUMMARY_BATCH):
+                players.update(await self.player_summaries(batch))
+        except UpstreamError as e:
+            # The summaries from the last refresh are kept, rather than being half replaced.
+            log.warning("Failed to refresh linked Steam accounts", linked=len(steamids), error=e)
+            return
+        self.linked_players = players
+        self.links_refreshed = datetime.utcnow()
+        log.info("Refreshed linked Steam accounts", linked=len(steamids), found=len(players))
+
+    @refresh_links.before_loop
+    async def before_refresh(self):
+        await self.bot.wait_until_ready()
+
+    async def player_summaries(self, steamids: list) -> dict:
         """
+        Fetches several players' summaries in one request
+        :param steamids: at most SUMMARY_BATCH of them
+        :return: {steamid: player summary}, without any ids that have no profile
+        """
+        url = f"{STEAM_USER_URL}GetPlayerSummaries/v0002/?key={self.bot.steam_api_key}&steamids={','.join(steamids)}"
+        players = (await self.bot.web.get_json(url))['response']['players']
+        return {player['steamid']: player for player in players}
+
+    async def player_summary(self, steamid: str):
+        """A player's summary from GetPlayerSummaries, or None if there's no profile with that id."""
+        player = self.linked_players.get(steamid) or self.summaries.get(steamid)
+        if player is None:
+            url = f"{STEAM_USER_URL}GetPlayerSummaries/v0002/?key={self.bot.steam_api_key}&steamids={steamid}"
+            players = (await self.bot.web.get_json(url, stale=STALE_PROFILES))['response']['players']
+            if not players:
+                return None
+            player = players[0]
+            self.summaries.put(player['steamid'], player)
+        return player
 
-        base_url = "http://api.steampowered.com/ISteamUser/"
-        url = f"{base_url}GetPlayerSummaries/v0002/?key={self.bot.steam_api_key}&steamids={search}"
-        response = (await get_json_content(url))['response']
+    async def resolve_vanity(self, name: str):
+        """The steamid a vanity URL name points to, or None if it doesn't point to one."""
+        url = f"{STEAM_USER_URL}ResolveVanityURL/v0001/?key={self.bot.steam_api_key}&vanityurl={name}"
+        response = (await self.bot.web.get_json(url, stale=STALE_PROFILES))['response']
+        if response['success'] != 1:
+            return None
+        self.vanity_ids.put(name, response['steamid'])
+        return response['steamid']
 
-        if not response['players']:
-            # Try searching for VanityURL
-            url = f"{base_url}ResolveVanityURL/v0001/?key={self.bot.steam_api_key}&vanityurl={search}"
-            response = (await get_json_content(url))['response']
+    async def library(self, steamid: str) -> list:
+        """
+        Sums up a player's games
+        :return: [games owned (None if their library is hidden), unplayed, [[playtime, name, appid]] of the top 6]
+        """
+        library = self.libraries.get(steamid)
+        if library is None:
+            library, _ = await self.fetch_library(steamid)
+        return library
+
+    async def fetch_library(self, steamid: str) -> tuple:
+        """
+        Fetches a player's games, caching both the summary library() returns and the sorted index game_index() does,
+        so browsing the library after a lookup doesn't fetch it again
+        :return: (library summary, [(playtime, name, appid)] most played first)
+        """
+        url = f"{STEAM_GAMES_URL}?key={self.bot.steam_api_key}&steamid={steamid}&include_appinfo=1"
+        # Streamed, so only the compact tuples are held, never the whole response.
+        games = []
+        games_owned = await self.bot.web.scan_json_array(
+            url, "games", lambda game: games.append((game['playtime_forever'], game['name'], game['appid'])))
+        games.sort(reverse=True)
+        unplayed = sum(1 for game in games if game[0] == 0)
+        library = [games_owned, unplayed, [list(game) for game in games[:6]]]
+        self.libraries.put(steamid, library)
+        self.game_indexes.put(steamid, games)
+        return library, games
 
-            if response['success'] != 1:
-                em = Embed(title="Not Found 😕", description="Your ID search doesn't link to any profile.")
-                await ctx.channel.send(embed=em)
+    async def library_or_none(self, steamid: str):
+        # A library that can't be fetched shouldn't stop the profile being shown.
+        try:
+            return await self.library(steamid)
+        except UpstreamError:
+            return None
+
+    async def lookup(self, search: str) -> tuple:
+        """
+        Finds a profile by steamid or vanity name, fetching its library alongside it rather than after
+        :return: (player summary, library or None if Steam failed to send it), or (None, None) if nothing matches
+        """
+        steamid = None if search.isdigit() else self.vanity_ids.get(search)
+        if steamid is None and not search.isdigit():
+            # Steam ids are all digits, so this can only be a vanity name.
+            steamid = await self.resolve_vanity(search)
+            if steamid is None:
+                return None, None
+        if steamid is not None:
+            return tuple(await gather(self.player_summary(steamid), self.library_or_none(steamid)))
+
+        # Most likely an id, but it could be a vanity name made of digits. Both are tried at once, along with the
+        # id's library, and whichever turns out to be wrong is cancelled.
+        summary = ensure_future(self.player_summary(search))
+        vanity = ensure_future(self.resolve_vanity(search))
+        library = ensure_future(self.library_or_none(search))
+        try:
+            player_content = await summary
+            if player_content is not None:
+                vanity.cancel()
+                return player_content, await library
+            library.cancel()
+            steamid = await vanity
+            if steamid is None:
+                return None, None
+            return tuple(await gather(self.player_summary(steamid), self.library_or_none(steamid)))
+        finally:
+            for task in (summary, vanity, library):
+                if not task.done():
+                    task.cancel()
+                elif not task.cancelled():
+                    task.exception()  # Marks it retrieved, if it failed while no longer needed
+
+    def linked_members(self, guild) -> dict:
+        """{member_id: steamid} for the members who've linked an account in the guild."""
+        if guild is None:
+            return {}
+        return self.steam_links.get(str(guild.id), {}).get("members", {})
+
+    async def find_player(self, search: str):
+        """A player's summary by steamid or vanity name, without their library, or None if nothing matches."""
+        player = await self.player_summary(search) if search.isdigit() else None
+        if player is None:
+            steamid = self.vanity_ids.get(search) or await self.resolve_vanity(search)
+            if steamid is not None:
+                player = await self.player_summary(steamid)
+        return player
+
+    @commands.group(pass_context=True, invoke_without_command=True)
+    async def steam(self, ctx, *, search=None):
+        """Returns information about a steam profile, given the id or vanity id.
+
+        steam [id] --> returns publicly available steam account info.
+        steam --> the same, for the account you've linked.
+        steam id [id] --> the same, for vanity ids that are also subcommand names, like "online".
+        """
+        if search is None:
+            search = self.linked_members(ctx.guild).get(str(ctx.author.id))
+            if search is None:
+                await ctx.send(f"Link your Steam account first, with `{ctx.prefix}steam link [id]`.")
                 return
+        await self.show_profile(ctx, search)
 
-            search = response['steamid']
-            url = f"{base_url}GetPlayerSummaries/v0002/?key={self.bot.steam_api_key}&steamids={search}"
-            response = (await get_json_content(url))['response']
+    @steam.command(name="id")
+    async def steam_id(self, ctx, *, search):
+        """Looks up a profile by id or vanity id, even one that's also the name of a steam subcommand."""
+        await self.show_profile(ctx, search)
 
-        player_content = response['players'][0]
+    async def show_profile(self, ctx, search: str):
+        player_content, library = await self.lookup(search)
+        if player_content is None:
+            em = Embed(title="Not Found 😕", description="Your ID search doesn't link to any profile.")
+            await ctx.channel.send(embed=em)
+            return
+        search = player_content['steamid']
 
         em = Embed(
             colour=0x8B008B,
@@ -65,60 +271,136 @@ class API(commands.Cog):
 
         em.set_thumbnail(url=player_content['avatarfull'])
         em.set_author(name="Steam Profile Search", icon_url=ctx.message.author.avatar_url)
-        em.set_footer(text="More information is available for Public profiles. | All times in UTC".format(search))
-
-        games_url = "http://api.steampowered.com/IPlayerService/GetOwnedGames/v0001/"
-        url = f"{games_url}?key={self.bot.steam_api_key}&steamid={search}&include_appinfo=1"
-        game_content = await get_json_content(url)
+        em.set_footer(text="More information is available for Public profiles. | All times in UTC")
 
-        game_list = []
-        if game_content['response']:
-            games_owned = game_content['response']['game_count']
+        if library is None:
+            em.add_field(name="🛒 Games Owned", value="Steam isn't responding right now.")
+            games_owned = None
+        else:
+            games_owned, unplayed, most_played = library
 
+        if games_owned:
             em.add_field(name="🛒 Games Owned", value=games_owned)
 
-            # Fetch the names and app ids of the Top 6 most played games.
-            games = game_content['response']['games']
-            unplayed = 0
-            for game in games:
-                game_list.append([game['playtime_forever'], game['name'], game['appid']])
-                if game['playtime_forever'] == 0:
-                    unplayed += 1
             if unplayed == games_owned:
                 em.add_field(name="🕸️ Unplayed", value="???")
                 em.add_field(name="🕖 Most Played", value="Your playtime is private :/")
             else:
                 em.add_field(name="🕸️ Unplayed", value="{} ({:.2%})".format(unplayed, unplayed / games_owned))
-                # 6n < n log n, so maybe just search through the list linearly
-                sorted_games = sorted(game_list)
-                if len(sorted_games) > 6:
-                    top6 = sorted_games[-6:]
-                else:
-                    top6 = sorted_games
-                top6.reverse()
-                print(top6)
 
                 value = ""
-                for item in top6:
-                    hours = int(round(int(item[0]) / 60))
-                    value += f"[{item[1]}](https://store.steampowered.com/app/{item[2]}) | {hours} Hours\n"
+                for playtime, name, appid in most_played:
+                    hours = int(round(int(playtime) / 60))
+                    value += f"[{name}](https://store.steampowered.com/app/{appid}) | {hours} Hours\n"
                 em.add_field(name="🕖 Most Played", value=value)
 
         steam_msg = await ctx.channel.send(embed=em)
         await steam_msg.add_reaction('🎮')
 
-        def check(msg_react, msg_user):
-            return msg_user == ctx.author and msg_react.message.id == steam_msg.id and msg_react.emoji == '🎮'
-
         try:
-            await self.bot.wait_for('reaction_add', timeout=15.0, check=check)
+            await self.bot.reactions.wait(steam_msg, emojis=['🎮'], user=ctx.author, timeout=15.0)
         except TimeoutError:
             steam_msg = await ctx.channel.fetch_message(steam_msg.id)
             await steam_msg.clear_reaction('🎮')
             return
 
-        # Display more games + playtime on reaction
-        # em.set_field_at()
+        await self.browse_library(ctx, steam_msg, player_content)
+
+    async def game_index(self, steamid: str) -> list:
+        """Every game in a player's library as (playtime, name, appid), most played first - built by the lookup's
+        fetch, and only fetched again if that's expired, so turning pages is just a slice."""
+        games = self.game_indexes.get(steamid)
+        if games is None:
+            _, games = await self.fetch_library(steamid)
+        return games
+
+    async def browse_library(self, ctx, message, player: dict):
+        """Shows the player's games on the message a page at a time, until the author stops turning pages."""
+        self.bot.actions.clear_reaction(message, '🎮')
+        games = await self.game_index(player['steamid'])
+        if not games:
+            return
+        pages = LibraryPages(player, games)
+        self.bot.actions.edit(message, embed=pages.embed())
+        if pages.count == 1:
+            return
+
+        turned = Event()
+
+        async def turn(reaction, user):
+            if user.id != ctx.author.id:
+                return
+            self.bot.actions.remove_reaction(reaction, user)
+            pages.turn(1 if str(reaction.emoji) == '▶️' else -1)
+            turned.set()
+            # Queued, so flipping through several pages quickly only sends the last of them.
+            self.bot.actions.edit(message, embed=pages.embed())
+
+        handle = self.bot.reactions.subscribe(message, turn, emojis=['◀️', '▶️'])
+        try:
+            for emoji in ('◀️', '▶️'):
+                self.bot.actions.add_reaction(message, emoji)
+            # The session ends once nobody's turned a page for a while.
+            while True:
+                turned.clear()
+                try:
+                    await wait_for(turned.wait(), LIBRARY_TIMEOUT)
+                except TimeoutError:
+                    break
+        finally:
+            self.bot.reactions.unsubscribe(handle)
+        self.bot.actions.clear_reactions(message)
+
+    @steam.command(name="link")
+    @commands.guild_only()
+    async def steam_link(self, ctx, *, search):
+        """Links your Steam account, by id or vanity id, so steam works without one and you show up in steam online."""
+        player = await self.find_player(search)
+        if player is None:
+            await ctx.send("Your ID search doesn't link to any profile.")
+            return
+        guild_str = str(ctx.guild.id)
+        if guild_str not in self.steam_links:
+            self.steam_links[guild_str] = {"members": {}}
+        self.steam_links[guild_str].setdefault("members", {})[str(ctx.author.id)] = player['steamid']
+        self.linked_players[player['steamid']] = player
+        await ctx.send(f"Linked your Steam account, **{player['personaname']}**.")
+
+    @steam.command(name="unlink")
+    @commands.guild_only()
+    async def steam_unlink(self, ctx):
+        members = self.linked_members(ctx.guild)
+        if members.pop(str(ctx.author.id), None) is None:
+            await ctx.send("You haven't linked a Steam account here.")
+            return
+        await ctx.send("Unlinked your Steam account.")
+
+    @steam.command(name="online")
+    @commands.guild_only()
+    async def steam_online(self, ctx):
+        """Lists the members playing a game right now, from their linked accounts."""
+        members = self.linked_members(ctx.guild)
+        playing = []
+        for member_id, steamid in members.items():
+            player = self.linked_players.get(steamid)
+            if player is not None and 'gameextrainfo' in player:
+                playing.append((player['gameextrainfo'], player['personaname'], member_id))
+        playing.sort(key=lambda entry: (entry[0].lower(), entry[1].lower()))
+
+        description = ""
+        for num, (game, name, member_id) in enumerate(playing):
+            line = f"<@{member_id}> ({name}) - **{game}**\n"
+            if len(description) + len(line) > 1900:
+                description += f"...and {len(playing) - num} more"
+                break
+            description += line
+        em = Embed(colour=0x8B008B, title=f"Playing on Steam | {ctx.guild.name}",
+                   description=description or "Nobody's playing anything right now.")
+        footer = f"{len(playing)} playing | {len(members)} linked"
+        if self.links_refreshed is not None:
+            footer += f" | Updated {self.links_refreshed.strftime('%H:%M')} UTC"
+        em.set_footer(text=footer)
+        await ctx.send(embed=em)
 
     @commands.command()
     async def wiki(self, ctx, *, search):
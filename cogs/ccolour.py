@@ -1,8 +1,17 @@
 from discord.ext import commands, tasks
-from discord import Member, Embed, Role, Colour, Guild, Forbidden, HTTPException
-from json import load, dumps
+from discord import Member, Embed, Role, Colour, Forbidden, HTTPException
+from json import load
+from os import path
 from asyncio import TimeoutError, sleep
 from re import match
+from util.features import needs_member_list, ensure_member_list
+from util.scheduler import BULK
+from util.logs import get_logger
+
+log = get_logger(__name__)
+intents = ["members", "guild_reactions"]
+DEFAULT_MAX_COLOURS = 2  # Number of people a member can give custom colours to, including themselves
+BANNED_COLOURS = [(231, 76, 60), (250, 128, 114), (101, 143, 209)]  # Too close to the staff and bot colours, in RGB
 
 
 def to_role_name(colour: int):
@@ -65,14 +74,13 @@ def get_target_member(ctx, user_string: str):
     if len(ctx.message.mentions) != 0:  # If member mentioned
         return ctx.message.mentions[0]
 
-    print(user_string)
     target_member = ctx.guild.get_member_named(user_string)  # By name or name + discriminator
     if target_member is not None:
         return target_member
     try:
         target_member = ctx.guild.get_member(int(user_string))
-    except ValueError as e:
-        print(e)
+    except ValueError:
+        pass
     return target_member
 
 
@@ -80,82 +88,99 @@ class CustomColours(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         # TODO: add/remove banned colours
-        self.banned_colours = [(231, 76, 60), (250, 128, 114), (101, 143, 209)]  # In RGB tuple format
-        # TODO: have colour store be a dictionary with [server_id]: [BoostColour, BoostColour, ...]
-        self.colour_store = []
+        self.banned_colours = list(BANNED_COLOURS)
+        self.colour_store = {}  # {guild_id: [BoostColour, ...]}, only for guilds on this process's shards
+        self.colour_links = bot.open_store("colour_links")  # {guild_id: {"links": [{role_id, from_id, to_id}]}}
 
-        self.save_colour_store.start()
+        self.bot.loop.create_task(self.fetch_colour_store())
         self.cleanup_roles.start()
 
-    async def fetch_colour_store(self):
-        await self.bot.wait_until_ready()
-        print("Fetching Colour Store...")
+    def cog_unload(self):
+        self.cleanup_roles.cancel()
+
+    def guild_colours(self, guild) -> list:
+        return self.colour_store.setdefault(guild.id, [])
+
+    def save_guild_colours(self, guild):
+        """Writes the guild's colours to the store, which saves them to disk shortly after."""
+        self.bot.results.drop(guild.id, "col")
+        self.colour_links[str(guild.id)] = {
+            "links": [{'role_id': colour_obj.role.id,
+                       'from_id': colour_obj.from_member.id,
+                       'to_id': colour_obj.to_member.id} for colour_obj in self.guild_colours(guild)]
+        }
+
+    def read_legacy_colours(self):
+        # Before colours were stored per guild, they were all kept in one file.
+        if len(self.colour_links) != 0 or not path.isfile("json/role_storage.json"):
+            return None
         with open("json/role_storage.json", "r") as file:
             if file.read() == "":
-                return []
+                return None
             file.seek(0)
-            colour_store_json = load(file)
-        colour_store = []
-        # TODO: switch to multi-server, with a map between server id and colours.
-        print(colour_store_json)
+            return load(file)
+
+    async def fetch_colour_store(self):
+        await self.bot.wait_until_ready()
+        log.info("Fetching colour store")
+        legacy_links = self.read_legacy_colours()
         for server_str in self.bot.guild_settings:
             guild = self.bot.get_guild(int(server_str))
             if guild is None:
                 continue
-            for colour_dict in colour_store_json:
+            if legacy_links is None:
+                links = self.colour_links.get(server_str, {}).get("links", [])
+            else:
+                links = [colour_dict for colour_dict in legacy_links if guild.get_role(colour_dict['role_id'])]
+            # Only guilds that use colours need their member lists fetched. That includes guilds with a colour role
+            # but no colours yet: discord.py drops member updates for uncached members, so without their members
+            # the colour role being granted or taken away would go unnoticed.
+            if not links and self.bot.config.role(guild, "colour_role_id") is None:
+                continue
+            await ensure_member_list(guild)
+            colour_store = []
+            for colour_dict in links:
                 from_member = guild.get_member(colour_dict['from_id'])
                 if from_member is None:
-                    print("Skipped due to invalid from_id")
+                    log.debug("Skipped colour link", guild=guild.id, reason="from_id", user=colour_dict['from_id'])
                     continue
                 if colour_dict['from_id'] == colour_dict['to_id']:
                     to_member = from_member
                 else:
                     to_member = guild.get_member(colour_dict['to_id'])
                     if to_member is None:
-                        print("Skipped due to invalid to_id")
+                        log.debug("Skipped colour link", guild=guild.id, reason="to_id", user=colour_dict['to_id'])
                         continue
                 role_obj = guild.get_role(colour_dict['role_id'])
                 if role_obj is None:
-                    print("Skipped due to invalid role_obj")
+                    log.debug("Skipped colour link", guild=guild.id, reason="role_id", role=colour_dict['role_id'])
                     continue
                 colour_store.append(BoostColour(role_obj, from_member, to_member))
-        return colour_store
+            self.colour_store[guild.id] = colour_store
+            self.bot.results.drop(guild.id, "col")  # In case someone used col before the colours were fetched
+            if legacy_links is not None:
+                self.save_guild_colours(guild)
+        log.info("Fetched colour store", guilds=len(self.colour_store))
 
     @tasks.loop(minutes=15)
     async def cleanup_roles(self):
-        print("Cleaning up roles...")
+        deleted = 0
         for server_str in self.bot.guild_settings:
             guild = self.bot.get_guild(int(server_str))
-            if guild is None:
+            # An unchunked guild's roles look empty, and there are no colours in it to clean up anyway.
+            if guild is None or not guild.chunked:
                 continue
             for role in guild.roles:
                 if len(role.members) == 0 and "CColour " in role.name:
-                    print(f"Deleting Role: {role.name}")
-                    await role.delete()
-        print("Finished")
+                    deleted += 1
+                    await self.bot.actions.delete_role(role, priority=BULK)
+        log.info("Cleaned up colour roles", deleted=deleted)
         
     @cleanup_roles.before_loop
     async def before_cleanup(self):
         # Wait for server data to load in
         await self.bot.wait_until_ready()
 
-    @tasks.loop(minutes=15)
-    async def save_colour_store(self):
-        print("Saving Custom Colours to file...")
-        colour_store_json = []
-        for colour_obj in self.colour_store:
-            colour_store_json.append({'role_id': colour_obj.role.id,
-                                      'from_id': colour_obj.from_member.id,
-                                      'to_id': colour_obj.to_member.id})
-        print(colour_store_json)
-        with open("json/role_storage.json", "w") as file:
-            file.write(dumps(colour_store_json))
-
-    @save_colour_store.before_loop
-    async def before_save(self):
-        self.colour_store = await self.fetch_colour_store()
-        print(self.colour_store)
-
     def is_colour_valid(self, colour_int: int):
         threshold = 1000  # Distance of just over 30
         col_r, col_g, col_b = int_to_rgb(colour_int)
@@ -169,27 +194,6 @@ class CustomColours(commands.Cog):
                 return False
         return True
 
-    def get_colour_role(self, guild: Guild):
-        """
-        Fetches the colour role for the specified server, if the setting exists
-        :param guild: Discord.Guild object
-        :return: Discord.Role object
-        """
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        colour_role_id = guild_settings.get("colour_role_id", None)
-        if colour_role_id is None:
-            return None
-        return guild.get_role(colour_role_id)
-
-    def get_max_colours(self, guild: Guild) -> int:
-        """
-        Fetches the maximum number of colours that can be given by a member (Defaults to 2)
-        :param guild: a discord.Guild object
-        :return: a positive integer
-        """
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        return guild_settings.get("max_colours", 2)
-
     @commands.Cog.listener()
     async def on_member_update(self, before: Member, after: Member):
         if before.bot:
@@ -199,12 +203,12 @@ class CustomColours(commands.Cog):
         after_roles = set(after.roles)
 
         # Get the colour role for the server, if it exists.
-        max_colours = self.get_max_colours(before.guild)
-        colour_role = self.get_colour_role(before.guild)
+        max_colours = self.bot.config.value(before.guild, "max_colours", DEFAULT_MAX_COLOURS)
+        colour_role = self.bot.config.role(before.guild, "colour_role_id")
         if colour_role is None:
             return
         elif colour_role in (after_roles - before_roles):  # Colour enabling role added
-            print(f"+ {after} can now use custom colours.")
+            log.info("Custom colours enabled", guild=after.guild.id, member=after.id)
             await after.send(
                 "Just to let you know, you now have access to __custom colours__!\n\n"
                 "Commands:\n"
@@ -217,26 +221,31 @@ class CustomColours(commands.Cog):
                 f"You can give out custom colours to **{max_colours}** people, including yourself."
             )
         elif colour_role in (before_roles - after_roles):  # Colour enabling role removed
-            print(f"- {after} can no longer use custom colours.")
+            log.info("Custom colours disabled", guild=after.guild.id, member=after.id)
+            await ensure_member_list(after.guild)
             # Finds the colours they gave out, and removes them.
             removed_roles = set()
-            for colour_obj in self.colour_store:
+            colour_store = self.guild_colours(after.guild)
+            for colour_obj in colour_store:
                 if colour_obj.from_member == after:
                     removed_roles.add(colour_obj.role)
-                    await colour_obj.to_member.remove_roles(colour_obj.role)
-                    self.colour_store.remove(colour_obj)
+                    await self.bot.actions.remove_roles(colour_obj.to_member, colour_obj.role, priority=BULK)
+                    colour_store.remove(colour_obj)
+            self.save_guild_colours(after.guild)
 
             # When done, check the colours and delete every role with no users.
             for role in removed_roles:
                 if len(role.members) == 0:
-                    print("Removed completely")
-                    await role.delete()
+                    log.debug("Deleting unused colour role", guild=role.guild.id, role=role.id)
+                    await self.bot.actions.delete_role(role, priority=BULK)
 
     @commands.Cog.listener()
     async def on_guild_role_delete(self, role):
-        for colour_obj in self.colour_store:
+        colour_store = self.guild_colours(role.guild)
+        for colour_obj in colour_store:
             if colour_obj.role.id == role.id:
-                self.colour_store.remove(colour_obj)
+                colour_store.remove(colour_obj)
+                self.save_guild_colours(role.guild)
                 break
 
     async def request_custom_colour(self, ctx, colour, member_obj):
@@ -246,7 +255,7 @@ class CustomColours(commands.Cog):
         if ctx.author == member_obj:
             return True
         em = Embed(title="You've been gifted a custom role colour!", colour=colour_to_object(colour),
-                   description=f"Would you like to accept? Your name will have a new colour in chat.")
+                   description="Would you like to accept? Your name will have a new colour in chat.")
         em.set_footer(text="This request will time out after 30 seconds.")
         em.add_field(name="Hex Code", value=f"#{hex(colour)[2:].zfill(6)}")
         em.add_field(name="From", value=ctx.author.mention)
@@ -255,11 +264,8 @@ class CustomColours(commands.Cog):
         await msg.add_reaction('👍')
         await msg.add_reaction('👎')
 
-        def check(msg_react, msg_user):
-            return msg_user == member_obj and msg_react.message.id == msg.id and msg_react.emoji in ['👍', '👎']
-
         try:
-            reaction, user = await self.bot.wait_for('reaction_add', timeout=30, check=check)
+            reaction, user = await self.bot.reactions.wait(msg, emojis=['👍', '👎'], user=member_obj, timeout=30)
         except TimeoutError:
             await msg.clear_reactions()
             em = Embed(title="You've been gifted a custom role colour!",
@@ -282,16 +288,13 @@ class CustomColours(commands.Cog):
     async def check_existing_colours(self, ctx, member_obj: Member):
         count = 0
         old_colour_obj = True
-        max_count = self.get_max_colours(ctx.guild)
-        for colour_obj in self.colour_store:
-            print(f"From: Searching for {ctx.author}, found {colour_obj.from_member}")
-            print(f"To: Searching for {member_obj}, found {colour_obj.to_member}")
+        max_count = self.bot.config.value(ctx.guild, "max_colours", DEFAULT_MAX_COLOURS)
+        for colour_obj in self.guild_colours(ctx.guild):
             if colour_obj.to_member == member_obj:  # If old colour exists
                 old_colour_obj = colour_obj
                 if colour_obj.from_member == ctx.author:  # If link is existing
                     break
             if colour_obj.from_member == ctx.author:
-                print("Count incremented")
                 count += 1
                 if count >= max_count:
                     await ctx.send(f"You can only give custom colours to {max_count} users, including yourself.\n"
@@ -301,36 +304,45 @@ class CustomColours(commands.Cog):
 
     async def assign_custom_colour(self, ctx, member: Member, colour):
         role_name = to_role_name(colour)
-        print(role_name)
-        for colour_obj in self.colour_store:
+        for colour_obj in self.guild_colours(ctx.guild):
             if colour_obj.role.name == role_name:  # If the role colour already exists
                 role = colour_obj.role
                 break
         else:
-            print("Creating Role")
+            log.debug("Creating colour role", guild=ctx.guild.id, role=role_name)
             role = await ctx.guild.create_role(name=role_name, colour=colour_to_object(colour))
             # Moves the new role directly above the colour role.
             # TODO: Use 'await Guild.fetch_roles()'
             await sleep(1)  # Web-socket won't have received the colour role yet, so we wait a second
             try:
-                colour_role = self.get_colour_role(ctx.guild)
+                colour_role = self.bot.config.role(ctx.guild, "colour_role_id")
                 await role.edit(position=colour_role.position)
             except Forbidden:
                 # If role position above bot role position
                 pass
-        await member.add_roles(role)
+        await self.bot.actions.add_roles(member, role)
         return role
 
     @commands.group(invoke_without_command=True)
+    @needs_member_list()
     async def col(self, ctx, member: Member = None):
         if member is None:
             member = ctx.author
-        print(f"Col: {member}")
 
+        em = self.bot.results.get(ctx.guild, "col", member.id)
+        if em is None:
+            em = self.colours_embed(ctx.guild, member)
+            self.bot.results.put(ctx.guild, "col", member.id, em)
+        em = em.copy()
+        em.set_author(name=f"Requested by {str(ctx.author)}", icon_url=str(ctx.author.avatar_url))
+        await ctx.send(embed=em)
+
+    def colours_embed(self, guild, member: Member):
         # Builds string of all custom colours given and received
         em = Embed(title=f"{str(member)}'s custom colours")
 
-        for colour_obj in self.colour_store:
+        colour_store = self.guild_colours(guild)
+        for colour_obj in colour_store:
             if member == colour_obj.to_member and colour_obj.role is not None:
                 em = Embed(title=f"{str(member)}'s custom colours", colour=colour_obj.role.colour)
                 em.add_field(name="Own Colour", value=colour_obj.role.mention)
@@ -342,7 +354,7 @@ class CustomColours(commands.Cog):
                 break
 
         colour_desc = ""
-        for colour_obj in self.colour_store:
+        for colour_obj in colour_store:
             if member == colour_obj.from_member and member != colour_obj.to_member and colour_obj.role is not None:
                 colour_desc += f"{colour_obj.to_member.mention} - {colour_obj.role.mention}\n"
         if colour_desc == "":
@@ -350,24 +362,21 @@ class CustomColours(commands.Cog):
 
         em.add_field(name="Gifted Colours", value=colour_desc, inline=False)
 
-        colour_role = self.get_colour_role(ctx.guild)
+        colour_role = self.bot.config.role(guild, "colour_role_id")
         if colour_role is None:
             colour_text = "None set."
         else:
             colour_text = colour_role.mention
         em.add_field(name="CColour Role", value=colour_text)
-        em.add_field(name="Max colours", value=str(self.get_max_colours(ctx.guild)))
+        em.add_field(name="Max colours", value=str(self.bot.config.value(guild, "max_colours", DEFAULT_MAX_COLOURS)))
 
         em.set_thumbnail(url=str(member.avatar_url))
-        em.set_author(name=f"Requested by {str(ctx.author)}", icon_url=str(ctx.author.avatar_url))
         em.set_footer(text="Sub-commands: add | remove | max | role | [member]")
-
-        await ctx.send(embed=em)
+        return em
 
     @col.command(name="add")
     async def col_add(self, ctx, colour: str, target_member: str = None):
-        colour_role: Role = self.get_colour_role(ctx.guild)
-        print(colour_role)
+        colour_role: Role = self.bot.config.role(ctx.guild, "colour_role_id")
         if colour_role is None:
             await ctx.send("Sorry, this server doesn't have a colour role set up...")
             return
@@ -401,36 +410,40 @@ class CustomColours(commands.Cog):
             return
         # Remove the old colour, if one exists
         if isinstance(old_colour_obj, BoostColour):
-            await old_colour_obj.to_member.remove_roles(old_colour_obj.role)
-            self.colour_store.remove(old_colour_obj)
+            await self.bot.actions.remove_roles(old_colour_obj.to_member, old_colour_obj.role)
+            self.guild_colours(ctx.guild).remove(old_colour_obj)
 
         role = await self.assign_custom_colour(ctx, member_obj, colour)
-        self.colour_store.append(BoostColour(role, ctx.author, member_obj))
+        self.guild_colours(ctx.guild).append(BoostColour(role, ctx.author, member_obj))
+        self.save_guild_colours(ctx.guild)
 
         em = Embed(title="Success!", description=f"I've added {member_obj.mention} to the {role.mention} role.")
         await ctx.send(embed=em)
 
     @col.command(name="remove")
     async def col_remove(self, ctx, target: Member = None):
+        colour_store = self.guild_colours(ctx.guild)
         if target is None:
-            for colour_obj in self.colour_store:
+            for colour_obj in colour_store:
                 if ctx.author == colour_obj.to_member:
                     try:
-                        await ctx.author.remove_roles(colour_obj.role)
+                        await self.bot.actions.remove_roles(ctx.author, colour_obj.role)
                     except HTTPException:
                         # Here the role is already deleted.
                         pass
-                    self.colour_store.remove(colour_obj)
+                    colour_store.remove(colour_obj)
+                    self.save_guild_colours(ctx.guild)
                     await ctx.send("Your role colour has been removed.")
                     break
             else:
                 await ctx.send("You don't have a role colour, so there was nothing to remove.")
             return
 
-        for colour_obj in self.colour_store:
+        for colour_obj in colour_store:
             if target == colour_obj.to_member and ctx.author == colour_obj.from_member:
-                await colour_obj.to_member.remove_roles(colour_obj.role)
-                self.colour_store.remove(colour_obj)
+                await self.bot.actions.remove_roles(colour_obj.to_member, colour_obj.role)
+                colour_store.remove(colour_obj)
+                self.save_guild_colours(ctx.guild)
                 await ctx.send("Role colour removed successfully.")
                 break
         else:
@@ -455,6 +468,8 @@ class CustomColours(commands.Cog):
         else:
             guild_settings["colour_role_id"] = role.id
             await ctx.send(f"Colour role set to {role.mention}")
+            # So on_member_update sees the role being granted and taken away from now on.
+            await ensure_member_list(ctx.guild)
 
     @col.command(name="forceadd")
     @commands.has_guild_permissions(manage_guild=True)
@@ -472,7 +487,8 @@ class CustomColours(commands.Cog):
         colour = get_colour(colour.strip("#"))
 
         role = await self.assign_custom_colour(ctx, member_t, colour)
-        self.colour_store.append(BoostColour(role, member_f, member_t))
+        self.guild_colours(ctx.guild).append(BoostColour(role, member_f, member_t))
+        self.save_guild_colours(ctx.guild)
 
         em = Embed(description=f"I've added {member_t.mention} to the {role.mention} role. (From {member_f.mention})")
         await ctx.send(embed=em)
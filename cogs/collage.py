@@ -1,11 +1,13 @@
 # Generates a collage of size @canvas_w@ * @canvas_h@ with @count@ as an upper bound for the number of members
 from discord.ext import commands
 from discord import File, errors
-from PIL import Image
 from random import shuffle
 from io import BytesIO
 from math import sqrt, ceil, floor
 from os import path, mkdir
+from util.features import needs_member_list
+
+intents = ["members"]
 
 
 class Collage(commands.Cog):
@@ -15,6 +17,7 @@ class Collage(commands.Cog):
     @commands.command(timeout=300.0)
     @commands.has_guild_permissions(manage_guild=True)
     @commands.max_concurrency(1, per=commands.BucketType.guild)
+    @needs_member_list()
     async def collage(self, ctx, count: int = None, canvas_w: int = 1920, canvas_h: int = 1080):
         if count is None:
             count = ctx.guild.member_count // 2
@@ -26,6 +29,8 @@ class Collage(commands.Cog):
             await ctx.send("Your count parameter is greater than the number of members in the server!")
             return
 
+        from PIL import Image  # Imported on first use, as PIL is slow to import and rarely needed
+
         canvas = Image.new('RGBA', (canvas_w, canvas_h))
         step_size = ceil(sqrt((canvas_w * canvas_h) / count))
         img_num_w = floor(canvas_w / step_size)
@@ -58,7 +63,6 @@ class Collage(commands.Cog):
                 try:
                     img = Image.open(BytesIO(await img_asset.read()))  # Sets the image
                 except errors.NotFound:
-                    print("This user does not have an avatar.")
                     continue
 
                 if step_size < size:  # If the image is too big, we want to resize it.
@@ -3,9 +3,11 @@ from discord import Member, Embed
 from typing import Optional
 from random import choice
 from asyncio import TimeoutError
-from aiohttp import ClientSession
-from json import loads
 from re import sub
+from util.logs import get_logger
+
+log = get_logger(__name__)
+intents = ["guild_reactions"]
 
 
 def get_lines(filename):
@@ -13,14 +15,6 @@ def get_lines(filename):
         return file.readlines()
 
 
-async def get_json_content(url):
-    async with ClientSession() as session:
-        async with session.get(url) as resp:
-            print("Response:" + str(resp.status))
-            json_string = await resp.text()
-    return loads(json_string)
-
-
 class Fun(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -49,7 +43,6 @@ class Fun(commands.Cog):
         line = choice(self.murder_lines)
         line = line.replace("<you>", f"**{you.display_name}**")
         line = line.replace("<user>", f"**{target.display_name}**")
-        print(line)
         await ctx.send(line)
 
     @commands.command()
@@ -70,7 +63,7 @@ class Fun(commands.Cog):
 
     async def get_gif(self, tags=None):
         url = f"http://api.giphy.com/v1/gifs/random?api_key={self.bot.giphy_api_key}&tag={tags}"
-        return await get_json_content(url)
+        return await self.bot.web.get_json(url)
 
     @commands.command()
     @commands.cooldown(1, 60.0, type=commands.BucketType.member)
@@ -110,13 +103,9 @@ class Fun(commands.Cog):
             await gif_msg.edit(embed=em)
             await gif_msg.add_reaction('🔄')
 
-            def check(msg_react, msg_user):
-                return msg_user == ctx.author and msg_react.message.id == gif_msg.id and msg_react.emoji == '🔄'
             try:
-                await self.bot.wait_for('reaction_add', timeout=15.0, check=check)
-                print()
+                await self.bot.reactions.wait(gif_msg, emojis=['🔄'], user=ctx.author, timeout=15.0)
             except TimeoutError:
-                print("Timed out")
                 gif_msg = await ctx.channel.fetch_message(gif_msg.id)
                 await gif_msg.clear_reaction('🔄')
                 return
@@ -1,5 +1,9 @@
 import discord
 from discord.ext import commands
+from util.features import needs_member_list
+from util.scheduler import BULK
+
+intents = ["members"]
 
 
 class Manager(commands.Cog):
@@ -9,6 +13,7 @@ class Manager(commands.Cog):
 
     @commands.command(name="roleshift")
     @commands.has_guild_permissions(manage_guild=True)
+    @needs_member_list()
     async def role_shift(self, ctx, old: commands.Greedy[discord.Role], flag: str, new: commands.Greedy[discord.Role]):
         """Moves all members that have at least one of the specified roles role to the other.
         using `>` removes the old role.
@@ -24,17 +29,18 @@ class Manager(commands.Cog):
             for member in role.members:
                 if member not in old_members:
                     old_members.append(member)
-        print(old_members)
 
         msg = await ctx.send("Shifting member roles...")
         total = len(old_members)
+        actions = self.bot.actions
         for num, member in enumerate(old_members):
             if flag in [">", "+"]:
-                await member.add_roles(*new)
+                await actions.add_roles(member, *new, priority=BULK)
             if flag == ">":
-                await member.remove_roles(*old)
-            await msg.edit(content=f"Shifting member roles... [{num}/{total}]")
-        await msg.edit(content=f"Shifted Roles for {total} members.")
+                await actions.remove_roles(member, *old, priority=BULK)
+            # Not awaited: progress edits that pile up behind other jobs are merged into one.
+            actions.edit(msg, priority=BULK, content=f"Shifting member roles... [{num}/{total}]")
+        await actions.edit(msg, content=f"Shifted Roles for {total} members.")
 
     @commands.command(name="clearreact")
     @commands.has_guild_permissions(manage_guild=True)
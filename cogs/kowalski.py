@@ -2,6 +2,9 @@ from discord.ext import commands
 from discord import Member, Embed, Role
 from datetime import datetime
 from util.timeformatter import highest_denom
+from util.features import needs_member_list
+
+intents = ["members"]
 
 
 class Analysis(commands.Cog):
@@ -12,7 +15,6 @@ class Analysis(commands.Cog):
         response = await ctx.send(f"🏓 {message}!")
         diff = response.created_at - ctx.message.created_at
         milliseconds = int(diff.total_seconds() * 1000)
-        print(f"Latency: {milliseconds}ms")
         await response.edit(content=f"🏓 {message}! `{milliseconds}ms`")
 
     @commands.command()
@@ -24,10 +26,20 @@ class Analysis(commands.Cog):
         await self.ping_pong(ctx, "Ping")
 
     @commands.command()
+    @needs_member_list()  # For the join position
     async def profile(self, ctx, member: Member = None):
         if member is None:
             member = ctx.author
 
+        em = self.bot.results.get(ctx.guild, "profile", member.id)
+        if em is None:
+            em = self.profile_embed(member)
+            self.bot.results.put(ctx.guild, "profile", member.id, em)
+        em = em.copy()
+        em.set_author(name=f"Requested by {str(ctx.author)}", icon_url=str(ctx.author.avatar_url))
+        await ctx.send(embed=em)
+
+    def profile_embed(self, member: Member):
         # Embed colour becomes yellow if the account is less than 7 days old.
         create_now_diff = datetime.utcnow() - member.created_at
         if create_now_diff.days < 7:
@@ -39,7 +51,6 @@ class Analysis(commands.Cog):
         em.set_thumbnail(url=str(member.avatar_url))
         em.add_field(name="User ID", value=member.id)
         em.add_field(name="Display Name", value=member.display_name)
-        em.set_author(name=f"Requested by {str(ctx.author)}", icon_url=str(ctx.author.avatar_url))
         create_join_diff = member.joined_at - member.created_at
 
         notes = [f"Account is about {highest_denom(create_now_diff)} old.",
@@ -67,14 +78,18 @@ class Analysis(commands.Cog):
 
         em.add_field(name="Roles", value=role_str, inline=False)
         em.set_footer(text="All times in UTC | Date format: dd/mm/yy")
-        await ctx.send(embed=em)
+        return em
 
     @commands.command()
+    @needs_member_list()
     async def roleinfo(self, ctx, role: Role = None):
         if role is None:
-            role_list = sorted(ctx.guild.roles, key=lambda x: len(x.members), reverse=True)
-            role_strings = [f"{role.mention} | {len(role.members)} members" for role in role_list]
-            em = Embed(description="\n".join(role_strings[:15]))
+            em = self.bot.results.get(ctx.guild, "roleinfo")
+            if em is None:
+                role_list = sorted(ctx.guild.roles, key=lambda x: len(x.members), reverse=True)
+                role_strings = [f"{role.mention} | {len(role.members)} members" for role in role_list]
+                em = Embed(description="\n".join(role_strings[:15]))
+                self.bot.results.put(ctx.guild, "roleinfo", None, em)
             await ctx.send(embed=em)
 
 
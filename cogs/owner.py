@@ -0,0 +1,286 @@
+# Diagnostics for whoever runs the bot. Every command here is restricted to the application owner.
+from discord.ext import commands, tasks
+from discord import Embed, File
+from io import BytesIO
+from functools import partial
+from time import perf_counter
+from datetime import datetime
+from os import path, makedirs, replace
+from util.watchdog import PROJECT_ROOT
+from util.profiler import sample_stacks, to_collapsed, to_speedscope
+from util.logs import set_level
+from util.memory import AllocationTracker, cog_sizes
+import logging
+
+
+class Owner(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.allocations = AllocationTracker()
+        self.write_metrics.start()
+
+    def cog_unload(self):
+        self.write_metrics.cancel()
+
+    def metrics_path(self):
+        # One file per process, so shard processes started by launcher.py don't overwrite each other.
+        if self.bot.shard_ids is None:
+            return "metrics/6thbot.prom"
+        return f"metrics/6thbot-shards-{self.bot.shard_ids[0]}-{self.bot.shard_ids[-1]}.prom"
+
+    @tasks.loop(minutes=1)
+    async def write_metrics(self):
+        text = self.bot.stats.to_prometheus()  # Rendered here, so the histograms can't change mid-write
+        await self.bot.loop.run_in_executor(None, write_atomic, self.metrics_path(), text)
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.command(name="msgstats")
+    async def message_stats(self, ctx):
+        """Shows how many messages the on_message prefilter let through to the command parser."""
+        counts = self.bot.prefilter.counts
+        seen = counts["seen"] or 1
+        em = Embed(title="Message Prefilter", colour=0xFA8072)
+        em.add_field(name="Seen", value=str(counts["seen"]))
+        em.add_field(name="Passed", value=str(counts["passed"]))
+        em.add_field(name="Rejected", value="{} ({:.1%})".format(counts["rejected"], counts["rejected"] / seen))
+        await ctx.send(embed=em)
+
+    @commands.command()
+    async def reload(self, ctx, name: str):
+        """Reloads a single cog from disk, without restarting the bot.
+
+        reload [name] --> e.g. `reload quiz` reloads cogs/quiz.py
+        """
+        start = perf_counter()
+        try:
+            self.bot.reload_extension(f"cogs.{name}")
+        except commands.ExtensionNotLoaded:
+            await ctx.send(f"There's no loaded cog called `{name}`.")
+            return
+        except commands.ExtensionFailed as e:
+            # reload_extension puts the old version back if the new one fails.
+            await ctx.send(f"Couldn't reload `{name}`, so the old version is still running: `{e.original}`")
+            return
+        await ctx.send(f"Reloaded `{name}` in {(perf_counter() - start) * 1000:.0f}ms.")
+
+    @commands.command(name="loglevel")
+    async def log_level(self, ctx, logger: str = "root", level: str = None):
+        """Shows or changes a logger's level, until the bot restarts.
+
+        loglevel [logger] [level] --> e.g. `loglevel cogs.quiz debug`. Set them permanently in json/logging.json.
+        """
+        if level is not None:
+            if level.upper() not in ("DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"):
+                await ctx.send("The level has to be one of `debug`, `info`, `warning`, `error` or `critical`.")
+                return
+            set_level(logger, level)
+        current = (logging.getLogger() if logger == "root" else logging.getLogger(logger)).getEffectiveLevel()
+        await ctx.send(f"`{logger}` logs at `{logging.getLevelName(current).lower()}` and above.")
+
+    @commands.command(name="loadtimes")
+    async def load_times(self, ctx):
+        """Shows how long each cog took to import and set up at startup."""
+        lines = [f"`{name}` | {import_secs * 1000:.0f}ms import, {setup_secs * 1000:.0f}ms setup"
+                 for name, (import_secs, setup_secs) in self.bot.extension_timings.items()]
+        total = sum(sum(timing) for timing in self.bot.extension_timings.values())
+        em = Embed(title="Extension Load Times", colour=0xFA8072, description="\n".join(lines) or "None loaded.")
+        em.set_footer(text=f"Total: {total * 1000:.0f}ms")
+        await ctx.send(embed=em)
+
+    @commands.command(name="reactstats")
+    async def reaction_stats(self, ctx):
+        """Shows how many messages are currently waiting for reactions."""
+        await ctx.send(f"{self.bot.reactions.active} active reaction registrations.")
+
+    @commands.command(name="cachestats")
+    async def cache_stats(self, ctx):
+        """Shows how often read-only commands and Steam lookups were answered from their caches."""
+        results = self.bot.results
+        em = Embed(title="Result Cache", colour=0xFA8072,
+                   description=f"Entries: **{results.size}** | Hit rate: **{results.hit_rate():.1%}**")
+        for command in sorted(set(results.hits) | set(results.misses)):
+            em.add_field(name=command, value=f"{results.hits[command]} hits | {results.misses[command]} misses | "
+                                             f"{results.hit_rate(command):.1%}")
+        api = self.bot.get_cog("API")
+        for name, cache in (api.caches.items() if api is not None else ()):
+            em.add_field(name=name, value=f"{cache.hits} hits | {cache.misses} misses | {cache.hit_rate:.1%} | "
+                                          f"{len(cache)} entries")
+        await ctx.send(embed=em)
+
+    @commands.command()
+    async def queues(self, ctx):
+        """Shows the outbound action queues: jobs waiting, jobs run and how long they waited."""
+        depth = self.bot.actions.depth()
+        lines = []
+        for bucket, stats in sorted(self.bot.actions.stats.items(), key=lambda t: t[1].max_wait, reverse=True)[:15]:
+            kind, snowflake = bucket
+            lines.append(f"`{kind}:{snowflake}` | {depth.get(bucket, 0)} queued | "
+                         f"{stats.completed} done, {stats.failed} failed, {stats.coalesced} merged | "
+                         f"wait {stats.mean_wait * 1000:.0f}ms avg, {stats.max_wait * 1000:.0f}ms max")
+        em = Embed(title="Action Queues", colour=0xFA8072, description="\n".join(lines) or "Nothing scheduled yet.")
+        em.set_footer(text=f"{sum(depth.values())} jobs queued across {len(depth)} buckets")
+        await ctx.send(embed=em)
+
+    @commands.command(name="stats")
+    async def show_stats(self, ctx, kind: str = "command"):
+        """Shows latency percentiles for the slowest commands, events or HTTP calls.
+
+        stats [kind] --> kind is one of command, event, http, discord or loop.
+        """
+        histograms = [(name, histogram) for (hist_kind, name), histogram in self.bot.stats.by_name.items()
+                      if hist_kind == kind]
+        histograms.sort(key=lambda t: t[1].quantile(0.99), reverse=True)
+        lines = [f"`{name}` | {histogram.count} calls, {histogram.errors} errors | "
+                 f"p50 {histogram.quantile(0.5) * 1000:.0f}ms, p99 {histogram.quantile(0.99) * 1000:.0f}ms"
+                 for name, histogram in histograms[:15]]
+        em = Embed(title=f"Latency | {kind}", colour=0xFA8072, description="\n".join(lines) or "Nothing timed yet.")
+        guild_histogram = self.bot.stats.by_guild.get((kind, ctx.guild.id))
+        if guild_histogram is not None:
+            em.add_field(name="This server", value=f"{guild_histogram.count} calls, "
+                                                   f"p99 {guild_histogram.quantile(0.99) * 1000:.0f}ms")
+        if kind == "http":
+            web = self.bot.web
+            shared = [f"`{host}` | {web.coalesced[host]} of {web.requests[host] + web.coalesced[host]}"
+                      for host in sorted(web.coalesced)]
+            em.add_field(name="Shared an identical request", value="\n".join(shared) or "None yet.", inline=False)
+            health = []
+            for host, breaker in sorted(web.breakers.items()):
+                state = f"{breaker.state}, retrying in {breaker.retry_in:.0f}s" if breaker.retry_in else breaker.state
+                error = f" | last error: {breaker.last_error}" if breaker.failures else ""
+                health.append(f"`{host}` | **{state}** | {breaker.failures} failures in a row{error} | "
+                              f"{web.stale[host]} stale | {web.hedged[host]} hedged")
+            em.add_field(name="Upstream health", value="\n".join(health) or "No requests yet.", inline=False)
+        em.set_footer(text="Sorted by p99 | Kinds: command, event, http, discord, loop")
+        await ctx.send(embed=em)
+
+    @commands.command()
+    async def lag(self, ctx, num: int = 5):
+        """Shows the event loop's lag, and the most recent stalls along with the code that caused them."""
+        watchdog = self.bot.watchdog
+        em = Embed(title="Event Loop Lag", colour=0xFA8072,
+                   description=f"Last: **{watchdog.last_lag * 1000:.0f}ms** | Max: **{watchdog.max_lag * 1000:.0f}ms** "
+                               f"| Stalls over {watchdog.threshold * 1000:.0f}ms: **{len(watchdog.stalls)}**")
+        for stall in list(watchdog.stalls)[-num:]:
+            # Only the frames from the bot itself, innermost last, as the rest is library code.
+            frames = [f"{frame.filename.rsplit('/', 1)[-1]}:{frame.lineno} {frame.name}" for frame in stall.stack
+                      if frame.filename.startswith(PROJECT_ROOT)][-4:]
+            em.add_field(name=f"{stall.lag * 1000:.0f}ms | {stall.culprit} | {stall.time.strftime('%H:%M:%S')}",
+                         value="```\n" + ("\n".join(frames) or "No bot frames") + "\n```", inline=False)
+        em.set_footer(text="All times in UTC")
+        await ctx.send(embed=em)
+
+    @commands.command()
+    async def traces(self, ctx, num: int = 5):
+        """Shows the slowest recent commands (and slow events), broken down into the calls made under them.
+
+        traces [num] --> every trace is also written to logs/traces.jsonl
+        """
+        tracer = self.bot.tracer
+        em = Embed(title="Slowest Traces", colour=0xFA8072,
+                   description=f"The slowest {min(num, 10)} of the last {len(tracer.recent)} traces")
+        for root in tracer.slowest(min(num, 10)):
+            lines = []
+            for depth, span in root.walk():
+                if depth == 0:
+                    continue
+                error = f" ({span.error})" if span.error else ""
+                lines.append(f"{'  ' * (depth - 1)}+{(span.start - root.start) * 1000:.0f}ms "
+                             f"{span.duration * 1000:.0f}ms {span.name}{error}")
+            value = "\n".join(lines) or "No calls made"
+            if len(value) > 1000:
+                value = value[:997] + "..."
+            error = f" | {root.error}" if root.error else ""
+            em.add_field(name=f"{root.duration * 1000:.0f}ms | {root.kind} {root.name}{error} | "
+                              f"{datetime.utcfromtimestamp(root.start_time).strftime('%H:%M:%S')}",
+                         value=f"```\n{value}\n```", inline=False)
+        em.set_footer(text="All times in UTC")
+        await ctx.send(embed=em)
+
+    @commands.command()
+    async def memory(self, ctx, action: str = None):
+        """Shows roughly how much memory each cog's attributes hold, and which lines have been allocating.
+
+        memory [start|stop] --> allocation tracing slows the bot down a little, so it's only on between the two.
+        Each `memory` while tracing also shows what grew since the last one.
+        """
+        tracker = self.allocations
+        if action == "start":
+            tracker.start()
+            await ctx.send("Allocation tracing started - use `memory` to take a snapshot.")
+            return
+        if action == "stop":
+            tracker.stop()
+            await ctx.send("Allocation tracing stopped.")
+            return
+
+        em = Embed(title="Memory", colour=0xFA8072)
+        bot = self.bot
+        em.add_field(name="Discord Cache", inline=False,
+                     value=f"{sum(len(guild.members) for guild in bot.guilds):,} members | {len(bot.users):,} users | "
+                           f"{len(bot.cached_messages):,} messages | {len(bot.guilds):,} guilds")
+        for cog_name, attributes in (await cog_sizes(self.bot)).items():
+            lines = [f"{attribute}: {size / 1024:,.0f}KiB ({objects:,} objects{'+' if truncated else ''})"
+                     for attribute, size, objects, truncated in attributes[:6]]
+            em.add_field(name=cog_name, value="\n".join(lines) or "No attributes", inline=False)
+
+        if not tracker.tracing:
+            em.set_footer(text="Allocation tracing is off - use `memory start` to see allocation sites.")
+            await ctx.send(embed=em)
+            return
+        top, diff, total = await self.bot.loop.run_in_executor(None, tracker.snapshot)
+        em.description = f"Traced: **{total / 1024 ** 2:,.1f}MiB**"
+        em.add_field(name="Top Allocation Sites", inline=False,
+                     value="\n".join(f"`{stat.size / 1024:,.0f}KiB` {_site(stat)}" for stat in top) or "Nothing traced yet")
+        if diff is None:
+            em.set_footer(text="Run again to see what's grown since this snapshot.")
+        elif diff:
+            em.add_field(name="Since Last Snapshot", inline=False,
+                         value="\n".join(f"`{stat.size_diff / 1024:+,.0f}KiB` {_site(stat)}" for stat in diff))
+        await ctx.send(embed=em)
+
+    @commands.command(name="cpuprofile")
+    @commands.max_concurrency(1)
+    async def cpu_profile(self, ctx, seconds: float = 10.0, file_format: str = "collapsed"):
+        """Samples every thread's stack while the bot carries on as normal, then uploads the result.
+
+        cpuprofile [seconds] [collapsed|speedscope] --> open the file in speedscope.app, or run flamegraph.pl on it.
+        """
+        if not 0 < seconds <= 120:
+            await ctx.send("You can profile for up to 120 seconds.")
+            return
+        if file_format not in ("collapsed", "speedscope"):
+            await ctx.send("The format has to be `collapsed` or `speedscope`.")
+            return
+        interval = 0.005
+        await ctx.send(f"Profiling for {seconds:g} seconds...")
+        # Sampling happens on an executor thread, so the loop being profiled keeps running meanwhile.
+        samples = await self.bot.loop.run_in_executor(None, partial(sample_stacks, seconds, interval))
+        if file_format == "speedscope":
+            text, filename = to_speedscope(samples, interval), "profile.speedscope.json"
+        else:
+            text, filename = to_collapsed(samples), "profile.collapsed.txt"
+        total = sum(samples.values())
+        await ctx.send(f"{total} stacks sampled across {len({stack[0] for stack in samples})} threads.",
+                       file=File(BytesIO(text.encode("utf-8")), filename=filename))
+
+
+def _site(stat) -> str:
+    # The line that made the allocation, relative to the project if it's in it.
+    frame = stat.traceback[0]
+    filename = path.relpath(frame.filename, PROJECT_ROOT) if frame.filename.startswith(PROJECT_ROOT) else \
+        path.basename(frame.filename)
+    return f"{filename}:{frame.lineno}"
+
+
+def write_atomic(filename, text):
+    # Written to a temporary file first, so a scraper never reads half a file.
+    makedirs(path.dirname(filename), exist_ok=True)
+    with open(filename + ".tmp", "w", encoding="utf-8") as file:
+        file.write(text)
+    replace(filename + ".tmp", filename)
+
+
+def setup(bot):
+    bot.add_cog(Owner(bot))
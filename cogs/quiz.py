@@ -3,23 +3,20 @@ from discord.ext import commands
 from discord import Embed, Reaction, Message
 from asyncio import sleep
 from random import shuffle
-from json import loads
 from html import unescape
-from aiohttp import ClientSession
+from util.features import needs_member_list
+from util.scheduler import BULK
+from util.logs import get_logger
 
+log = get_logger(__name__)
+intents = ["members", "guild_reactions"]
+STALE_QUESTIONS = 24 * 3600  # If OpenTDB is down, repeating recent questions beats no quiz
 
-async def get_json_content(url):
-    async with ClientSession() as session:
-        async with session.get(url) as resp:
-            print("Response:" + str(resp.status))
-            json_string = await resp.text()
-    return loads(json_string)
 
-
-async def get_questions(difficulty, amount):
+async def get_questions(web, difficulty, amount):
     # Note: Disproportionately large number of questions in the 'Entertainment: Video Games' category
     url = f"https://opentdb.com/api.php?amount={amount}&type=multiple&difficulty={difficulty}"
-    data = await get_json_content(url)
+    data = await web.get_json(url, stale=STALE_QUESTIONS)
     return [quest for quest in data['results']]
 
 
@@ -110,20 +107,14 @@ class Quiz(commands.Cog):
         self.option_emojis = ["🇦", "🇧", "🇨", "🇩"]  # Note: These are regional indicator emojis
         self.active_quiz_data = {}  # {[svr_id]: QuizData}
 
-    @commands.Cog.listener()
-    async def on_reaction_add(self, reaction: Reaction, user):
-        if user.bot:
-            return
+    async def record_answer(self, reaction: Reaction, user):
+        # Only called for reactions on the quiz message, while its quiz is running
         guild_quiz_data: QuizData = self.active_quiz_data.get(reaction.message.guild.id, None)
-
-        # Checks if a quiz is running, and that this is the correct message
         if guild_quiz_data is None:
             return
-        elif guild_quiz_data.message.id != reaction.message.id:
-            return
 
         guild_quiz_data.set_answer(user.id, reaction.emoji)  # change emote
-        await reaction.remove(user)
+        self.bot.actions.remove_reaction(reaction, user, priority=BULK)  # Behind the option reactions and edits
 
     async def setup_quiz(self, ctx, rounds: int) -> QuizData:
         em = Embed(
@@ -165,16 +156,17 @@ class Quiz(commands.Cog):
             em.add_field(name=self.option_emojis[i], value=unescape(options[i]), inline=False)
             if options[i] == question['correct_answer']:
                 correct_idx = i
-            await quiz_msg.add_reaction(self.option_emojis[i])
+            self.bot.actions.add_reaction(quiz_msg, self.option_emojis[i])
 
         # 5 second decrements give rough indicator of time remaining - frequent edits would increase latency.
         for i in range(3):
-            await quiz_msg.edit(
+            await self.bot.actions.edit(
+                quiz_msg,
                 content=f":alarm_clock: You have {15 - (i * 5)} Seconds to answer this question",
                 embed=em
             )
             await sleep(5)
-        await quiz_msg.edit(content="\n:alarm_clock: Time's up!")
+        await self.bot.actions.edit(quiz_msg, content="\n:alarm_clock: Time's up!")
         return correct_idx
 
     async def update_standings(self, ctx, correct_idx, correct_ans, question_no, rounds):
@@ -203,7 +195,7 @@ class Quiz(commands.Cog):
             if score_data.curr_streak > 1:
                 slot += f" **🔥 {score_data.curr_streak}**"
             elif score_data.streak_reset:
-                slot += f" **🧯 0**"
+                slot += " **🧯 0**"
             slots.append(slot)
             pos += 1
 
@@ -219,8 +211,8 @@ class Quiz(commands.Cog):
 
         # Get message by id again, as reaction data is not updated
         quiz_msg = await ctx.channel.fetch_message(quiz_data.message.id)
-        await quiz_msg.clear_reactions()
-        await quiz_msg.edit(embed=em)
+        await self.bot.actions.clear_reactions(quiz_msg)
+        await self.bot.actions.edit(quiz_msg, embed=em)
         await sleep(5)
 
     async def final_standings(self, ctx, rounds):
@@ -261,6 +253,7 @@ class Quiz(commands.Cog):
 
     @commands.command()
     @commands.max_concurrency(1, per=commands.BucketType.guild)
+    @needs_member_list()  # Players are looked up by id to mention them
     async def quiz(self, ctx, rounds: int = 5):
         if not 1 <= rounds <= 15:
             # Technically 150 is the limit, but it gets very boring.
@@ -270,30 +263,42 @@ class Quiz(commands.Cog):
         # Tries to fetch similar number of questions for each difficulty. Remainder precedence Medium, Hard, Easy
         questions = []
         quotient, remainder = divmod(rounds, 3)
-        questions += await get_questions("easy", quotient)
-        questions += await get_questions("medium", quotient + (remainder != 0))
-        questions += await get_questions("hard", quotient + (remainder == 2))
-
-        await self.setup_quiz(ctx, rounds)
-        await sleep(10)
-
-        for question_no in range(rounds):
-            question = questions[question_no]
-            correct_idx = await self.serve_question(ctx, question, question_no, rounds)
-            await self.update_standings(ctx, correct_idx, unescape(question['correct_answer']), question_no, rounds)
-
-        await self.final_standings(ctx, rounds)
+        questions += await get_questions(self.bot.web, "easy", quotient)
+        questions += await get_questions(self.bot.web, "medium", quotient + (remainder != 0))
+        questions += await get_questions(self.bot.web, "hard", quotient + (remainder == 2))
+
+        quiz_data = await self.setup_quiz(ctx, rounds)
+        try:
+            # Each round takes about 20 seconds, so the timeout only matters if the quiz never finishes.
+            handle = self.bot.reactions.subscribe(quiz_data.message, self.record_answer, timeout=60 + rounds * 60)
+            try:
+                await sleep(10)
+
+                for question_no in range(rounds):
+                    question = questions[question_no]
+                    correct_idx = await self.serve_question(ctx, question, question_no, rounds)
+                    await self.update_standings(ctx, correct_idx, unescape(question['correct_answer']),
+                                                question_no, rounds)
+            finally:
+                self.bot.reactions.unsubscribe(handle)
+
+            await self.final_standings(ctx, rounds)
+        finally:
+            # Otherwise every finished quiz is kept until the bot restarts.
+            del self.active_quiz_data[ctx.guild.id]
 
     @quiz.error
     async def quiz_error(self, ctx, error):
         if isinstance(error, commands.MaxConcurrencyReached):
-            message = self.active_quiz_data[ctx.guild.id].message
+            quiz_data = self.active_quiz_data.get(ctx.guild.id)
+            if quiz_data is None:  # The other quiz is still fetching its questions
+                await ctx.send("Only one quiz can be active at once.", delete_after=30.0)
+                return
             await ctx.send(f"Only one quiz can be active at once. "
-                           f"You can find the current game here:\n{message.jump_url}", delete_after=30.0)
+                           f"You can find the current game here:\n{quiz_data.message.jump_url}", delete_after=30.0)
         elif isinstance(error, commands.UserInputError):
             await ctx.send("Make sure to specify a *positive number* of rounds.")
-        else:
-            print(error)
+        # Anything else is logged by on_command_error, which runs as well as this.
 
 
 def setup(bot):
@@ -5,6 +5,8 @@ from asyncio import sleep
 from util.timeformatter import highest_denom
 from typing import Union
 
+intents = ["members"]
+
 
 class Filter(commands.Cog):
     def __init__(self, bot):
@@ -15,53 +17,14 @@ class Filter(commands.Cog):
         :param guild: a discord.Guild object
         :return: the filter time, in seconds.
         """
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        return 60 * guild_settings.get("filter_time", 15)
-
-    def get_filter_role(self, guild: Guild):
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        filter_role_id = guild_settings.get("filter_role_id", None)
-        if filter_role_id is None:
-            return None
-        return guild.get_role(filter_role_id)
-
-    def get_new_acc_role(self, guild: Guild):
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        new_acc_role_id = guild_settings.get("new_acc_role_id", None)
-        if new_acc_role_id is None:
-            return None
-        return guild.get_role(new_acc_role_id)
-
-    def get_manual_chl(self, guild: Guild):
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        manual_chl_id = guild_settings.get("manual_chl_id", None)
-        if manual_chl_id is None:
-            return None
-        return guild.get_channel(manual_chl_id)
-
-    def get_manual_content(self, guild: Guild):
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        return guild_settings.get("manual_content", None)
-
-    def get_welcome_chl(self, guild: Guild):
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        welcome_chl_id = guild_settings.get("welcome_chl_id", None)
-        if welcome_chl_id is None:
-            return None
-        return guild.get_channel(welcome_chl_id)
-
-    def is_manual(self, guild: Guild) -> bool:
-        guild_settings = self.bot.guild_settings[str(guild.id)]
-        return guild_settings.get("manual", False)
-        # could replace presence check with something else?
+        return 60 * self.bot.config.value(guild, "filter_time", 15)
 
     async def send_welcomes(self, member):
-        guild_settings = self.bot.guild_settings[str(member.guild.id)]
-        welcome_messages: dict = guild_settings['welcome_messages']
+        welcome_messages: dict = self.bot.config.value(member.guild, "welcome_messages", {})
 
         filter_secs = self.get_filter_time(member.guild)
         # Manual verification text
-        if self.is_manual(member.guild):
+        if self.bot.config.value(member.guild, "manual", False):
             text = "We're in manual verification, so you'll need to **__contact a member of staff__** to get verified."
         else:
 
@@ -91,19 +54,19 @@ class Filter(commands.Cog):
         guild: Guild = member.guild
 
         # Adds the filter role, if one exists
-        filter_role = self.get_filter_role(guild)
+        filter_role = self.bot.config.role(guild, "filter_role_id")
         if filter_role is not None:
             await member.add_roles(filter_role)
 
         create_now_diff = datetime.utcnow() - member.created_at
         if create_now_diff.days < 14:
-            new_acc_role = self.get_new_acc_role(guild)
+            new_acc_role = self.bot.config.role(guild, "new_acc_role_id")
             if new_acc_role is not None:
                 await member.add_roles(new_acc_role)
 
         await self.send_welcomes(member)
 
-        if not self.is_manual(guild) and filter_role is not None:
+        if not self.bot.config.value(guild, "manual", False) and filter_role is not None:
             # Schedule Role removal
             filter_secs = self.get_filter_time(member.guild)
             await sleep(filter_secs)
@@ -113,12 +76,12 @@ class Filter(commands.Cog):
     @commands.group(invoke_without_command=True)
     @commands.has_guild_permissions(manage_roles=True)
     async def manual(self, ctx):
-        if self.is_manual(ctx.guild):
+        if self.bot.config.value(ctx.guild, "manual", False):
             toggle_text = "Enabled"
         else:
             toggle_text = "Disabled"
 
-        man_chl = self.get_manual_chl(ctx.guild)
+        man_chl = self.bot.config.channel(ctx.guild, "manual_chl_id")
         if man_chl is None:
             chl_text = "None set."
         else:
@@ -136,11 +99,11 @@ class Filter(commands.Cog):
     async def manual_on(self, ctx):
         guild_settings = self.bot.guild_settings[str(ctx.guild.id)]
 
-        man_chl = self.get_manual_chl(ctx.guild)
+        man_chl = self.bot.config.channel(ctx.guild, "manual_chl_id")
         if man_chl is None:
             ctx.send("No manual channel has been set.")
             return
-        content = self.get_manual_content(ctx.guild)
+        content = self.bot.config.value(ctx.guild, "manual_content")
         if content is None:
             ctx.send("No manual message has been set.")
             return
@@ -153,7 +116,7 @@ class Filter(commands.Cog):
     @commands.has_guild_permissions(manage_roles=True)
     async def manual_off(self, ctx):
         guild_settings = self.bot.guild_settings[str(ctx.guild.id)]
-        man_chl = self.get_manual_chl(ctx.guild)
+        man_chl = self.bot.config.channel(ctx.guild, "manual_chl_id")
         guild_settings.pop('manual', None)
         man_msg_id = guild_settings.pop('man_msg_id', None)
         if man_msg_id is not None:
@@ -176,7 +139,7 @@ class Filter(commands.Cog):
     @manual.command(name="message")
     @commands.has_guild_permissions(manage_roles=True)
     async def manual_message(self, ctx):
-        content = self.get_manual_content(ctx.guild)
+        content = self.bot.config.value(ctx.guild, "manual_content")
         if content is None:
             ctx.send("No manual message has been set.")
             return
@@ -185,8 +148,7 @@ class Filter(commands.Cog):
     @commands.group(invoke_without_command=True)
     @commands.has_guild_permissions(manage_roles=True)
     async def welcome(self, ctx, name: str = None):
-        guild_settings: dict = self.bot.guild_settings[str(ctx.guild.id)]
-        welcome_messages: dict = guild_settings.get("welcome_messages", {})
+        welcome_messages: dict = self.bot.config.value(ctx.guild, "welcome_messages", {})
 
         # Name specified
         if name is not None:
@@ -218,7 +180,7 @@ class Filter(commands.Cog):
         em.set_author(name=f"Requested by {str(ctx.author)}", icon_url=str(ctx.author.avatar_url))
         em.set_thumbnail(url=str(ctx.guild.icon_url))
 
-        filter_role = self.get_filter_role(ctx.guild)
+        filter_role = self.bot.config.role(ctx.guild, "filter_role_id")
         if filter_role is None:
             role_text = "None set."
         else:
@@ -228,7 +190,7 @@ class Filter(commands.Cog):
         filter_secs = self.get_filter_time(ctx.guild)
         em.add_field(name="Filter Timer", value=highest_denom(filter_secs))
 
-        restrict_role = self.get_new_acc_role(ctx.guild)
+        restrict_role = self.bot.config.role(ctx.guild, "new_acc_role_id")
         if restrict_role is None:
             role_text = "None set."
         else:
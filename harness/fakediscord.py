@@ -0,0 +1,296 @@
+# A local stand-in for Discord's gateway and REST API, good enough for discord.py to log in, receive the synthetic
+# guilds and run commands against them. REST calls that change something are echoed back over the gateway, as
+# Discord does, so the bot's caches (and its event handlers) see their effects.
+from aiohttp import web, WSMsgType
+from collections import Counter, deque
+from datetime import datetime
+from json import dumps, loads
+from harness.world import BOT_USER_ID, Snowflakes, user_payload
+from util.sharding import shard_for
+import asyncio
+
+HEARTBEAT_INTERVAL = 41250  # Milliseconds, what Discord sends
+CHUNK_SIZE = 1000  # Members per GUILD_MEMBERS_CHUNK, as on Discord
+
+
+def _not_found():
+    return web.Response(status=404, body=dumps({"message": "Unknown Message", "code": 10008}).encode("utf-8"),
+                        headers={"Content-Type": "application/json"})
+
+
+class FakeDiscord:
+    """
+    Serves the gateway at /gateway and the REST API under /api/v7
+    :param guilds: FakeGuilds from harness.world
+    :param rest_latency: seconds to wait before answering each REST call, to stand in for the round trip
+    """
+    def __init__(self, guilds, shard_count: int = 1, rest_latency: float = 0.0, host: str = "127.0.0.1"):
+        self.guilds = {guild.id: guild for guild in guilds}
+        self.shard_count = shard_count
+        self.rest_latency = rest_latency
+        self.host = host
+        self.port = None
+        self.requests = Counter()  # {"METHOD /route": calls}
+        self.recent_messages = deque(maxlen=500)  # (guild_id, channel_id, message_id), for reactions to target
+        self.last_request = 0.0  # Loop time of the last REST call, to tell when the bot has gone quiet
+        self.ready = asyncio.Event()  # Set once every shard has been sent its guilds
+        self._sockets = {}  # {shard_id: WebSocketResponse}
+        self._sequences = Counter()  # {shard_id: last sequence number}
+        self._messages = {}  # {message_id: payload}
+        self.snowflake = Snowflakes(datetime.utcnow())
+        self._runner = None
+
+    @property
+    def api_url(self) -> str:
+        return f"http://{self.host}:{self.port}/api/v7"
+
+    @property
+    def gateway_url(self) -> str:
+        return f"ws://{self.host}:{self.port}/gateway"
+
+    async def start(self):
+        app = web.Application(client_max_size=0)
+        app.router.add_get("/gateway", self.gateway)
+        routes = [
+            ("GET", "/users/@me", self.get_me),
+            ("GET", "/gateway", self.get_gateway),
+            ("GET", "/gateway/bot", self.get_gateway),
+            ("GET", "/oauth2/applications/@me", self.get_application),
+            ("POST", "/channels/{channel_id}/messages", self.create_message),
+            ("GET", "/channels/{channel_id}/messages/{message_id}", self.get_message),
+            ("PATCH", "/channels/{channel_id}/messages/{message_id}", self.edit_message),
+            ("DELETE", "/channels/{channel_id}/messages/{message_id}", self.delete_message),
+            ("PUT", "/channels/{channel_id}/messages/{message_id}/reactions/{emoji}/@me", self.add_reaction),
+            ("PUT", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.add_member_role),
+            ("DELETE", "/guilds/{guild_id}/members/{user_id}/roles/{role_id}", self.remove_member_role),
+            ("POST", "/guilds/{guild_id}/roles", self.create_role),
+            ("PATCH", "/guilds/{guild_id}/roles", self.move_role),
+            ("PATCH", "/guilds/{guild_id}/roles/{role_id}", self.edit_role),
+            ("DELETE", "/guilds/{guild_id}/roles/{role_id}", self.delete_role),
+        ]
+        for method, path, handler in routes:
+            app.router.add_route(method, "/api/v7" + path, self._rest(handler))
+        # Anything else (typing, removing reactions...) just succeeds.
+        app.router.add_route("*", "/api/v7/{tail:.*}", self._rest(self.no_content))
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, 0)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        for ws in list(self._sockets.values()):
+            await ws.close()
+        await self._runner.cleanup()
+
+    # Gateway
+
+    async def send(self, shard_id: int, payload: dict):
+        ws = self._sockets.get(shard_id)
+        if ws is None or ws.closed:
+            return
+        await ws.send_str(dumps(payload))
+
+    async def dispatch(self, event: str, data: dict, guild_id: int = None):
+        """Sends a DISPATCH to the shard the guild is on, or every shard without a guild."""
+        shard_ids = range(self.shard_count) if guild_id is None else [shard_for(guild_id, self.shard_count)]
+        for shard_id in shard_ids:
+            await self.dispatch_to_shard(shard_id, event, data)
+
+    async def dispatch_to_shard(self, shard_id: int, event: str, data: dict):
+        self._sequences[shard_id] += 1
+        await self.send(shard_id, {"op": 0, "t": event, "s": self._sequences[shard_id], "d": data})
+
+    async def gateway(self, request):
+        ws = web.WebSocketResponse(max_msg_size=0)
+        await ws.prepare(request)
+        await ws.send_str(dumps({"op": 10, "d": {"heartbeat_interval": HEARTBEAT_INTERVAL}}))
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            payload = loads(msg.data)
+            op, data = payload.get("op"), payload.get("d")
+            if op == 1:  # Heartbeat
+                await ws.send_str(dumps({"op": 11}))
+            elif op == 2:  # Identify
+                shard_id = (data.get("shard") or [0, 1])[0]
+                self._sockets[shard_id] = ws
+                await self.identified(shard_id)
+            elif op == 8:  # Request guild members
+                await self.send_chunks(data)
+        return ws
+
+    async def identified(self, shard_id: int):
+        guilds = [guild for guild in self.guilds.values() if shard_for(guild.id, self.shard_count) == shard_id]
+        self._sequences[shard_id] = 0
+        await self.dispatch_to_shard(shard_id, "READY", {
+            "v": 6, "user": user_payload(BOT_USER_ID, "6thBot", bot=True), "private_channels": [],
+            "guilds": [{"id": str(guild.id), "unavailable": True} for guild in guilds],
+            "session_id": f"harness-{shard_id}", "shard": [shard_id, self.shard_count],
+            "application": {"id": str(BOT_USER_ID), "flags": 0},
+        })
+        for guild in guilds:
+            await self.dispatch_to_shard(shard_id, "GUILD_CREATE", guild.create_payload())
+        if len(self._sockets) == self.shard_count:
+            self.ready.set()
+
+    async def send_chunks(self, data: dict):
+        guild = self.guilds.get(int(data["guild_id"]))
+        if guild is None:
+            return
+        members = list(guild.members.values())
+        chunks = [members[start:start + CHUNK_SIZE] for start in range(0, len(members), CHUNK_SIZE)] or [[]]
+        for index, chunk in enumerate(chunks):
+            await self.dispatch("GUILD_MEMBERS_CHUNK", {
+                "guild_id": str(guild.id), "members": chunk, "chunk_index": index, "chunk_count": len(chunks),
+                "nonce": data.get("nonce"),
+            }, guild.id)
+
+    # REST
+
+    def _rest(self, handler):
+        async def counted(request):
+            self.requests[f"{request.method} {request.match_info.route.resource.canonical[len('/api/v7'):]}"] += 1
+            if self.rest_latency:
+                await asyncio.sleep(self.rest_latency)
+            self.last_request = asyncio.get_event_loop().time()
+            result = await handler(request)
+            if result is None:
+                return web.Response(status=204)
+            if isinstance(result, web.StreamResponse):
+                return result
+            # discord.py only decodes JSON if the content type is exactly this, without a charset.
+            return web.Response(body=dumps(result).encode("utf-8"), headers={"Content-Type": "application/json"})
+        return counted
+
+    def _guild_of_channel(self, channel_id: int):
+        for guild in self.guilds.values():
+            if channel_id in guild.channels:
+                return guild
+        return None
+
+    async def no_content(self, request):
+        return None
+
+    async def get_me(self, request):
+        return user_payload(BOT_USER_ID, "6thBot", bot=True)
+
+    async def get_gateway(self, request):
+        return {"url": self.gateway_url, "shards": self.shard_count,
+                "session_start_limit": {"total": 1000, "remaining": 1000, "reset_after": 0, "max_concurrency": 1}}
+
+    async def get_application(self, request):
+        return {"id": str(BOT_USER_ID), "name": "6thBot", "icon": None, "description": "", "rpc_origins": None,
+                "bot_public": True, "bot_require_code_grant": False, "owner": user_payload(1, "owner"),
+                "summary": "", "verify_key": "", "team": None, "flags": 0}
+
+    async def create_message(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        if request.content_type.startswith("multipart/"):
+            form = await request.post()
+            body = loads(form.get("payload_json", "{}"))
+        else:
+            body = await request.json()
+        guild = self._guild_of_channel(channel_id)
+        message = {
+            "id": str(self.snowflake()), "channel_id": str(channel_id), "type": 0,
+            "author": user_payload(BOT_USER_ID, "6thBot", bot=True), "content": body.get("content") or "",
+            "embeds": [body["embed"]] if body.get("embed") else [], "attachments": [], "mentions": [],
+            "mention_roles": [], "mention_everyone": False, "pinned": False, "tts": False,
+            "timestamp": datetime.utcnow().isoformat() + "+00:00", "edited_timestamp": None,
+        }
+        self._messages[int(message["id"])] = message
+        if guild is not None:
+            message["guild_id"] = str(guild.id)
+            message["member"] = {key: value for key, value in guild.members[BOT_USER_ID].items() if key != "user"}
+            self.recent_messages.append((guild.id, channel_id, int(message["id"])))
+            await self.dispatch("MESSAGE_CREATE", message, guild.id)
+        return message
+
+    async def get_message(self, request):
+        message = self._messages.get(int(request.match_info["message_id"]))
+        if message is None:
+            return _not_found()
+        return message
+
+    async def edit_message(self, request):
+        message = self._messages.get(int(request.match_info["message_id"]))
+        if message is None:
+            return _not_found()
+        body = await request.json()
+        if "content" in body:
+            message["content"] = body["content"] or ""
+        if "embed" in body:
+            message["embeds"] = [body["embed"]] if body["embed"] else []
+        message["edited_timestamp"] = datetime.utcnow().isoformat() + "+00:00"
+        if "guild_id" in message:
+            await self.dispatch("MESSAGE_UPDATE", message, int(message["guild_id"]))
+        return message
+
+    async def delete_message(self, request):
+        message = self._messages.pop(int(request.match_info["message_id"]), None)
+        if message is not None and "guild_id" in message:
+            await self.dispatch("MESSAGE_DELETE", {"id": message["id"], "channel_id": message["channel_id"],
+                                                   "guild_id": message["guild_id"]}, int(message["guild_id"]))
+
+    async def add_reaction(self, request):
+        channel_id = int(request.match_info["channel_id"])
+        guild = self._guild_of_channel(channel_id)
+        if guild is not None:
+            await self.dispatch("MESSAGE_REACTION_ADD", {
+                "user_id": str(BOT_USER_ID), "channel_id": str(channel_id), "guild_id": str(guild.id),
+                "message_id": request.match_info["message_id"],
+                "emoji": {"id": None, "name": request.match_info["emoji"]},
+                "member": guild.members[BOT_USER_ID],
+            }, guild.id)
+
+    async def _member_roles_changed(self, guild, member: dict):
+        await self.dispatch("GUILD_MEMBER_UPDATE", {"guild_id": str(guild.id), **member}, guild.id)
+
+    async def add_member_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        member = guild.members.get(int(request.match_info["user_id"]))
+        if member is not None and request.match_info["role_id"] not in member["roles"]:
+            member["roles"].append(request.match_info["role_id"])
+            await self._member_roles_changed(guild, member)
+
+    async def remove_member_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        member = guild.members.get(int(request.match_info["user_id"]))
+        if member is not None and request.match_info["role_id"] in member["roles"]:
+            member["roles"].remove(request.match_info["role_id"])
+            await self._member_roles_changed(guild, member)
+
+    async def create_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        body = await request.json()
+        role = guild.add_role(self.snowflake(), body.get("name", "new role"), 1, colour=body.get("color", 0),
+                              permissions=int(body.get("permissions", 0)))
+        await self.dispatch("GUILD_ROLE_CREATE", {"guild_id": str(guild.id), "role": role}, guild.id)
+        return role
+
+    async def move_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        for change in await request.json():
+            role = guild.roles.get(int(change["id"]))
+            if role is not None:
+                role["position"] = change["position"]
+                await self.dispatch("GUILD_ROLE_UPDATE", {"guild_id": str(guild.id), "role": role}, guild.id)
+        return list(guild.roles.values())
+
+    async def edit_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        role = guild.roles[int(request.match_info["role_id"])]
+        role.update(await request.json())
+        await self.dispatch("GUILD_ROLE_UPDATE", {"guild_id": str(guild.id), "role": role}, guild.id)
+        return role
+
+    async def delete_role(self, request):
+        guild = self.guilds[int(request.match_info["guild_id"])]
+        role_id = int(request.match_info["role_id"])
+        if guild.roles.pop(role_id, None) is not None:
+            for member in guild.members.values():
+                if str(role_id) in member["roles"]:
+                    member["roles"].remove(str(role_id))
+            await self.dispatch("GUILD_ROLE_DELETE", {"guild_id": str(guild.id), "role_id": str(role_id)},
+                                guild.id)
@@ -0,0 +1,114 @@
+# Streams of gateway events for the load harness: generated from the synthetic guilds, or read from a recording.
+from datetime import datetime
+from json import dumps, loads
+from random import Random
+from time import perf_counter
+import asyncio
+
+WORDS = ("the", "quiz", "when", "is", "anyone", "revising", "physics", "maths", "tomorrow", "lol", "did", "you",
+         "see", "that", "exam", "6thbot", "hello", "colour", "mock", "results", "ucas", "deadline")
+COMMANDS = ("6.ping", "6.profile", "6.roleinfo", "6.col")  # Commands that don't call out to other APIs
+REACTIONS = ("👍", "👎", "🔄", "🇦", "🇧", "🇨", "🇩")
+
+
+def _message(fake, rng, guild, users: list, content: str) -> tuple:
+    channel_id = rng.choice(list(guild.channels))
+    member = guild.members[rng.choice(users)]
+    message_id = fake.snowflake()
+    fake.recent_messages.append((guild.id, channel_id, message_id))
+    return "MESSAGE_CREATE", {
+        "id": str(message_id), "channel_id": str(channel_id), "guild_id": str(guild.id), "type": 0,
+        "author": member["user"], "member": {key: value for key, value in member.items() if key != "user"},
+        "content": content, "embeds": [], "attachments": [], "mentions": [], "mention_roles": [],
+        "mention_everyone": False, "pinned": False, "tts": False,
+        "timestamp": datetime.utcnow().isoformat() + "+00:00", "edited_timestamp": None,
+    }
+
+
+def _reaction(fake, rng, users: dict) -> tuple:
+    # On recent messages, both the bot's and the generated ones, as the bot only has recent messages cached.
+    guild_id, channel_id, message_id = rng.choice(fake.recent_messages)
+    member = fake.guilds[guild_id].members[rng.choice(users[guild_id])]
+    return "MESSAGE_REACTION_ADD", {
+        "user_id": member["user"]["id"], "channel_id": str(channel_id), "guild_id": str(guild_id),
+        "message_id": str(message_id), "emoji": {"id": None, "name": rng.choice(REACTIONS)}, "member": member,
+    }
+
+
+def _member_update(rng, guild, users: list, roles: list) -> tuple:
+    member = guild.members[rng.choice(users)]
+    role_id = str(rng.choice(roles))
+    if role_id in member["roles"]:
+        member["roles"].remove(role_id)
+    else:
+        member["roles"].append(role_id)
+    return "GUILD_MEMBER_UPDATE", {"guild_id": str(guild.id), **member}
+
+
+def generate_events(fake, mix: dict, command_ratio: float, seed: int = 0):
+    """
+    Yields (event name, payload) forever, picking each event's type by the weights in `mix`
+    :param fake: the FakeDiscord whose guilds the events happen in
+    :param mix: e.g. {"message": 0.8, "reaction": 0.1, "member_update": 0.1}
+    :param command_ratio: the fraction of messages that are commands
+    """
+    rng = Random(seed)
+    guilds = list(fake.guilds.values())
+    users = {guild.id: [user_id for user_id, member in guild.members.items() if not member["user"]["bot"]]
+             for guild in guilds}
+    # Not @everyone (which shares the guild's id) or the bot's own role
+    roles = {guild.id: [role_id for role_id, role in guild.roles.items()
+                        if role_id != guild.id and role["permissions"] != "8"] for guild in guilds}
+    kinds, weights = zip(*mix.items())
+    while True:
+        kind = rng.choices(kinds, weights)[0]
+        guild = rng.choice(guilds)
+        if kind == "reaction" and fake.recent_messages:
+            yield _reaction(fake, rng, users)
+        elif kind == "member_update" and roles[guild.id]:
+            yield _member_update(rng, guild, users[guild.id], roles[guild.id])
+        elif rng.random() < command_ratio:
+            yield _message(fake, rng, guild, users[guild.id], rng.choice(COMMANDS))
+        else:
+            content = " ".join(rng.choices(WORDS, k=rng.randrange(1, 12)))
+            yield _message(fake, rng, guild, users[guild.id], content)
+
+
+def load_events(path: str):
+    """Yields (event name, payload) from a JSON lines file of {"t": event name, "d": payload}, as saved by replay."""
+    with open(path, "r", encoding="utf-8") as file:
+        for line in file:
+            if line.strip():
+                event = loads(line)
+                yield event["t"], event["d"]
+
+
+async def replay(fake, events, rate: float, limit: int, record: str = None) -> tuple:
+    """
+    Sends events to the bot at a steady rate
+    :param events: an iterable of (event name, payload)
+    :param rate: events per second
+    :param limit: the most events to send
+    :param record: a file to save the events to, for replaying the same stream later
+    :return: a tuple of (events sent, seconds taken)
+    """
+    record_file = open(record, "w", encoding="utf-8") if record is not None else None
+    sent = 0
+    start = perf_counter()
+    try:
+        for event, data in events:
+            if sent >= limit:
+                break
+            # Sleep until this event is due, rather than a fixed time per event, so the rate holds up under load.
+            delay = start + sent / rate - perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            guild_id = data.get("guild_id")
+            await fake.dispatch(event, data, int(guild_id) if guild_id is not None else None)
+            if record_file is not None:
+                record_file.write(dumps({"t": event, "d": data}, ensure_ascii=False) + "\n")
+            sent += 1
+    finally:
+        if record_file is not None:
+            record_file.close()
+    return sent, perf_counter() - start
@@ -0,0 +1,158 @@
+# Runs the real Core and cogs against a local fake Discord, replays a stream of events at it, and reports how
+# fast each handler dealt with them. Nothing connects to Discord, so no api_keys.json is needed.
+#
+#   python -m harness.run --guilds 2 --members 20000 --roles 200 --rate 200 --events 5000
+#
+# Use --record to save the generated stream, and --replay to send a saved one again. Run from the repo root,
+# as the cogs read text/ and json/ relative to it.
+from argparse import ArgumentParser
+from json import dump
+from tempfile import TemporaryDirectory
+import asyncio
+import os.path
+import discord
+from harness.fakediscord import FakeDiscord
+from harness.replay import generate_events, load_events, replay
+from harness.world import generate_guilds
+from util.logs import setup_logging, set_level, stop_logging
+from util.stats import stats
+import main
+
+QUIET_PERIOD = 1.0  # Seconds without any REST calls or handlers finishing, after which the bot counts as done
+
+
+def _handled() -> int:
+    # Not counting the watchdog's loop lag samples, which keep coming whether or not the bot is busy.
+    return sum(histogram.count for (kind, _), histogram in stats.by_name.items() if kind != "loop")
+
+
+async def wait_until_quiet(fake: FakeDiscord, timeout: float = 120.0) -> float:
+    """Waits for the bot to work through everything sent to it, returning when it did."""
+    loop = asyncio.get_event_loop()
+    start = loop.time()
+    last_handled = _handled()
+    last_change = loop.time()
+    while loop.time() - start < timeout:
+        await asyncio.sleep(0.1)
+        handled = _handled()
+        if handled != last_handled:
+            last_handled = handled
+            last_change = loop.time()
+        last_activity = max(last_change, fake.last_request)
+        if loop.time() - last_activity >= QUIET_PERIOD:
+            return last_activity
+    return loop.time()
+
+
+def report(sent: int, replay_secs: float, total_secs: float, fake: FakeDiscord, bot) -> dict:
+    handlers = []
+    for (kind, name), histogram in sorted(stats.by_name.items()):
+        handlers.append({
+            "kind": kind, "name": name, "count": histogram.count, "errors": histogram.errors,
+            "mean_ms": histogram.mean * 1000, "p50_ms": histogram.quantile(0.5) * 1000,
+            "p95_ms": histogram.quantile(0.95) * 1000, "p99_ms": histogram.quantile(0.99) * 1000,
+        })
+    return {
+        "events": sent, "replay_seconds": replay_secs, "total_seconds": total_secs,
+        "throughput": sent / total_secs if total_secs else 0.0,
+        "max_loop_lag_ms": bot.watchdog.max_lag * 1000, "stalls": len(bot.watchdog.stalls),
+        "rest_calls": dict(fake.requests.most_common()), "handlers": handlers,
+    }
+
+
+def print_report(result: dict):
+    print(f"\n{result['events']} events in {result['total_seconds']:.2f}s "
+          f"(sent over {result['replay_seconds']:.2f}s) -> {result['throughput']:.1f} events/s")
+    print(f"Max loop lag {result['max_loop_lag_ms']:.0f}ms, {result['stalls']} stalls\n")
+    print(f"{'kind':<8} {'handler':<48} {'count':>7} {'err':>5} {'mean':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for row in result["handlers"]:
+        print(f"{row['kind']:<8} {row['name'][:48]:<48} {row['count']:>7} {row['errors']:>5} "
+              f"{row['mean_ms']:>7.1f}ms {row['p50_ms']:>6.1f}ms {row['p95_ms']:>6.1f}ms {row['p99_ms']:>6.1f}ms")
+    print("\nREST calls:")
+    for route, calls in result["rest_calls"].items():
+        print(f"  {calls:>7} {route}")
+
+
+async def run(args, data_dir: str) -> dict:
+    fake = FakeDiscord(generate_guilds(args.guilds, args.members, args.roles, seed=args.seed),
+                       shard_count=args.shards, rest_latency=args.rest_latency / 1000)
+    await fake.start()
+    discord.http.Route.BASE = fake.api_url
+
+    bot = main.Core(
+        api_keys={"discord": "harness", "giphy": "", "steam": ""},
+        storage_path=os.path.join(data_dir, "storage.db"),
+        traces_path=os.path.join(data_dir, "traces.jsonl"),
+        command_prefix="6.",
+        shard_count=args.shards,
+        loop=asyncio.get_event_loop(),
+    )
+    bot.remove_command("help")
+    bot_task = asyncio.ensure_future(bot.start("harness"))
+    try:
+        ready = asyncio.ensure_future(bot.wait_until_ready())
+        await asyncio.wait((ready, bot_task), return_when=asyncio.FIRST_COMPLETED)
+        if bot_task.done():  # It failed to log in or connect
+            ready.cancel()
+            bot_task.result()
+        # Only the replayed events should be measured, not logging in.
+        stats.by_name.clear()
+        stats.by_guild.clear()
+        bot.watchdog.max_lag = 0.0
+        bot.watchdog.stalls.clear()
+        fake.requests.clear()
+
+        if args.replay is not None:
+            events = load_events(args.replay)
+        else:
+            mix = {"message": args.messages, "reaction": args.reactions, "member_update": args.member_updates}
+            events = generate_events(fake, mix, args.command_ratio, seed=args.seed)
+        start = asyncio.get_event_loop().time()
+        sent, replay_secs = await replay(fake, events, args.rate, args.events, record=args.record)
+        # Until the bot finished its last piece of work, not counting the quiet period after it.
+        total_secs = max(replay_secs, await wait_until_quiet(fake) - start)
+        return report(sent, replay_secs, total_secs, fake, bot)
+    finally:
+        await bot.close()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        await fake.stop()
+
+
+def main_cli():
+    parser = ArgumentParser(description="Replay gateway events at the bot, against a fake Discord.")
+    parser.add_argument("--guilds", type=int, default=2)
+    parser.add_argument("--members", type=int, default=10000, help="Members per guild")
+    parser.add_argument("--roles", type=int, default=100, help="Roles per guild")
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--rate", type=float, default=100.0, help="Events sent per second")
+    parser.add_argument("--events", type=int, default=2000, help="Number of events to send")
+    parser.add_argument("--messages", type=float, default=0.8, help="Weight of messages in the generated stream")
+    parser.add_argument("--reactions", type=float, default=0.1, help="Weight of reactions")
+    parser.add_argument("--member-updates", type=float, default=0.1, help="Weight of member role changes")
+    parser.add_argument("--command-ratio", type=float, default=0.05, help="Fraction of messages that are commands")
+    parser.add_argument("--rest-latency", type=float, default=50.0, help="Milliseconds per fake REST call")
+    parser.add_argument("--replay", help="A JSON lines file of events to send, instead of generating them")
+    parser.add_argument("--record", help="Save the events sent to this file")
+    parser.add_argument("--json", help="Also write the report to this file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args()
+
+    setup_logging()
+    set_level("root", args.log_level)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        with TemporaryDirectory() as data_dir:
+            result = loop.run_until_complete(run(args, data_dir))
+    finally:
+        loop.close()
+        stop_logging()
+    print_report(result)
+    if args.json is not None:
+        with open(args.json, "w", encoding="utf-8") as file:
+            dump(result, file, indent=2)
+
+
+if __name__ == "__main__":
+    main_cli()
@@ -0,0 +1,114 @@
+# Synthetic guilds for the load harness, kept as the raw JSON payloads Discord would send.
+from datetime import datetime, timedelta
+from itertools import count
+from random import Random
+
+DISCORD_EPOCH_MS = 1420070400000
+BOT_USER_ID = 100000000000000001
+
+
+def _timestamp(moment: datetime) -> str:
+    return moment.isoformat() + "+00:00"
+
+
+class Snowflakes:
+    """Ids that sort by creation time, like Discord's, so created_at comes out sensible."""
+    def __init__(self, start: datetime = datetime(2020, 1, 1)):
+        self._base = (int(start.timestamp() * 1000) - DISCORD_EPOCH_MS) << 22
+        self._seq = count(1)
+
+    def __call__(self) -> int:
+        return self._base + (next(self._seq) << 12)
+
+
+def user_payload(user_id: int, name: str, bot: bool = False) -> dict:
+    return {"id": str(user_id), "username": name, "discriminator": f"{user_id % 10000:04d}", "avatar": None,
+            "bot": bot}
+
+
+class FakeGuild:
+    """One guild's roles, channels and members. Members are stored as their gateway payloads."""
+    def __init__(self, guild_id: int, name: str, owner_id: int):
+        self.id = guild_id
+        self.name = name
+        self.owner_id = owner_id
+        self.roles = {}  # {role_id: role payload}
+        self.channels = {}  # {channel_id: channel payload}
+        self.members = {}  # {user_id: member payload}
+
+    def add_role(self, role_id: int, name: str, position: int, colour: int = 0, permissions: int = 0) -> dict:
+        role = self.roles[role_id] = {
+            "id": str(role_id), "name": name, "color": colour, "hoist": False, "position": position,
+            "permissions": str(permissions), "managed": False, "mentionable": True,
+        }
+        return role
+
+    def add_channel(self, channel_id: int, name: str, position: int) -> dict:
+        channel = self.channels[channel_id] = {
+            "id": str(channel_id), "type": 0, "name": name, "position": position, "permission_overwrites": [],
+            "topic": None, "nsfw": False, "parent_id": None, "rate_limit_per_user": 0, "last_message_id": None,
+            "guild_id": str(self.id),
+        }
+        return channel
+
+    def add_member(self, user: dict, role_ids, joined_at: datetime) -> dict:
+        member = self.members[int(user["id"])] = {
+            "user": user, "roles": [str(role_id) for role_id in role_ids], "nick": None,
+            "joined_at": _timestamp(joined_at), "premium_since": None, "deaf": False, "mute": False,
+        }
+        return member
+
+    def create_payload(self, member_limit: int = 100) -> dict:
+        """
+        The GUILD_CREATE payload. Like Discord, large guilds only come with some members, and the rest are chunked
+        :param member_limit: the most members to include - the bot's own member is always included
+        """
+        members = [self.members[BOT_USER_ID]]
+        members.extend(member for user_id, member in self.members.items()
+                       if user_id != BOT_USER_ID and len(members) < member_limit)
+        return {
+            "id": str(self.id), "name": self.name, "owner_id": str(self.owner_id), "region": "europe",
+            "icon": None, "splash": None, "discovery_splash": None, "banner": None, "description": None,
+            "afk_timeout": 300, "verification_level": 0, "default_message_notifications": 0,
+            "explicit_content_filter": 0, "features": [], "emojis": [], "mfa_level": 0,
+            "system_channel_id": None, "system_channel_flags": 0, "rules_channel_id": None,
+            "public_updates_channel_id": None, "vanity_url_code": None, "premium_tier": 0,
+            "premium_subscription_count": 0, "preferred_locale": "en-US", "max_members": 250000,
+            "max_video_channel_users": 25, "unavailable": False, "large": len(self.members) > member_limit,
+            "member_count": len(self.members), "joined_at": _timestamp(datetime(2020, 1, 1)),
+            "roles": list(self.roles.values()), "channels": list(self.channels.values()),
+            "members": members, "presences": [], "voice_states": [],
+        }
+
+
+def generate_guilds(guilds: int, members: int, roles: int, channels: int = 5, seed: int = 0) -> list:
+    """
+    Builds guilds full of members with random roles, joined at random times over the past few years
+    :param guilds: the number of guilds
+    :param members: members per guild, not counting the bot
+    :param roles: roles per guild, not counting @everyone
+    """
+    rng = Random(seed)
+    snowflake = Snowflakes()
+    bot_user = user_payload(BOT_USER_ID, "6thBot", bot=True)
+    users = [user_payload(snowflake(), f"user{num}") for num in range(members)]
+    now = datetime.utcnow()
+    result = []
+    for guild_num in range(guilds):
+        guild_id = snowflake()
+        guild = FakeGuild(guild_id, f"Guild {guild_num}", int(users[0]["id"]) if users else BOT_USER_ID)
+        guild.add_role(guild_id, "@everyone", 0, permissions=104324673)  # @everyone shares the guild's id
+        admin_role = snowflake()
+        guild.add_role(admin_role, "6thBot", roles + 1, permissions=8)  # Administrator
+        role_ids = [snowflake() for _ in range(roles)]
+        for num, role_id in enumerate(role_ids):
+            guild.add_role(role_id, f"role{num}", num + 1, colour=rng.randrange(0xffffff))
+        for num in range(channels):
+            guild.add_channel(snowflake(), f"channel{num}", num)
+        guild.add_member(bot_user, [admin_role], now - timedelta(days=365))
+        # Every guild shares the same users, as most members of a real bot's guilds are in several of them.
+        for user in users:
+            member_roles = rng.sample(role_ids, min(len(role_ids), rng.randrange(4)))
+            guild.add_member(user, member_roles, now - timedelta(seconds=rng.randrange(3 * 365 * 86400)))
+        result.append(guild)
+    return result
@@ -0,0 +1,89 @@
+# Runs the bot as several processes, each connecting its own slice of the shards, so the work is spread across
+# CPU cores. Every process shares json/storage.db, but only loads and writes the guilds on its own shards.
+#
+#   python launcher.py --processes 4 --shards 8
+#
+# A process that crashes is restarted after a short delay. main.py still runs everything in one process.
+from argparse import ArgumentParser
+from multiprocessing import Process
+from signal import SIGTERM, signal
+from time import sleep
+from util.logs import get_logger, setup_logging, stop_logging
+import main
+
+log = get_logger("launcher")
+
+RESTART_DELAY = 10  # Seconds to wait before restarting a crashed process
+
+
+def split_shards(shard_count: int, processes: int):
+    """Splits shard ids 0..shard_count-1 into `processes` contiguous, near-equal lists."""
+    quotient, remainder = divmod(shard_count, processes)
+    slices = []
+    start = 0
+    for num in range(processes):
+        end = start + quotient + (num < remainder)
+        slices.append(list(range(start, end)))
+        start = end
+    return slices
+
+
+class Shutdown(Exception):
+    """Raised in the launcher when it's sent SIGTERM, e.g. by `docker stop`."""
+
+
+def _raise_shutdown(signum, frame):
+    raise Shutdown()
+
+
+def start_process(shard_ids, shard_count):
+    process = Process(target=main.run, kwargs={"shard_ids": shard_ids, "shard_count": shard_count},
+                      name=f"shards-{shard_ids[0]}-{shard_ids[-1]}")
+    process.start()
+    log.info("Started process", process=process.name, pid=process.pid)
+    return process
+
+
+def launch(processes: int, shard_count: int):
+    if not 1 <= processes <= shard_count:
+        raise ValueError("You need at least one shard per process.")
+    running = {}
+    for shard_ids in split_shards(shard_count, processes):
+        running[tuple(shard_ids)] = start_process(shard_ids, shard_count)
+    signal(SIGTERM, _raise_shutdown)
+
+    try:
+        while running:
+            sleep(RESTART_DELAY)
+            for shard_ids, process in list(running.items()):
+                if process.is_alive():
+                    continue
+                if process.exitcode == 0:
+                    log.info("Process closed", process=process.name)
+                    running.pop(shard_ids)
+                else:
+                    log.warning("Process crashed, restarting", process=process.name, exitcode=process.exitcode)
+                    running[shard_ids] = start_process(list(shard_ids), shard_count)
+    except KeyboardInterrupt:
+        # Each child gets the same interrupt, and closes itself (saving its settings) on the way out.
+        for process in running.values():
+            process.join()
+    except Shutdown:
+        # SIGTERM only reaches the launcher, so it's passed on - each child closes itself on it, as on an interrupt.
+        log.info("Shutting down", processes=len(running))
+        for process in running.values():
+            process.terminate()
+        for process in running.values():
+            process.join()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description="Run the bot across several processes.")
+    parser.add_argument("--processes", type=int, default=2, help="Number of processes to start")
+    parser.add_argument("--shards", type=int, default=None, help="Total shard count (defaults to one per process)")
+    args = parser.parse_args()
+    setup_logging()
+    try:
+        launch(args.processes, args.shards or args.processes)
+    finally:
+        stop_logging()
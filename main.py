@@ -1,16 +1,33 @@
 # The main module. This adds all the other files as cogs, so this should be the code entry point.
 import discord
-from discord.ext import commands, tasks
+from discord.ext import commands
 from datetime import datetime
-from json import load, dump
+from json import load
 import asyncio
+from time import perf_counter
+import importlib
 import os.path
 from util.timeformatter import highest_denom
+from util.settings import SettingsStore, SQLiteBackend
+from util.guildconfig import GuildConfig
+from util.resultcache import ResultCache
+from util.prefilter import MessagePrefilter
+from util.reactions import ReactionRouter
+from util.scheduler import ActionScheduler
+from util.stats import stats
+from util.tracing import tracer
+from util.watchdog import LoopWatchdog
+from util.web import WebClient, UpstreamError
+from util.features import build_intents, build_member_cache_flags
+from util.sharding import guild_filter
+from util.logs import get_logger, setup_logging, stop_logging
 
-intents = discord.Intents.all()
-intents.members = True
+log = get_logger(__name__)
 
-extensions = ["apis", "quiz", "ccolour", "collage", "fun", "kowalski", "helper"]
+STORAGE_PATH = "json/storage.db"  # Settings and cog state, shared by every shard process
+TRACES_PATH = "logs/traces.jsonl"
+
+extensions = ["apis", "quiz", "ccolour", "collage", "fun", "kowalski", "helper", "owner"]
 
 def load_json(filename):
     if not os.path.isfile(f"json/{filename}.json"):
@@ -19,43 +36,162 @@ def load_json(filename):
         return load(file)
 
 
-def save_json(filename, data):
-    with open(f"json/{filename}.json", "w", encoding="utf-8") as file:
-        dump(data, file, ensure_ascii=False)
+def _guild_id_of(event_args):
+    # Events are passed a guild, or an object with a guild (a message, member, role, reaction's message...)
+    for arg in event_args:
+        guild = arg if isinstance(arg, discord.Guild) else getattr(arg, "guild", None)
+        if guild is None and isinstance(arg, discord.Reaction):
+            guild = arg.message.guild
+        if guild is not None:
+            return guild.id
+    return None
 
 
-class Core(commands.Bot):  # discord.ext.commands.Bot is a subclass of discord.Client
-    def __init__(self, **options):
-        super().__init__(**options)
+# AutoShardedBot runs every shard in one process, unless shard_ids picks out a subset (see launcher.py).
+class Core(commands.AutoShardedBot):  # Combines commands.Bot with discord.AutoShardedClient
+    def __init__(self, api_keys: dict = None, storage_path: str = STORAGE_PATH, traces_path: str = None, **options):
+        """
+        :param api_keys: {"discord": ..., "giphy": ..., "steam": ...}, read from json/api_keys.json if not given
+        :param storage_path: the SQLite database for settings and cog state
+        :param traces_path: the JSON lines file traces are written to
+        """
+        # Cogs are imported before connecting, so the intents they declare decide what the gateway sends.
+        self.extension_timings = {}  # {name: (import seconds, setup seconds)}
+        modules = self.import_extensions()
+        intents = build_intents(modules)
+        super().__init__(
+            intents=intents,
+            member_cache_flags=build_member_cache_flags(intents),
+            chunk_guilds_at_startup=False,  # Features that need member lists chunk their guild on first use
+            **options
+        )
 
-        token_dict = load_json("api_keys")
+        token_dict = load_json("api_keys") if api_keys is None else api_keys
         self.discord_api_key = token_dict["discord"]
         self.giphy_api_key = token_dict["giphy"]
         self.steam_api_key = token_dict["steam"]
 
-        self.guild_settings: dict = load_json("guild_settings")
+        # Each process only loads and writes the guilds on its own shards.
+        self.storage_path = storage_path
+        self._owns_guild = guild_filter(self.shard_ids, self.shard_count)
+        self._stores = {}
+        # Written back per guild as it changes - the old guild_settings.json is imported on the first run.
+        self.guild_settings = self.open_store("guild_settings", legacy_json="json/guild_settings.json")
+        self.config = GuildConfig(self)  # Cogs should read settings through this, rather than guild_settings
+        self.results = ResultCache(self)  # Rendered output of read-only commands, dropped on member/role events
         self.start_time = datetime.utcnow()
+        self.prefilter = MessagePrefilter(self.command_prefix)
+        self.reactions = ReactionRouter(self)  # Use this rather than wait_for('reaction_add')
+        self.actions = ActionScheduler(self.loop)  # Queues role, reaction and edit requests by rate-limit bucket
+        # For external APIs - self.http is discord.py's client for Discord's API. Timeouts etc. are set in web.json.
+        self.web = WebClient(**load_json("web"))
+        self.stats = stats
+        self.tracer = tracer
+        if traces_path is None:
+            traces_path = TRACES_PATH if self.shard_ids is None else \
+                f"logs/traces-shards-{self.shard_ids[0]}-{self.shard_ids[-1]}.jsonl"
+        self.tracer.open(traces_path)
+        self._time_discord_requests()
+        self.watchdog = LoopWatchdog(self.loop, self.stats)
+
+    def _time_discord_requests(self):
+        # Every REST call discord.py makes goes through HTTPClient.request, so it's wrapped here to time them.
+        request = self.http.request
+
+        async def timed_request(route, **kwargs):
+            name = f"{route.method} {route.path}"
+            with self.stats.timer("discord", name, route.guild_id), self.tracer.child(name, "discord"):
+                return await request(route, **kwargs)
+        self.http.request = timed_request
+
+    def open_store(self, table: str, legacy_json: str = None) -> SettingsStore:
+        """
+        Opens a per-guild store in the shared database, for settings or any cog state that outlives a restart.
+        Reopening a table returns the same store, so cogs can call this again after being reloaded.
+        :param table: the table name
+        :param legacy_json: a JSON file of {guild_id: dict} to import, if the table doesn't exist yet
+        """
+        store = self._stores.get(table)
+        if store is None:
+            backend = SQLiteBackend(self.storage_path, table, legacy_json=legacy_json)
+            store = self._stores[table] = SettingsStore(backend, self.loop, owns=self._owns_guild)
+        return store
+
+    def import_extensions(self):
+        log.info("Importing extensions")
+        modules = []
+        for name in extensions:
+            start = perf_counter()
+            modules.append(importlib.import_module(f"cogs.{name}"))
+            self.extension_timings[name] = (perf_counter() - start, 0.0)
+        return modules
+
+    def load_extensions(self):
+        log.info("Loading extensions")
+        total = len(extensions)
+        for num, name in enumerate(extensions):
+            # load_extension re-runs the module body, but everything it imports is cached by now.
+            start = perf_counter()
+            self.load_extension(f"cogs.{name}")
+            import_secs = self.extension_timings[name][0]
+            setup_secs = perf_counter() - start
+            self.extension_timings[name] = (import_secs, setup_secs)
+            log.info("Loaded extension", extension=name, num=num + 1, total=total,
+                     import_ms=round(import_secs * 1000), setup_ms=round(setup_secs * 1000))
+
+    async def start(self, *args, **kwargs):
+        # Extensions are loaded here rather than in on_ready, which fires again on every reconnect.
+        self.load_extensions()
+        self.watchdog.start()
+        await super().start(*args, **kwargs)
+
+    async def invoke(self, ctx):
+        if ctx.command is None:
+            await super().invoke(ctx)
+            return
+        start = perf_counter()
+        try:
+            with self.tracer.span(ctx.command.qualified_name, "command", root=True,
+                                  guild=ctx.guild.id if ctx.guild else None, user=ctx.author.id) as span:
+                await super().invoke(ctx)
+                if ctx.command_failed:
+                    span.error = "CommandFailed"
+        finally:
+            # Errors are handled inside invoke, so they're only visible through command_failed.
+            self.stats.observe("command", ctx.command.qualified_name, perf_counter() - start,
+                               ctx.guild.id if ctx.guild else None, ok=not ctx.command_failed)
+
+    async def _run_event(self, coro, event_name, *args, **kwargs):
+        # Same as discord.Client._run_event, which every event listener is run through, but timed.
+        start = perf_counter()
+        name = getattr(coro, "__qualname__", event_name)
+        guild_id = _guild_id_of(args)
+        ok = True
+        with self.tracer.span(name, "event", guild=guild_id) as span:
+            try:
+                await coro(*args, **kwargs)
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                ok = False
+                span.error = type(e).__name__
+                try:
+                    await self.on_error(event_name, *args, **kwargs)
+                except asyncio.CancelledError:
+                    pass
+            finally:
+                self.stats.observe("event", name, perf_counter() - start, guild_id, ok)
 
     async def on_ready(self):
-        print('Logged on as {0}!'.format(self.user))
-        print("Checking for server changes while offline...")
+        log.info("Logged on", user=str(self.user), shards=len(self.shards), guilds=len(self.guilds))
         guild_ids: set = {str(guild.id) for guild in self.guilds}
         guild_ids_contained: set = {key for key in self.guild_settings}
         for added_guild in guild_ids - guild_ids_contained:
             self.guild_settings[str(added_guild)]: dict = {}
-            print(f"+ Added {added_guild}")
+            log.info("Added guild while offline", guild=added_guild)
         for removed_guild in guild_ids_contained - guild_ids:
             self.guild_settings[str(removed_guild)]: dict = {}
-            print(f"- Removed {removed_guild}")
-        print("...Done")
-
-        self.save_guild_settings.start()
-
-        print("Loading extensions...")
-        total = len(extensions)
-        for num, name in enumerate(extensions):
-            print(f"[{num+1}/{total}] {name}")
-            self.load_extension(f"cogs.{name}")
+            log.info("Removed guild while offline", guild=removed_guild)
 
     async def on_message(self, msg: discord.Message):
         if msg.author.bot:
@@ -63,35 +199,36 @@ class Core(commands.Bot):  # discord.ext.commands.Bot is a subclass of discord.C
         if not isinstance(msg.channel, discord.TextChannel):
             await msg.channel.send("Sorry, commands don't work in DMs. Try talking to me on a server instead!")
             return
-        if msg.guild.me.name.lower() in msg.content.lower() or msg.guild.me in msg.mentions:
+        could_be_command, says_name = self.prefilter.scan(msg)
+        if says_name or msg.guild.me in msg.mentions:
             await msg.add_reaction("👋")  # Adds the wave reaction
-        await bot.process_commands(msg)
+        if could_be_command:
+            await self.process_commands(msg)
 
     # Add empty settings dictionary on join
     async def on_guild_join(self, guild: discord.Guild):
         self.guild_settings[str(guild.id)]: dict = {}
-        print(f"+ Added {guild.name}")
+        log.info("Joined guild", guild=guild.id, name=guild.name)
 
     # Remove settings dictionary on leave
     async def on_guild_remove(self, guild: discord.Guild):
         self.guild_settings.pop(str(guild.id))
-        print(f"- Removed {guild.name}")
-
-    @tasks.loop(minutes=15)
-    async def save_guild_settings(self):
-        loop = asyncio.get_event_loop()
-        await loop.run_in_executor(None, save_json, "guild_settings", self.guild_settings)
-        print("Guild Settings Saved")
+        self.prefilter.forget(guild.id)
+        log.info("Left guild", guild=guild.id, name=guild.name)
 
-    @save_guild_settings.before_loop
-    async def before_save(self):
-        await self.wait_until_ready()
+    async def close(self):
+        self.watchdog.stop()
+        await super().close()
+        await self.web.close()
+        # Cogs are unloaded by now, so nothing else will change the settings.
+        for store in self._stores.values():
+            await store.close()
+        log.info("Guild settings saved")
 
     async def on_command_error(self, ctx, err):
-        print(f"Type: {type(err)} | Description: {err}")
+        log.debug("Command error", type=type(err).__name__, error=err)
         if isinstance(err, commands.CommandNotFound):
             cmd_name = err.args[0].split('"')[1]
-            print(f"Invalid command: {cmd_name}")
             if cmd_name.isdigit():
                 return
             await ctx.message.add_reaction("❓")
@@ -111,23 +248,39 @@ class Core(commands.Bot):  # discord.ext.commands.Bot is a subclass of discord.C
             await ctx.send("Sorry, you don't have the required permissions for this command :/")
         elif isinstance(err, discord.Forbidden):
             await ctx.send("Sorry, I'm not allowed to do that properly - have you set up permissions correctly?")
+        elif isinstance(err, UpstreamError):
+            # Already logged by the web client, if it's worth logging.
+            await ctx.send(f"Sorry, I can't reach `{err.host}` right now - try again in a bit.")
         elif isinstance(err, commands.CommandInvokeError):
-            print("Command Invoke Error")
+            if not isinstance(err.original, UpstreamError):
+                log.error("Command raised an exception", command=ctx.command.qualified_name,
+                          exc_info=err.original)
             await self.on_command_error(ctx, err.original)
         elif isinstance(err, commands.ConversionError):
-            print(f"Conversion failed with {err.converter}")
+            log.warning("Conversion failed", command=ctx.command.qualified_name, converter=err.converter)
+
+
+def run(shard_ids=None, shard_count=None):
+    """Runs the bot until it's closed. With no arguments, every shard runs in this process."""
+    setup_logging()
+    # Initialise the bot client
+    bot = Core(
+        description="A Bot Designed for the r/6thForm Discord.",
+        activity=discord.Game("with you!"),  # "playing" is prefixed at the start of the status
+        command_prefix="6.",
+        shard_ids=shard_ids,
+        shard_count=shard_count
+    )
+    bot.remove_command('help')
 
+    # The bot token should be put in api_keys.json
+    try:
+        bot.run(bot.discord_api_key)
+    finally:
+        stop_logging()
 
-# Initialise the bot client
-bot = Core(
-    description="A Bot Designed for the r/6thForm Discord.",
-    activity=discord.Game("with you!"),  # "playing" is prefixed at the start of the status
-    command_prefix="6."
-    intents=intents
-)
-bot.remove_command('help')
 
-# The bot token should be put in api_keys.json
-bot.run(bot.discord_api_key)
+if __name__ == "__main__":
+    run()
 
 # Implement shadow-banning (if a user with a certain ID joins, they will immediately be banned)?
@@ -0,0 +1,58 @@
+# Circuit breakers for the external APIs, so a host that's down fails fast instead of holding up every command.
+from time import monotonic
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+
+class CircuitBreaker:
+    """Opens after `failure_threshold` failures in a row, turning requests away for `reset_after` seconds.
+
+    After that it's half-open, letting one request through as a probe: if it succeeds the breaker closes again,
+    and if it fails the breaker opens for another `reset_after` seconds.
+    """
+    def __init__(self, failure_threshold: int = 5, reset_after: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.state = CLOSED
+        self.failures = 0  # In a row
+        self.opened_at = 0.0
+        self.last_error = None
+        self._probing = False
+
+    def allow(self) -> bool:
+        """Whether a request may go out now. A True while half-open means this request is the probe."""
+        if self.state == OPEN and monotonic() - self.opened_at >= self.reset_after:
+            self.state = HALF_OPEN
+        if self.state == CLOSED:
+            return True
+        if self.state == HALF_OPEN and not self._probing:
+            self._probing = True
+            return True
+        return False
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._probing = False
+
+    def record_failure(self, error: str):
+        self.failures += 1
+        self.last_error = error
+        self._probing = False
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = OPEN
+            self.opened_at = monotonic()
+
+    def record_cancelled(self):
+        # The probe never finished (or failed for reasons of its own), so nothing was learnt - let the next request
+        # probe instead.
+        self._probing = False
+
+    @property
+    def retry_in(self) -> float:
+        """Seconds until the breaker will let a probe through, if it's open."""
+        if self.state != OPEN:
+            return 0.0
+        return max(0.0, self.opened_at + self.reset_after - monotonic())
@@ -0,0 +1,54 @@
+# Each cog module declares the gateway intents it relies on in a module-level `intents` list, e.g.
+#     intents = ["members", "guild_reactions"]
+# and Core asks Discord for only the union of those. Member lists are fetched per guild, the first time a
+# feature that needs them is used, rather than for every guild at startup.
+from discord import Guild, Intents, MemberCacheFlags
+from discord.ext import commands
+from util.logs import get_logger
+import asyncio
+
+# Needed by Core itself: guild/role/channel caches, commands in guilds, and the "no commands in DMs" reply.
+BASE_INTENTS = ("guilds", "guild_messages", "dm_messages")
+
+_chunk_tasks = {}  # {guild_id: Task}, so concurrent first uses share one request
+log = get_logger(__name__)
+
+
+def build_intents(modules) -> Intents:
+    """
+    :param modules: the imported cog modules
+    :return: the smallest discord.Intents covering Core and every module's declared `intents`
+    """
+    intents = Intents.none()
+    for name in BASE_INTENTS:
+        setattr(intents, name, True)
+    for module in modules:
+        for name in getattr(module, "intents", ()):
+            setattr(intents, name, True)
+    return intents
+
+
+def build_member_cache_flags(intents: Intents) -> MemberCacheFlags:
+    # Without the presences intent, only members seen through chunking or joins are kept.
+    return MemberCacheFlags.from_intents(intents)
+
+
+async def ensure_member_list(guild: Guild):
+    """Fetches every member of the guild into the cache, unless that's already been done."""
+    if guild.chunked:
+        return
+    task = _chunk_tasks.get(guild.id)
+    if task is None:
+        log.info("Chunking guild", guild=guild.id, members=guild.member_count)
+        task = _chunk_tasks[guild.id] = asyncio.ensure_future(guild.chunk())
+        task.add_done_callback(lambda _: _chunk_tasks.pop(guild.id, None))
+    await asyncio.shield(task)
+
+
+def needs_member_list():
+    """A command check for commands that read guild.members or role.members, which chunks the guild first."""
+    async def predicate(ctx):
+        if ctx.guild is not None:
+            await ensure_member_list(ctx.guild)
+        return True
+    return commands.check(predicate)
@@ -0,0 +1,94 @@
+# Cached, typed lookups of guild settings, shared by every cog.
+from discord import Guild, Role, TextChannel
+from discord.abc import GuildChannel
+from typing import Optional
+
+_MISSING = object()
+
+
+class GuildConfig:
+    """Resolves guild settings (and the Roles/Channels their ids point to) once, then serves them from a cache.
+
+    A guild's cached entries are dropped whenever its settings are written, or when a role or channel is deleted.
+    Everything is dropped on reconnect, since discord.py rebuilds its Guild and Role objects then.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._cache = {}  # {guild_id: {key: value}}
+
+        bot.guild_settings.listeners.append(self._on_settings_change)
+        for listener in (self.on_guild_role_delete, self.on_guild_channel_delete, self.on_guild_remove,
+                         self.on_guild_available, self.on_ready):
+            bot.add_listener(listener)
+
+    def _guild_cache(self, guild: Guild) -> dict:
+        guild_cache = self._cache.get(guild.id)
+        if guild_cache is None:
+            guild_cache = self._cache[guild.id] = {}
+        return guild_cache
+
+    def value(self, guild: Guild, key: str, default=None):
+        """
+        Fetches a raw setting for the guild
+        :param guild: a discord.Guild object
+        :param key: the setting name
+        :param default: returned if the setting hasn't been set
+        """
+        guild_cache = self._guild_cache(guild)
+        value = guild_cache.get(key, _MISSING)
+        if value is _MISSING:
+            value = guild_cache[key] = self.bot.guild_settings[str(guild.id)].get(key, _MISSING)
+        return default if value is _MISSING else value
+
+    def role(self, guild: Guild, key: str) -> Optional[Role]:
+        """
+        Fetches the role whose id is stored in the setting, if the setting exists and the role hasn't been deleted
+        :param guild: a discord.Guild object
+        :param key: the setting name, e.g. "colour_role_id"
+        :return: a discord.Role object, or None
+        """
+        return self._resolve(guild, key, guild.get_role)
+
+    def channel(self, guild: Guild, key: str) -> Optional[GuildChannel]:
+        """
+        Fetches the channel whose id is stored in the setting, if the setting exists and the channel still exists
+        :param guild: a discord.Guild object
+        :param key: the setting name, e.g. "manual_chl_id"
+        :return: a discord.abc.GuildChannel (usually a discord.TextChannel), or None
+        """
+        return self._resolve(guild, key, guild.get_channel)
+
+    def _resolve(self, guild, key, getter):
+        guild_cache = self._guild_cache(guild)
+        # Resolved objects are cached under a separate key to the raw id.
+        cache_key = ("resolved", key)
+        obj = guild_cache.get(cache_key, _MISSING)
+        if obj is _MISSING:
+            obj_id = self.value(guild, key)
+            obj = guild_cache[cache_key] = None if obj_id is None else getter(obj_id)
+        return obj
+
+    def invalidate(self, guild_id: int = None):
+        """Drops the cached settings for one guild, or every guild if no id is given."""
+        if guild_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(guild_id, None)
+
+    def _on_settings_change(self, guild_str: str):
+        self.invalidate(int(guild_str))
+
+    async def on_guild_role_delete(self, role: Role):
+        self.invalidate(role.guild.id)
+
+    async def on_guild_channel_delete(self, channel: TextChannel):
+        self.invalidate(channel.guild.id)
+
+    async def on_guild_remove(self, guild: Guild):
+        self.invalidate(guild.id)
+
+    async def on_guild_available(self, guild: Guild):
+        self.invalidate(guild.id)
+
+    async def on_ready(self):
+        self.invalidate()
@@ -0,0 +1,63 @@
+# Incremental JSON decoding, for responses too big to hold and parse in one go (e.g. a Steam library).
+from json import JSONDecoder
+from re import compile as re_compile, escape
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",]"
+
+
+class JsonArrayStream:
+    """Decodes the items of one array in a JSON document as the text arrives, keeping only the unparsed tail.
+
+    The array is the first one found under `key`, at any depth. Anything before it is skipped without being parsed,
+    so the key shouldn't also appear as a string earlier in the document.
+    """
+    def __init__(self, key: str):
+        self._start = re_compile(r'"%s"\s*:\s*\[' % escape(key))
+        self._decoder = JSONDecoder()
+        self._buffer = ""
+        self.found = False  # Whether the array has started
+        self.done = False  # Whether the array has ended
+        self.count = 0  # Items decoded so far
+
+    def feed(self, text: str) -> list:
+        """
+        Adds the next piece of the document
+        :return: the items completed by it, in order
+        """
+        if self.done:
+            return []
+        self._buffer += text
+        if not self.found:
+            match = self._start.search(self._buffer)
+            if match is None:
+                # Keeps enough of the end for a key split over two pieces.
+                self._buffer = self._buffer[-(len(self._start.pattern) + 64):]
+                return []
+            self.found = True
+            self._buffer = self._buffer[match.end():]
+        items = []
+        pos = 0
+        buffer = self._buffer
+        end = len(buffer)
+        while True:
+            while pos < end and (buffer[pos] in _WHITESPACE or buffer[pos] == ","):
+                pos += 1
+            if pos == end:
+                break
+            if buffer[pos] == "]":
+                self.done = True
+                pos = end
+                break
+            try:
+                item, item_end = self._decoder.raw_decode(buffer, pos)
+            except ValueError:
+                break  # Not all here yet
+            # A number (or true/false/null) might still have more to come, so wait for what follows it.
+            if not isinstance(item, (dict, list, str)) and (item_end == end or buffer[item_end] not in _DELIMITERS):
+                break
+            items.append(item)
+            pos = item_end
+        self._buffer = buffer[pos:]
+        self.count += len(items)
+        return items
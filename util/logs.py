@@ -0,0 +1,165 @@
+# Logging for the whole bot. Code on the event loop only puts records on a queue - a background thread formats
+# them and does the (possibly blocking) writes to stdout and the log file.
+from collections import Counter
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from json import load, dumps
+from queue import SimpleQueue
+import logging
+import os.path
+import sys
+
+CONFIG_PATH = "json/logging.json"
+DEFAULT_LEVELS = {"discord": "WARNING"}  # discord.py logs every gateway event at DEBUG and INFO
+
+_listener = None
+_listener_pid = None  # A process forked from one that set up logging has to start its own listener thread
+_file_listeners = []  # For the loggers made by json_lines_logger
+
+
+class KeyValueFormatter(logging.Formatter):
+    """Formats records as one line of logfmt: `time=... level=info logger=cogs.ccolour msg="..." guild=123`"""
+    def format(self, record: logging.LogRecord) -> str:
+        pairs = [
+            ("time", datetime.utcfromtimestamp(record.created).isoformat(timespec="milliseconds")),
+            ("level", record.levelname.lower()),
+            ("logger", record.name),
+            ("msg", record.getMessage()),
+        ]
+        pairs.extend(getattr(record, "fields", {}).items())
+        if record.exc_info:
+            pairs.append(("exc", self.formatException(record.exc_info)))
+        return " ".join(f"{key}={_quote(value)}" for key, value in pairs)
+
+
+def _quote(value) -> str:
+    text = str(value)
+    if text and not any(char in text for char in ' ="\n\\'):
+        return text
+    return '"' + text.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """Writes the record's message, which should be a dict, as one line of JSON."""
+    def format(self, record: logging.LogRecord) -> str:
+        return dumps(record.msg, default=str, ensure_ascii=False)
+
+
+class _EnqueueHandler(QueueHandler):
+    def prepare(self, record):
+        # QueueHandler.prepare formats the record here, on the caller's thread. The listener is in this process,
+        # so the record can go on the queue as it is, and be formatted by the listener's thread instead.
+        return record
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Takes key/value fields as keyword arguments: log.info("Role deleted", guild=guild.id, role=role.name)
+
+    Passing every=N logs only one in N calls with that message, for events too frequent to log every time.
+    """
+    def __init__(self, logger: logging.Logger):
+        super().__init__(logger, {})
+        self._calls = Counter()  # {message: calls}, for sampled messages
+
+    def log(self, level, msg, *args, exc_info=None, stack_info=False, every: int = 1, **fields):
+        if not self.isEnabledFor(level):
+            return
+        if every > 1:
+            self._calls[msg] += 1
+            if self._calls[msg] % every != 1:
+                return
+            fields["sampled"] = every
+        self.logger.log(level, msg, *args, exc_info=exc_info, stack_info=stack_info, extra={"fields": fields})
+
+    def debug(self, msg, *args, **kwargs):
+        self.log(logging.DEBUG, msg, *args, **kwargs)
+
+    def info(self, msg, *args, **kwargs):
+        self.log(logging.INFO, msg, *args, **kwargs)
+
+    def warning(self, msg, *args, **kwargs):
+        self.log(logging.WARNING, msg, *args, **kwargs)
+
+    def error(self, msg, *args, **kwargs):
+        self.log(logging.ERROR, msg, *args, **kwargs)
+
+    def exception(self, msg, *args, exc_info=True, **kwargs):
+        self.log(logging.ERROR, msg, *args, exc_info=exc_info, **kwargs)
+
+
+def get_logger(name: str) -> StructuredLogger:
+    """Use with __name__, so each cog's level can be set separately, e.g. "cogs.ccolour"."""
+    return StructuredLogger(logging.getLogger(name))
+
+
+def set_level(name: str, level: str):
+    """
+    Changes a logger's level while running
+    :param name: the logger name, e.g. "cogs.quiz", or "root" for the default
+    :param level: a level name, e.g. "DEBUG"
+    """
+    logger = logging.getLogger() if name == "root" else logging.getLogger(name)
+    logger.setLevel(level.upper())
+
+
+def json_lines_logger(name: str, path: str, max_bytes: int = 5_000_000, backups: int = 3) -> logging.Logger:
+    """
+    Makes a logger that writes dicts to a rotating JSON lines file, through its own queue and writer thread
+    :param name: the logger name - its records don't go to stdout
+    :param path: the file to write, e.g. "logs/traces.jsonl"
+    :param max_bytes: the size at which the file is rotated
+    :param backups: how many rotated files to keep
+    """
+    logger = logging.getLogger(name)
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+    handler.setFormatter(JsonLinesFormatter())
+    queue = SimpleQueue()
+    logger.handlers = [_EnqueueHandler(queue)]
+    listener = QueueListener(queue, handler)
+    listener.start()
+    _file_listeners.append(listener)
+    return logger
+
+
+def setup_logging(log_file: str = None):
+    """
+    Sends every log record through a queue to a background thread, which writes to stdout (and the file)
+    Levels are read from json/logging.json: {"level": "INFO", "levels": {"cogs.ccolour": "DEBUG"}, "file": "..."}
+    """
+    global _listener, _listener_pid
+    if _listener is not None and _listener_pid == os.getpid():
+        return
+    config = {}
+    if os.path.isfile(CONFIG_PATH):
+        with open(CONFIG_PATH, "r", encoding="utf-8") as file:
+            config = load(file)
+    formatter = KeyValueFormatter()
+    handlers = [logging.StreamHandler(sys.stdout)]
+    log_file = log_file or config.get("file")
+    if log_file is not None:
+        handlers.append(logging.FileHandler(log_file, encoding="utf-8"))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    queue = SimpleQueue()
+    root = logging.getLogger()
+    root.handlers = [_EnqueueHandler(queue)]
+    root.setLevel(config.get("level", "INFO").upper())
+    for name, level in {**DEFAULT_LEVELS, **config.get("levels", {})}.items():
+        set_level(name, level)
+    _listener = QueueListener(queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    _listener_pid = os.getpid()
+
+
+def stop_logging():
+    """Writes out anything still queued. Call before the process exits."""
+    global _listener
+    while _file_listeners:
+        _file_listeners.pop().stop()
+    if _listener is not None and _listener_pid == os.getpid():
+        _listener.stop()
+        _listener = None
@@ -0,0 +1,100 @@
+# Rough memory accounting: deep sizes of the objects each cog holds on to, and allocation sites from tracemalloc.
+from collections import deque
+from discord import Client, Guild
+from discord.http import HTTPClient
+from discord.state import ConnectionState
+from types import FunctionType, MethodType, ModuleType
+import asyncio
+import sys
+import tracemalloc
+
+# Shared objects that every cog can reach, which would otherwise be counted against whichever cog got to them first.
+_OPAQUE = (type, ModuleType, FunctionType, MethodType, Client, Guild, ConnectionState, HTTPClient,
+           asyncio.AbstractEventLoop)
+
+
+def deep_size(obj, seen: set, limit: int = 50_000) -> tuple:
+    """
+    Adds up sys.getsizeof for the object and everything it refers to, skipping anything already in `seen`
+    :param seen: ids of objects already counted - pass the same set for every attribute of a cog, so nothing
+                 shared between them is counted twice
+    :param limit: the most objects to visit, so a huge structure can't hold up the loop for long
+    :return: a tuple of (bytes, objects visited, whether the limit was hit)
+    """
+    size = 0
+    visited = 0
+    pending = deque([obj])
+    while pending:
+        item = pending.popleft()
+        if id(item) in seen or isinstance(item, _OPAQUE):
+            continue
+        seen.add(id(item))
+        visited += 1
+        if visited > limit:
+            return size, visited, True
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            pending.extend(item)
+        if hasattr(item, "__dict__"):
+            pending.append(item.__dict__)
+        for slot in getattr(type(item), "__slots__", ()):
+            if hasattr(item, slot):
+                pending.append(getattr(item, slot))
+    return size, visited, False
+
+
+async def cog_sizes(bot) -> dict:
+    """{cog name: [(attribute, bytes, objects, truncated), ...]}, largest first. Yields to the loop between
+    attributes, so other events are handled while it works through them."""
+    sizes = {}
+    # The bot's own attributes (settings stores, caches, stats) are reached from every cog through self.bot.
+    seen = {id(bot)}
+    for name, cog in bot.cogs.items():
+        attributes = []
+        for attribute, value in vars(cog).items():
+            if value is bot:
+                continue
+            attributes.append((attribute, *deep_size(value, seen)))
+            await asyncio.sleep(0)
+        sizes[name] = sorted(attributes, key=lambda row: row[1], reverse=True)
+    return sizes
+
+
+class AllocationTracker:
+    """Takes tracemalloc snapshots, each compared with the one before, to show which lines are allocating."""
+    def __init__(self, frames: int = 10):
+        self.frames = frames
+        self.last = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        # Tracing slows every allocation down, so it's only on while someone's looking.
+        tracemalloc.start(self.frames)
+        self.last = None
+
+    def stop(self):
+        tracemalloc.stop()
+        self.last = None
+
+    def snapshot(self, num: int = 10) -> tuple:
+        """
+        Takes a snapshot, grouping allocations by the line that made them - call it in an executor, it's slow
+        :return: a tuple of (top lines by size, top lines by growth since the last snapshot or None, total bytes)
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        top = snapshot.statistics("lineno")
+        diff = None
+        if self.last is not None:
+            diff = [stat for stat in snapshot.compare_to(self.last, "lineno") if stat.size_diff != 0][:num]
+        self.last = snapshot
+        return top[:num], diff, sum(stat.size for stat in top)
@@ -0,0 +1,40 @@
+# Cheap checks run on every message, so that messages which can't be commands never reach the command parser.
+from collections import Counter
+from discord import Guild, Message
+import re
+
+
+class MessagePrefilter:
+    """Matches the command prefix and the bot's name in one pass over the message.
+
+    A pattern is compiled per guild the first time a message arrives there, and recompiled only if the bot's
+    name changes.
+    """
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self._matchers = {}  # {guild_id: (bot name, compiled pattern)}
+        self.counts = Counter()  # "seen", "rejected" and "passed" message totals
+
+    def _matcher(self, guild: Guild):
+        name = guild.me.name
+        cached = self._matchers.get(guild.id)
+        if cached is None or cached[0] != name:
+            # The prefix is only allowed at the very start, then the name is searched for anywhere after it.
+            pattern = re.compile(f"(?P<prefix>{re.escape(self.prefix)})?(?:.*?(?P<name>{re.escape(name)}))?",
+                                 re.IGNORECASE | re.DOTALL)
+            cached = self._matchers[guild.id] = (name, pattern)
+        return cached[1]
+
+    def scan(self, msg: Message):
+        """
+        :param msg: a message sent in a guild
+        :return: a tuple of (could be a command, says the bot's name)
+        """
+        found = self._matcher(msg.guild).match(msg.content)
+        is_command = found.group("prefix") is not None
+        self.counts["seen"] += 1
+        self.counts["passed" if is_command else "rejected"] += 1
+        return is_command, found.group("name") is not None
+
+    def forget(self, guild_id: int):
+        self._matchers.pop(guild_id, None)
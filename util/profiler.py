@@ -0,0 +1,70 @@
+# A sampling profiler that runs inside the bot: a thread records every other thread's stack at a fixed
+# interval, and the samples are written out as collapsed stacks (for flamegraph.pl) or speedscope JSON.
+from collections import Counter
+from json import dumps
+from time import monotonic, sleep
+import os.path
+import sys
+import threading
+
+
+def _frame_name(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def sample_stacks(seconds: float, interval: float = 0.005) -> Counter:
+    """
+    Samples the stack of every thread except the calling one, which blocks until it's done
+    :param seconds: how long to sample for
+    :param interval: the time between samples - 5ms costs about 1% of one core with a handful of threads
+    :return: a Counter of {(thread name, outermost frame, ..., innermost frame): samples}
+    """
+    own_id = threading.get_ident()
+    samples = Counter()
+    end = monotonic() + seconds
+    while monotonic() < end:
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own_id:
+                continue
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame.f_code))
+                frame = frame.f_back
+            stack.append(names.get(thread_id, str(thread_id)))
+            stack.reverse()
+            samples[tuple(stack)] += 1
+        del frame
+        sleep(interval)
+    return samples
+
+
+def to_collapsed(samples: Counter) -> str:
+    """One `root;...;leaf count` line per distinct stack, as read by flamegraph.pl and speedscope."""
+    return "\n".join(f"{';'.join(stack)} {count}" for stack, count in samples.most_common()) + "\n"
+
+
+def to_speedscope(samples: Counter, interval: float, name: str = "6thBot") -> str:
+    """A speedscope "sampled" profile per thread, sharing one frame table."""
+    frame_index = {}
+    frames = []
+    profiles = {}
+    for stack, count in samples.items():
+        thread, calls = stack[0], stack[1:]
+        indices = []
+        for call in calls:
+            if call not in frame_index:
+                frame_index[call] = len(frames)
+                frames.append({"name": call})
+            indices.append(frame_index[call])
+        profile = profiles.setdefault(thread, {"type": "sampled", "name": thread, "unit": "seconds",
+                                               "startValue": 0, "endValue": 0, "samples": [], "weights": []})
+        profile["samples"].append(indices)
+        profile["weights"].append(count * interval)
+        profile["endValue"] += count * interval
+    return dumps({
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "name": name,
+        "shared": {"frames": frames},
+        "profiles": list(profiles.values()),
+    })
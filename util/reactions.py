@@ -0,0 +1,102 @@
+# Routes reactions to the interactive message they were added to, instead of every pending check running on
+# every reaction in every guild.
+from discord import Message, Reaction
+from util.logs import get_logger
+import asyncio
+
+log = get_logger(__name__)
+
+
+class _Route:
+    __slots__ = ("emojis", "user_id", "future", "callback")
+
+    def __init__(self, emojis=None, user_id=None, future=None, callback=None):
+        self.emojis = emojis  # None accepts any emoji
+        self.user_id = user_id  # None accepts anyone
+        self.future = future  # Set for one-off waits
+        self.callback = callback  # Set for subscriptions
+
+    def matches(self, reaction: Reaction, user) -> bool:
+        if self.user_id is not None and user.id != self.user_id:
+            return False
+        return self.emojis is None or str(reaction.emoji) in self.emojis
+
+
+class ReactionRouter:
+    """Keeps a dict of message id -> registrations, so each reaction is dispatched with one lookup.
+
+    Reactions from bots (including this one adding its own options) are never routed.
+    """
+    def __init__(self, bot):
+        self.bot = bot
+        self._routes = {}  # {message_id: [_Route, ...]}
+        bot.add_listener(self.on_reaction_add)
+
+    @property
+    def active(self) -> int:
+        """The number of registrations currently waiting for reactions."""
+        return sum(len(routes) for routes in self._routes.values())
+
+    def _add(self, message_id: int, route: _Route):
+        self._routes.setdefault(message_id, []).append(route)
+
+    def _remove(self, message_id: int, route: _Route):
+        routes = self._routes.get(message_id)
+        if routes is None:
+            return
+        try:
+            routes.remove(route)
+        except ValueError:
+            pass
+        if not routes:
+            del self._routes[message_id]
+
+    async def wait(self, message: Message, emojis=None, user=None, timeout: float = None):
+        """
+        Waits for a reaction on the message, like bot.wait_for('reaction_add') but without a check closure
+        :param message: the message to watch
+        :param emojis: the emojis to accept, or None for any
+        :param user: the only user to accept, or None for anyone
+        :param timeout: seconds to wait before raising asyncio.TimeoutError
+        :return: a tuple of (reaction, user)
+        """
+        route = _Route(set(emojis) if emojis is not None else None, None if user is None else user.id,
+                       future=self.bot.loop.create_future())
+        self._add(message.id, route)
+        try:
+            return await asyncio.wait_for(route.future, timeout)
+        finally:
+            self._remove(message.id, route)
+
+    def subscribe(self, message: Message, callback, emojis=None, timeout: float = None):
+        """
+        Calls `await callback(reaction, user)` for every reaction added to the message, until unsubscribed
+        :param timeout: seconds after which the subscription is removed anyway, in case it's never unsubscribed
+        :return: a handle to pass to unsubscribe
+        """
+        route = _Route(set(emojis) if emojis is not None else None, callback=callback)
+        self._add(message.id, route)
+        if timeout is not None:
+            self.bot.loop.call_later(timeout, self._remove, message.id, route)
+        return message.id, route
+
+    def unsubscribe(self, handle):
+        self._remove(*handle)
+
+    async def on_reaction_add(self, reaction: Reaction, user):
+        if user.bot:
+            return
+        routes = self._routes.get(reaction.message.id)
+        if routes is None:
+            return
+        for route in list(routes):
+            if not route.matches(reaction, user):
+                continue
+            if route.future is not None:
+                if not route.future.done():
+                    route.future.set_result((reaction, user))
+            else:
+                try:
+                    await route.callback(reaction, user)
+                except Exception as e:
+                    log.error("Reaction callback failed", message=reaction.message.id, exc_info=e)
@@ -0,0 +1,117 @@
+# Caches the rendered output of read-only commands (profile, roleinfo, col), so repeated calls in a big guild
+# don't redo the sorts and scans behind them.
+from collections import Counter, OrderedDict
+from discord import Guild, Member, Role, User
+from time import monotonic
+
+
+class ResultCache:
+    """Entries are keyed by (command, subject id) per guild, and dropped when a member or role event could change them.
+
+    Each guild keeps its `per_guild` most recently used entries. Entries also expire after `ttl` seconds, as some
+    output mentions how long ago something happened.
+    """
+    def __init__(self, bot, per_guild: int = 64, ttl: float = 600.0):
+        self.bot = bot
+        self.per_guild = per_guild
+        self.ttl = ttl
+        self._cache = {}  # {guild_id: OrderedDict{(command, subject_id): (expires, value)}}
+        self.hits = Counter()  # {command: hits}
+        self.misses = Counter()  # {command: misses}
+
+        bot.guild_settings.listeners.append(self._on_settings_change)
+        for listener in (self.on_member_join, self.on_member_remove, self.on_member_update, self.on_user_update,
+                         self.on_guild_role_create, self.on_guild_role_delete, self.on_guild_role_update,
+                         self.on_guild_remove, self.on_ready):
+            bot.add_listener(listener)
+
+    def get(self, guild: Guild, command: str, subject_id: int = None):
+        """
+        Fetches a cached result
+        :param command: the command name, e.g. "profile"
+        :param subject_id: the id of what the result is about (e.g. the member), if anything
+        :return: the value, or None if there isn't one
+        """
+        entries = self._cache.get(guild.id)
+        entry = None if entries is None else entries.get((command, subject_id))
+        if entry is None or entry[0] < monotonic():
+            self.misses[command] += 1
+            return None
+        entries.move_to_end((command, subject_id))
+        self.hits[command] += 1
+        return entry[1]
+
+    def put(self, guild: Guild, command: str, subject_id: int, value):
+        """Caches a result - it's handed out as is, so copy it before changing anything per call."""
+        entries = self._cache.get(guild.id)
+        if entries is None:
+            entries = self._cache[guild.id] = OrderedDict()
+        entries[(command, subject_id)] = (monotonic() + self.ttl, value)
+        entries.move_to_end((command, subject_id))
+        while len(entries) > self.per_guild:
+            entries.popitem(last=False)
+
+    def drop(self, guild_id: int, command: str = None, subject_id: int = None):
+        """Drops a guild's entries for the command and/or subject, or every entry if neither is given."""
+        entries = self._cache.get(guild_id)
+        if not entries:
+            return
+        for key in [key for key in entries if (command is None or key[0] == command) and
+                    (subject_id is None or key[1] == subject_id)]:
+            del entries[key]
+
+    def invalidate(self, guild_id: int = None):
+        """Drops every entry for one guild, or every guild if no id is given."""
+        if guild_id is None:
+            self._cache.clear()
+        else:
+            self._cache.pop(guild_id, None)
+
+    def hit_rate(self, command: str = None) -> float:
+        hits = self.hits[command] if command else sum(self.hits.values())
+        misses = self.misses[command] if command else sum(self.misses.values())
+        return hits / (hits + misses) if hits + misses else 0.0
+
+    @property
+    def size(self) -> int:
+        return sum(len(entries) for entries in self._cache.values())
+
+    def _on_settings_change(self, guild_str: str):
+        # col shows the colour role and limit.
+        self.drop(int(guild_str), "col")
+
+    async def on_member_join(self, member: Member):
+        # Join positions and role member counts change for everyone.
+        self.drop(member.guild.id, "profile")
+        self.drop(member.guild.id, "roleinfo")
+
+    async def on_member_remove(self, member: Member):
+        self.drop(member.guild.id, "profile")
+        self.drop(member.guild.id, "roleinfo")
+        self.drop(member.guild.id, subject_id=member.id)
+
+    async def on_member_update(self, before: Member, after: Member):
+        if before.roles != after.roles:
+            self.drop(after.guild.id, "roleinfo")
+        self.drop(after.guild.id, subject_id=after.id)
+
+    async def on_user_update(self, before: User, after: User):
+        for guild_id in self._cache:
+            self.drop(guild_id, subject_id=after.id)
+
+    async def on_guild_role_create(self, role: Role):
+        self.drop(role.guild.id, "roleinfo")
+
+    async def on_guild_role_delete(self, role: Role):
+        self.invalidate(role.guild.id)
+
+    async def on_guild_role_update(self, before: Role, after: Role):
+        # Role names, colours and positions show up in every cached result.
+        self.invalidate(after.guild.id)
+
+    async def on_guild_remove(self, guild: Guild):
+        self.invalidate(guild.id)
+
+    async def on_ready(self):
+        # discord.py rebuilds its Member and Role objects on reconnect, and events may have been missed.
+        self.invalidate()
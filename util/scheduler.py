@@ -0,0 +1,166 @@
+# Queues outbound Discord actions by rate-limit bucket, so bulk jobs (role shifts, cleanups) wait behind
+# interactive replies instead of competing with them for the same bucket.
+from collections import defaultdict
+from discord import Member, Message, Reaction, Role
+from itertools import count
+from time import monotonic
+import asyncio
+from util.logs import get_logger
+from util.tracing import activate, current_span
+import heapq
+
+log = get_logger(__name__)
+
+# Lower runs first.
+INTERACTIVE = 0
+BULK = 10
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "enqueued", "func", "args", "kwargs", "future", "edit_of", "span")
+
+    def __init__(self, priority, seq, func, args, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = monotonic()
+        self.func = func  # Called with *args, **kwargs to get the coroutine, when the job is run
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.edit_of = None  # The message id, for edits that later edits can be merged into
+        # A bucket's worker task outlives the command that started it, so each job carries its submitter's span.
+        self.span = current_span()
+
+    def __lt__(self, other):
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+
+class BucketStats:
+    __slots__ = ("completed", "failed", "coalesced", "total_wait", "max_wait")
+
+    def __init__(self):
+        self.completed = 0
+        self.failed = 0
+        self.coalesced = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    @property
+    def mean_wait(self) -> float:
+        return self.total_wait / max(self.completed + self.failed, 1)
+
+
+class _JobFuture(asyncio.Future):
+    """A future that knows whether it's been awaited, so failures are only logged when nobody else will see them."""
+    awaited = False
+
+    def __await__(self):
+        self.awaited = True
+        return super().__await__()
+
+    __iter__ = __await__
+
+
+def _log_failure(future: _JobFuture):
+    # Retrieving the exception here also stops asyncio warning about it when nobody awaited the job. A caller that
+    # awaited it gets the exception raised, and handles (or reports) it there.
+    if not future.cancelled() and future.exception() is not None and not future.awaited:
+        log.warning("Scheduled action failed", error=future.exception())
+
+
+class ActionScheduler:
+    """One priority queue and one worker per bucket, so jobs in a bucket run one at a time, in priority order.
+
+    Every method returns a future, which can be awaited for the result or left to run in the background.
+    Edits to a message that hasn't been edited yet are merged into the pending edit.
+    """
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self._seq = count()
+        self._queues = defaultdict(list)  # {bucket: heap of _Job}
+        self._workers = {}  # {bucket: Task}
+        self._pending_edits = {}  # {message_id: _Job}
+        self.stats = defaultdict(BucketStats)  # {bucket: BucketStats}
+
+    def depth(self) -> dict:
+        """The number of jobs waiting in each bucket."""
+        return {bucket: len(queue) for bucket, queue in self._queues.items() if queue}
+
+    def submit(self, bucket, func, *args, priority: int = INTERACTIVE, **kwargs) -> asyncio.Future:
+        """
+        Queues `await func(*args, **kwargs)` to run in the bucket
+        :param bucket: a hashable key, matching the route Discord rate-limits the action under
+        """
+        return self._submit(bucket, func, args, kwargs, priority).future
+
+    def _submit(self, bucket, func, args, kwargs, priority) -> _Job:
+        future = _JobFuture(loop=self._loop)
+        future.add_done_callback(_log_failure)
+        job = _Job(priority, next(self._seq), func, args, kwargs, future)
+        heapq.heappush(self._queues[bucket], job)
+        if bucket not in self._workers:
+            self._workers[bucket] = self._loop.create_task(self._work(bucket))
+        return job
+
+    async def _work(self, bucket):
+        queue = self._queues[bucket]
+        stats = self.stats[bucket]
+        try:
+            while queue:
+                job = heapq.heappop(queue)
+                if job.edit_of is not None:
+                    del self._pending_edits[job.edit_of]
+                wait = monotonic() - job.enqueued
+                stats.total_wait += wait
+                stats.max_wait = max(stats.max_wait, wait)
+                try:
+                    with activate(job.span):
+                        result = await job.func(*job.args, **job.kwargs)
+                except Exception as e:
+                    stats.failed += 1
+                    if not job.future.done():
+                        job.future.set_exception(e)
+                else:
+                    stats.completed += 1
+                    if not job.future.done():
+                        job.future.set_result(result)
+        finally:
+            # If cancelled part way through, the next job submitted to the bucket starts a new worker.
+            del self._workers[bucket]
+
+    def add_roles(self, member: Member, *roles: Role, priority: int = INTERACTIVE):
+        return self.submit(("member_roles", member.guild.id), member.add_roles, *roles, priority=priority)
+
+    def remove_roles(self, member: Member, *roles: Role, priority: int = INTERACTIVE):
+        return self.submit(("member_roles", member.guild.id), member.remove_roles, *roles, priority=priority)
+
+    def delete_role(self, role: Role, priority: int = INTERACTIVE):
+        return self.submit(("roles", role.guild.id), role.delete, priority=priority)
+
+    def add_reaction(self, message: Message, emoji, priority: int = INTERACTIVE):
+        return self.submit(("reactions", message.channel.id), message.add_reaction, emoji, priority=priority)
+
+    def remove_reaction(self, reaction: Reaction, user, priority: int = INTERACTIVE):
+        return self.submit(("reactions", reaction.message.channel.id), reaction.remove, user, priority=priority)
+
+    def clear_reactions(self, message: Message, priority: int = INTERACTIVE):
+        return self.submit(("reactions", message.channel.id), message.clear_reactions, priority=priority)
+
+    def clear_reaction(self, message: Message, emoji, priority: int = INTERACTIVE):
+        return self.submit(("reactions", message.channel.id), message.clear_reaction, emoji, priority=priority)
+
+    def edit(self, message: Message, priority: int = INTERACTIVE, **fields):
+        """Queues message.edit(**fields), merging it into an earlier edit of the message if that's still queued."""
+        bucket = ("messages", message.channel.id)
+        pending = self._pending_edits.get(message.id)
+        if pending is not None:
+            pending.kwargs.update(fields)
+            self.stats[bucket].coalesced += 1
+            if priority < pending.priority:
+                pending.priority = priority
+                heapq.heapify(self._queues[bucket])  # It's more urgent now, so re-sort
+            return pending.future
+        job = self._submit(bucket, message.edit, (), fields, priority)
+        job.edit_of = message.id
+        self._pending_edits[message.id] = job
+        return job.future
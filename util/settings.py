@@ -0,0 +1,186 @@
+# Per-guild settings and cog state, kept in memory and written back to disk one guild at a time as they change.
+# Several processes can share one database file, as long as each only writes the guilds it owns.
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from json import load, dumps, loads
+import asyncio
+import os.path
+import sqlite3
+from util.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class TrackedDict(dict):
+    """A dict that calls on_change whenever it (or any dict nested inside it) is modified.
+
+    Lists aren't tracked, so a list setting has to be reassigned for the change to be saved.
+    """
+    def __init__(self, data, on_change):
+        super().__init__()
+        self._on_change = on_change
+        for key, value in dict(data).items():
+            dict.__setitem__(self, key, self._track(value))
+
+    def _track(self, value):
+        if isinstance(value, dict):
+            return TrackedDict(value, self._on_change)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, self._track(value))
+        self._on_change()
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self._on_change()
+
+    def pop(self, key, *default):
+        value = super().pop(key, *default)
+        self._on_change()
+        return value
+
+    def popitem(self):
+        item = super().popitem()
+        self._on_change()
+        return item
+
+    def setdefault(self, key, default=None):
+        if key not in self:
+            self[key] = default
+        return self[key]
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).items():
+            super().__setitem__(key, self._track(value))
+        self._on_change()
+
+    def clear(self):
+        super().clear()
+        self._on_change()
+
+
+class SQLiteBackend:
+    """Stores one JSON document per guild in an SQLite table, using WAL mode so reads never block writes.
+
+    All database access happens on a single worker thread, so the connection is never shared between threads.
+    """
+    def __init__(self, path: str, table: str, legacy_json: str = None):
+        self.path = path
+        self.table = table
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"sqlite-{table}")
+        self._conn = self.executor.submit(self._open, legacy_json).result()
+
+    def _open(self, legacy_json):
+        # Other processes may be writing, so wait for their locks rather than failing straight away.
+        conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        with conn:
+            # Take the write lock before checking, so only one process creates the table and imports into it.
+            conn.execute("BEGIN IMMEDIATE")
+            exists = conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name=?",
+                                  (self.table,)).fetchone()
+            if exists is None:
+                conn.execute(f"CREATE TABLE {self.table} (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL)")
+                # First run: bring across whatever the old JSON file held.
+                if legacy_json is not None and os.path.isfile(legacy_json):
+                    with open(legacy_json, "r", encoding="utf-8") as file:
+                        legacy = load(file)
+                    conn.executemany(f"INSERT INTO {self.table} VALUES (?, ?)",
+                                     [(key, dumps(value, ensure_ascii=False)) for key, value in legacy.items()])
+                    log.info("Imported legacy JSON", rows=len(legacy), file=legacy_json, table=self.table)
+        return conn
+
+    def load(self) -> dict:
+        def _load():
+            rows = self._conn.execute(f"SELECT guild_id, data FROM {self.table}").fetchall()
+            return {guild_id: loads(data) for guild_id, data in rows}
+        return self.executor.submit(_load).result()
+
+    def write(self, rows: dict):
+        """Upserts each row, deleting any whose value is None. Must run on the backend's executor."""
+        with self._conn:
+            for guild_id, data in rows.items():
+                if data is None:
+                    self._conn.execute(f"DELETE FROM {self.table} WHERE guild_id = ?", (guild_id,))
+                else:
+                    self._conn.execute(f"INSERT OR REPLACE INTO {self.table} VALUES (?, ?)", (guild_id, data))
+
+    def close(self):
+        self._conn.close()
+
+
+class SettingsStore(MutableMapping):
+    """Maps guild id strings to settings dicts, tracking which guilds have changed since the last write.
+
+    Changes made close together are batched: the first change starts a short timer, and when it fires every
+    dirty guild is serialised on the event loop (so handlers can't edit it mid-dump) then written by the backend
+    in its executor.
+    """
+    def __init__(self, backend, loop: asyncio.AbstractEventLoop, batch_delay: float = 2.0, owns=None):
+        """
+        :param owns: a predicate on guild id strings - only the rows it accepts are loaded. None loads every row.
+        """
+        self.backend = backend
+        self.batch_delay = batch_delay
+        self._loop = loop
+        self.listeners = []  # Called with the guild id string whenever that guild's settings change
+        self._dirty = set()
+        self._flush_handle = None
+        self._write_lock = asyncio.Lock()
+        self._data = {key: TrackedDict(value, self._on_change_callback(key))
+                      for key, value in backend.load().items() if owns is None or owns(key)}
+
+    def _on_change_callback(self, key):
+        return lambda: self.mark_dirty(key)
+
+    def mark_dirty(self, key: str):
+        self._dirty.add(key)
+        for listener in self.listeners:
+            listener(key)
+        if self._flush_handle is None:
+            self._flush_handle = self._loop.call_later(self.batch_delay, self._start_flush)
+
+    def _start_flush(self):
+        self._flush_handle = None
+        self._loop.create_task(self.flush())
+
+    async def flush(self):
+        async with self._write_lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            rows = {key: dumps(self._data[key], ensure_ascii=False) if key in self._data else None for key in dirty}
+            try:
+                await self._loop.run_in_executor(self.backend.executor, self.backend.write, rows)
+            except Exception as e:
+                log.error("Failed to save rows, retrying", rows=len(rows), table=self.backend.table, exc_info=e)
+                for key in dirty:
+                    self.mark_dirty(key)
+
+    async def close(self):
+        """Writes any outstanding changes, then closes the backend."""
+        await self.flush()
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        await self._loop.run_in_executor(self.backend.executor, self.backend.close)
+        self.backend.executor.shutdown()
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __setitem__(self, key, value):
+        self._data[key] = TrackedDict(value, self._on_change_callback(key))
+        self.mark_dirty(key)
+
+    def __delitem__(self, key):
+        del self._data[key]
+        self.mark_dirty(key)
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
@@ -0,0 +1,18 @@
+# Which shard (and so which process) a guild belongs to, using the same formula as Discord.
+from typing import Callable, Iterable, Optional
+
+
+def shard_for(guild_id: int, shard_count: int) -> int:
+    return (guild_id >> 22) % shard_count
+
+
+def guild_filter(shard_ids: Optional[Iterable[int]], shard_count: Optional[int]) -> Optional[Callable[[str], bool]]:
+    """
+    :param shard_ids: the shards this process runs, or None if it runs all of them
+    :param shard_count: the total number of shards across every process
+    :return: a predicate taking a guild id string, or None if this process owns every guild
+    """
+    if shard_ids is None or shard_count is None:
+        return None
+    owned = set(shard_ids)
+    return lambda guild_str: shard_for(int(guild_str), shard_count) in owned
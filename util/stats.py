@@ -0,0 +1,114 @@
+# Latency histograms and success/error counts for commands, event listeners and outbound HTTP calls.
+from bisect import bisect_left
+from collections import defaultdict
+from contextlib import contextmanager
+from heapq import nlargest
+from time import perf_counter
+
+# Upper bounds of each histogram bucket, in seconds. Anything slower goes in a final +Inf bucket.
+BOUNDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0,
+          30.0, 60.0, 300.0)
+EXPORTED_GUILDS = 20  # Per kind, only the busiest guilds are exported, so the guild label's values stay bounded
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "errors")
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.errors = 0
+
+    def observe(self, seconds: float, ok: bool = True):
+        self.counts[bisect_left(BOUNDS, seconds)] += 1
+        self.total += seconds
+        self.count += 1
+        if not ok:
+            self.errors += 1
+
+    def quantile(self, q: float) -> float:
+        """Estimates the q-th quantile, interpolating linearly inside the bucket it falls in."""
+        if self.count == 0:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for num, bucket_count in enumerate(self.counts):
+            if seen + bucket_count >= rank and bucket_count:
+                lower = BOUNDS[num - 1] if num > 0 else 0.0
+                upper = BOUNDS[num] if num < len(BOUNDS) else BOUNDS[-1]
+                return lower + (upper - lower) * (rank - seen) / bucket_count
+            seen += bucket_count
+        return BOUNDS[-1]
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class Stats:
+    """Keeps one histogram per (kind, name) and one per (kind, guild id), e.g. ("command", "steam")."""
+    def __init__(self):
+        self.by_name = {}  # {(kind, name): Histogram}
+        self.by_guild = {}  # {(kind, guild_id): Histogram}
+
+    def observe(self, kind: str, name: str, seconds: float, guild_id: int = None, ok: bool = True):
+        histogram = self.by_name.get((kind, name))
+        if histogram is None:
+            histogram = self.by_name[(kind, name)] = Histogram()
+        histogram.observe(seconds, ok)
+        if guild_id is not None:
+            histogram = self.by_guild.get((kind, guild_id))
+            if histogram is None:
+                histogram = self.by_guild[(kind, guild_id)] = Histogram()
+            histogram.observe(seconds, ok)
+
+    @contextmanager
+    def timer(self, kind: str, name: str, guild_id: int = None):
+        """Times the body of a with block, counting it as an error if it raises."""
+        start = perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(kind, name, perf_counter() - start, guild_id, ok)
+
+    def busiest_guilds(self, limit: int) -> dict:
+        """{(kind, guild_id): Histogram} for the `limit` guilds with the most observations of each kind."""
+        by_kind = defaultdict(list)
+        for key, histogram in self.by_guild.items():
+            by_kind[key[0]].append((key, histogram))
+        return {key: histogram for entries in by_kind.values()
+                for key, histogram in nlargest(limit, entries, key=lambda entry: entry[1].count)}
+
+    def to_prometheus(self, prefix: str = "sixthbot", guilds: int = EXPORTED_GUILDS) -> str:
+        """
+        Renders the histograms in the Prometheus text exposition format
+        :param guilds: how many of the busiest guilds of each kind to include per-guild histograms for
+        """
+        lines = []
+        for metric, histograms, label in ((f"{prefix}_latency_seconds", self.by_name, "name"),
+                                          (f"{prefix}_guild_latency_seconds", self.busiest_guilds(guilds), "guild")):
+            lines.append(f"# TYPE {metric} histogram")
+            for (kind, key), histogram in histograms.items():
+                labels = f'kind="{kind}",{label}="{_escape(str(key))}"'
+                cumulative = 0
+                for num, bucket_count in enumerate(histogram.counts):
+                    cumulative += bucket_count
+                    le = repr(BOUNDS[num]) if num < len(BOUNDS) else "+Inf"
+                    lines.append(f'{metric}_bucket{{{labels},le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{labels}}} {histogram.total}")
+                lines.append(f"{metric}_count{{{labels}}} {histogram.count}")
+        lines.append(f"# TYPE {prefix}_errors_total counter")
+        for (kind, name), histogram in self.by_name.items():
+            lines.append(f'{prefix}_errors_total{{kind="{kind}",name="{_escape(name)}"}} {histogram.errors}')
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Shared by the whole process, so module-level helpers without a bot reference can record timings too.
+stats = Stats()
@@ -0,0 +1,171 @@
+# Spans for commands and event handlers, with a child span for every HTTP and Discord REST call made under them,
+# so a slow command can be broken down into the calls that took the time.
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+from time import perf_counter, time
+from util.logs import json_lines_logger
+import asyncio
+
+_current_span = ContextVar("current_span", default=None)
+# The span open in each task, for other threads (the loop watchdog) - they can't read another thread's ContextVar.
+_task_spans = {}  # {Task: Span}
+
+
+class Span:
+    __slots__ = ("name", "kind", "span_id", "root", "start_time", "start", "duration", "attrs", "error",
+                 "children", "handed_off")
+
+    def __init__(self, name: str, kind: str, span_id: int, root, attrs: dict):
+        self.name = name
+        self.kind = kind  # "command", "event", "http" or "discord"
+        self.span_id = span_id
+        self.root = root or self  # The span that started the trace
+        self.start_time = time()
+        self.start = perf_counter()
+        self.duration = None  # Seconds, once finished
+        self.attrs = attrs
+        self.error = None
+        self.children = []  # Finished child spans
+        self.handed_off = False  # Set on a trace when a command inside it starts its own trace
+
+    def walk(self, depth: int = 0):
+        """Yields (depth, span) for this span and every finished span under it, in start order."""
+        yield depth, self
+        for child in sorted(self.children, key=lambda span: span.start):
+            yield from child.walk(depth + 1)
+
+    def to_dict(self) -> dict:
+        return {
+            "trace": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "time": self.start_time,
+            "ms": round(self.duration * 1000, 2),
+            "attrs": self.attrs,
+            "error": self.error,
+            "spans": [{"depth": depth, "name": span.name, "kind": span.kind,
+                       "offset_ms": round((span.start - self.start) * 1000, 2),
+                       "ms": round(span.duration * 1000, 2), "error": span.error}
+                      for depth, span in self.walk() if span is not self],
+        }
+
+
+class Tracer:
+    """Keeps the most recent traces in memory, and writes them to a rotating JSON lines file once open() is called.
+
+    Command traces are always kept. Event handlers run far more often, so their traces are only kept if they
+    fail or take longer than `slow_event` seconds.
+    """
+    def __init__(self, history: int = 200, slow_event: float = 0.1):
+        self.recent = deque(maxlen=history)  # Finished root spans
+        self.slow_event = slow_event
+        self._ids = count(1)
+        self._file = None
+
+    def open(self, path: str = "logs/traces.jsonl"):
+        if self._file is None:
+            self._file = json_lines_logger("sixthbot.traces", path)
+
+    @contextmanager
+    def span(self, name: str, kind: str, root: bool = False, **attrs):
+        """
+        Times the body of a with block as a span, under the span that's currently open (if any)
+        :param root: start a new trace, even if a span is already open
+        :param attrs: anything else to record with it, e.g. guild=guild.id
+        """
+        parent = _current_span.get()
+        if root and parent is not None:
+            parent.root.handed_off = True
+            parent = None
+        span = Span(name, kind, next(self._ids), parent.root if parent else None, attrs)
+        token = _current_span.set(span)
+        task, previous = _enter_task_span(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = type(e).__name__
+            raise
+        finally:
+            span.duration = perf_counter() - span.start
+            _current_span.reset(token)
+            _exit_task_span(task, previous)
+            if parent is not None:
+                parent.children.append(span)
+            else:
+                self._finish(span)
+
+    @contextmanager
+    def child(self, name: str, kind: str, **attrs):
+        """Like span, but does nothing outside a trace - for calls that are only interesting as part of one."""
+        if _current_span.get() is None:
+            yield None
+            return
+        with self.span(name, kind, **attrs) as span:
+            yield span
+
+    def _finish(self, span: Span):
+        if span.handed_off:
+            return
+        if span.kind == "event" and span.error is None and span.duration < self.slow_event:
+            return
+        self.recent.append(span)
+        if self._file is not None:
+            self._file.info(span.to_dict())
+
+    def slowest(self, num: int) -> list:
+        return sorted(self.recent, key=lambda span: span.duration, reverse=True)[:num]
+
+
+def current_span():
+    return _current_span.get()
+
+
+def task_span(task):
+    """The span open in a task, or None. Safe to call from any thread."""
+    return _task_spans.get(task)
+
+
+def _enter_task_span(span) -> tuple:
+    """
+    Records `span` (or None, for no span) as the one open in the running task
+    :return: (the task, the span it had before), to pass to _exit_task_span once the span closes
+    """
+    try:
+        task = asyncio.current_task()
+    except RuntimeError:  # No running loop
+        return None, None
+    if task is None:
+        return None, None
+    previous = _task_spans.get(task)
+    _set_task_span(task, span)
+    return task, previous
+
+
+def _exit_task_span(task, previous):
+    if task is not None:
+        _set_task_span(task, previous)
+
+
+def _set_task_span(task, span):
+    if span is None:
+        _task_spans.pop(task, None)
+    else:
+        _task_spans[task] = span
+
+
+@contextmanager
+def activate(span):
+    """Makes spans opened in the block children of `span`, for work done by a long-lived task on another's behalf."""
+    token = _current_span.set(span)
+    task, previous = _enter_task_span(span)
+    try:
+        yield
+    finally:
+        _current_span.reset(token)
+        _exit_task_span(task, previous)
+
+
+# Shared by the whole process, like util.stats.stats, so the cogs' HTTP helpers can open spans without a bot.
+tracer = Tracer()
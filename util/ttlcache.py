@@ -0,0 +1,95 @@
+# A size-bounded cache whose entries expire, optionally saved to a JSON file so it survives restarts.
+from collections import OrderedDict
+from json import dump, load
+from time import time
+import os
+import os.path
+from util.logs import get_logger
+
+log = get_logger(__name__)
+
+
+class TTLCache:
+    """Keeps up to `max_entries` values for `ttl` seconds each, evicting the least recently used first.
+
+    With a `path`, entries are loaded from it on creation and written back with snapshot() then write(), so keys and
+    values must be JSON serialisable, and keys strings. Expiry times are wall clock times, so they still hold after a
+    restart.
+    """
+    def __init__(self, max_entries: int, ttl: float, path: str = None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self._entries = OrderedDict()  # {key: (expires, value)}
+        self.hits = 0
+        self.misses = 0
+        self.dirty = False  # Whether there's anything new to save
+        if path is not None:
+            self.load()
+
+    def get(self, key, default=None):
+        entry = self._entries.get(key)
+        if entry is None or entry[0] < time():
+            self.misses += 1
+            return default
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key, value, ttl: float = None):
+        self._entries[key] = (time() + (self.ttl if ttl is None else ttl), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self.dirty = True
+
+    def drop(self, key):
+        if self._entries.pop(key, None) is not None:
+            self.dirty = True
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0
+
+    def load(self):
+        if not os.path.isfile(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as file:
+                saved = load(file)
+        except ValueError as e:
+            log.warning("Ignoring unreadable cache file", path=self.path, error=e)
+            return
+        now = time()
+        # Saved oldest first, so the most recently used end up at the end again.
+        for key, expires, value in saved:
+            if expires > now:
+                self._entries[key] = (expires, value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def snapshot(self):
+        """
+        Takes the unexpired entries to save, on the event loop so nothing changes them mid-copy
+        :return: the entries to pass to write(), or None if there's nothing new to save
+        """
+        if self.path is None or not self.dirty:
+            return None
+        now = time()
+        self.dirty = False
+        return [(key, expires, value) for key, (expires, value) in self._entries.items() if expires > now]
+
+    def write(self, saved: list):
+        """Writes a snapshot to the path, replacing the file in one go so a crash can't leave half of it. Safe to
+        run in an executor, off the event loop."""
+        temp_path = self.path + ".tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as file:
+                dump(saved, file, ensure_ascii=False)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            log.error("Failed to save cache file", path=self.path, exc_info=e)
+            self.dirty = True  # Try again next time
@@ -0,0 +1,116 @@
+# Measures event loop lag from a separate thread, and when the loop stalls, records what was blocking it.
+from collections import deque
+from datetime import datetime
+from time import monotonic
+import os.path
+import sys
+import asyncio
+import threading
+import traceback
+from util.logs import get_logger
+from util.tracing import task_span
+
+log = get_logger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class Stall:
+    __slots__ = ("time", "lag", "culprit", "frame", "stack")
+
+    def __init__(self, lag: float, culprit: str, frame: str, stack: traceback.StackSummary):
+        self.time = datetime.utcnow()
+        self.lag = lag
+        self.culprit = culprit  # e.g. "command steam", "event Quiz.record_answer" or "cog collage"
+        self.frame = frame  # e.g. "cogs/collage.py:collage", the innermost frame from this project
+        self.stack = stack
+
+
+def find_frame(stack: traceback.StackSummary) -> str:
+    """Names the innermost frame that belongs to the bot (rather than discord.py, PIL or the stdlib)."""
+    for frame in reversed(stack):
+        filename = os.path.abspath(frame.filename)
+        if filename.startswith(PROJECT_ROOT) and not filename.endswith("watchdog.py"):
+            return f"{os.path.relpath(filename, PROJECT_ROOT)}:{frame.name}"
+    return f"{os.path.basename(stack[-1].filename)}:{stack[-1].name}" if stack else "unknown"
+
+
+def find_culprit(span, frame: str) -> str:
+    """
+    Names the command or event listener that was running, from the trace it was part of, or failing that, the cog
+    whose file the blocking frame is in
+    :param span: the span open in the task that was running, if any
+    :param frame: as returned by find_frame
+    """
+    if span is not None:
+        return f"{span.root.kind} {span.root.name}"
+    path = frame.split(":", 1)[0].replace(os.sep, "/")
+    if path.startswith("cogs/"):
+        return f"cog {path[len('cogs/'):-len('.py')]}"
+    return frame
+
+
+class LoopWatchdog:
+    """Every `interval` seconds, a daemon thread schedules a callback on the loop and waits for it to run.
+
+    If it hasn't run after `threshold` seconds, the loop is blocked, so the thread takes the loop thread's
+    current stack - the code doing the blocking - then waits for the loop to recover to measure the full stall.
+    """
+    def __init__(self, loop, stats=None, interval: float = 0.5, threshold: float = 0.25, history: int = 50):
+        self.loop = loop
+        self.stats = stats
+        self.interval = interval
+        self.threshold = threshold
+        self.stalls = deque(maxlen=history)
+        self.last_lag = 0.0
+        self.max_lag = 0.0
+        self._loop_thread_id = None
+        self._answered = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Must be called from the loop's thread."""
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._thread = threading.Thread(target=self._run, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self._answered.clear()
+            sent = monotonic()
+            try:
+                self.loop.call_soon_threadsafe(self._answered.set)
+            except RuntimeError:  # The loop has closed
+                return
+            stall = None
+            if not self._answered.wait(self.threshold):
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = traceback.extract_stack(frame) if frame is not None else traceback.StackSummary()
+                del frame
+                span = task_span(asyncio.current_task(self.loop))
+                while not self._answered.wait(1.0):
+                    if self._stopped.is_set():
+                        return
+                blocking_frame = find_frame(stack)
+                stall = Stall(monotonic() - sent, find_culprit(span, blocking_frame), blocking_frame, stack)
+            lag = monotonic() - sent
+            self.last_lag = lag
+            self.max_lag = max(self.max_lag, lag)
+            # Recorded on the loop's thread, since that's the only thread that touches the stats.
+            try:
+                self.loop.call_soon_threadsafe(self._record, lag, stall)
+            except RuntimeError:
+                return
+
+    def _record(self, lag, stall):
+        if self.stats is not None:
+            self.stats.observe("loop", "lag", lag)
+        if stall is not None:
+            self.stalls.append(stall)
+            log.warning("Event loop blocked", lag_ms=round(stall.lag * 1000), culprit=stall.culprit, frame=stall.frame)
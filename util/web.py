@@ -0,0 +1,312 @@
+# The bot-wide HTTP client for external APIs (Steam, Giphy, OpenTDB). Discord's own API goes through bot.http.
+from aiohttp import ClientError, ClientSession, ClientTimeout, TCPConnector
+from codecs import getincrementaldecoder
+from collections import Counter, OrderedDict
+from contextlib import asynccontextmanager, nullcontext
+from functools import partial
+from json import loads
+from time import monotonic, perf_counter
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+import asyncio
+from util.circuit import CircuitBreaker, OPEN
+from util.jsonstream import JsonArrayStream
+from util.stats import stats
+from util.tracing import tracer
+from util.logs import get_logger
+
+log = get_logger(__name__)
+
+USER_AGENT = "6thBot"
+DEFAULT_PORTS = {"http": 80, "https": 443}
+# Per host settings, which json/web.json can override: "timeout" for the whole request, and "hedge_after" to send
+# a second copy of a request that's taken longer than that many seconds, using whichever answers first.
+DEFAULT_HOSTS = {
+    "api.steampowered.com": {"timeout": 10.0},
+    "api.giphy.com": {"timeout": 8.0},
+    "opentdb.com": {"timeout": 8.0},
+}
+STALE_ENTRIES = 128  # Bodies kept to fall back on, for requests that allow stale responses
+STREAM_CHUNK = 64 * 1024  # Bytes read at a time from streamed responses
+
+
+class UpstreamError(Exception):
+    """An external API timed out, couldn't be reached, or answered with a server error."""
+    def __init__(self, host: str, reason: str):
+        super().__init__(f"{host}: {reason}")
+        self.host = host
+        self.reason = reason
+
+
+class UpstreamUnavailable(UpstreamError):
+    """The host's circuit breaker is open, so the request wasn't sent."""
+
+
+def normalise_url(url: str) -> str:
+    """The same URL however it was written: lower case scheme and host, no default port or fragment, and the query
+    parameters in order."""
+    parts = urlsplit(url)
+    scheme = parts.scheme.lower()
+    netloc = (parts.hostname or "").lower()
+    if parts.port is not None and parts.port != DEFAULT_PORTS.get(scheme):
+        netloc += f":{parts.port}"
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return urlunsplit((scheme, netloc, parts.path or "/", query, ""))
+
+
+class WebClient:
+    """Shares one pooled aiohttp session between every cog, so connections and DNS lookups are reused across calls.
+
+    Identical requests made while one is already in flight wait for it and share its body, rather than going out
+    again. Each host has a circuit breaker: once it's failing, requests to it raise UpstreamUnavailable straight
+    away (or get a stale response, if they allow one) until a probe request gets through again.
+    The session is created on the first request, as aiohttp wants it made from inside the running loop.
+    """
+    def __init__(self, limit: int = 50, limit_per_host: int = 8, dns_ttl: int = 300, keepalive: float = 30.0,
+                 connect_timeout: float = 5.0, total_timeout: float = 20.0, hosts: dict = None,
+                 failure_threshold: int = 5, reset_after: float = 30.0):
+        """
+        :param limit: the most connections open at once
+        :param limit_per_host: the most connections open to any one host - more requests wait for one to free up
+        :param dns_ttl: seconds to cache DNS lookups for
+        :param keepalive: seconds to keep an idle connection open for
+        :param connect_timeout: seconds to wait for a connection (including waiting for a free one in the pool)
+        :param total_timeout: seconds a whole request may take, for hosts without their own timeout
+        :param hosts: {host: {"timeout": seconds, "hedge_after": seconds}}, merged over DEFAULT_HOSTS
+        :param failure_threshold: failures in a row before a host's breaker opens
+        :param reset_after: seconds an open breaker waits before letting a probe request through
+        """
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.dns_ttl = dns_ttl
+        self.keepalive = keepalive
+        self.connect_timeout = connect_timeout
+        self.timeout = ClientTimeout(total=total_timeout, connect=connect_timeout)
+        self.hosts = {host: dict(settings) for host, settings in DEFAULT_HOSTS.items()}
+        for host, settings in (hosts or {}).items():
+            self.hosts.setdefault(host, {}).update(settings)
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.breakers = {}  # {host: CircuitBreaker}
+        self._session = None
+        self._in_flight = {}  # {normalised url: Task fetching its body}
+        self._waiting = Counter()  # {normalised url: callers waiting for it}
+        self._last_good = OrderedDict()  # {normalised url: (monotonic time, body)}
+        self.requests = Counter()  # {host: requests sent}
+        self.coalesced = Counter()  # {host: requests that shared one already in flight}
+        self.hedged = Counter()  # {host: requests that were sent a second time for taking too long}
+        self.stale = Counter()  # {host: stale responses served}
+
+    @property
+    def session(self) -> ClientSession:
+        if self._session is None or self._session.closed:
+            connector = TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host, ttl_dns_cache=self.dns_ttl,
+                                     keepalive_timeout=self.keepalive)
+            self._session = ClientSession(connector=connector, timeout=self.timeout,
+                                          headers={"User-Agent": USER_AGENT})
+        return self._session
+
+    def breaker(self, host: str) -> CircuitBreaker:
+        breaker = self.breakers.get(host)
+        if breaker is None:
+            breaker = self.breakers[host] = CircuitBreaker(self.failure_threshold, self.reset_after)
+        return breaker
+
+    async def get_text(self, url: str, stale: float = 0.0) -> str:
+        """
+        Fetches a URL's body as text, timing it by host in the stats and as a child span of the current trace
+        :param stale: if the request fails or the host is failing, return the last body fetched for this URL
+            instead, as long as it's no more than this many seconds old
+        :return: the body - shared with any other caller that asked for the same URL while it was in flight. The
+            request is only cancelled once every caller waiting for it has been.
+        :raises UpstreamError: if the request failed, or UpstreamUnavailable if the host's breaker is open
+        """
+        parts = urlsplit(url)
+        host = parts.netloc
+        key = normalise_url(url)
+        task = self._in_flight.get(key)
+        if task is not None:
+            self.coalesced[host] += 1
+            span = tracer.child(host + parts.path, "http", coalesced=True)
+        else:
+            breaker = self.breaker(host)
+            if not breaker.allow():
+                return self._fall_back(key, host, stale,
+                                       UpstreamUnavailable(host, f"failing, retrying in {breaker.retry_in:.0f}s"))
+            self.requests[host] += 1
+            # A task of its own, so callers sharing it aren't cancelled along with whichever one started it.
+            task = self._in_flight[key] = asyncio.ensure_future(self._fetch(url, key, host, keep=stale > 0))
+            task.add_done_callback(partial(self._request_done, key))
+            span = nullcontext()
+        self._waiting[key] += 1
+        try:
+            with span:
+                return await asyncio.shield(task)
+        except UpstreamError as error:
+            return self._fall_back(key, host, stale, error)
+        except asyncio.CancelledError:
+            if self._waiting[key] == 1:
+                task.cancel()  # Nobody else is waiting for it, so there's no point finishing it
+            raise
+        finally:
+            self._waiting[key] -= 1
+            if not self._waiting[key]:
+                del self._waiting[key]
+
+    async def get_json(self, url: str, stale: float = 0.0):
+        """Fetches and parses a JSON body, whatever its status code below 500 - the APIs used describe their errors
+        in it. Takes the same arguments as get_text."""
+        return loads(await self.get_text(url, stale))
+
+    async def scan_json_array(self, url: str, key: str, handle) -> int:
+        """
+        Streams a JSON response, decoding the items of the array under `key` as they arrive and passing each to
+        `handle`, so the whole body is never held at once. Not shared with identical requests, hedged or cached.
+        :param key: the array's key, e.g. "games" - the first array under that key, at any depth, is used
+        :param handle: called with each item, in order
+        :return: the number of items, or None if the response had no such array
+        :raises UpstreamError: like get_text, with UpstreamUnavailable if the host's breaker is open
+        """
+        host = urlsplit(url).netloc
+        breaker = self.breaker(host)
+        if not breaker.allow():
+            raise UpstreamUnavailable(host, f"failing, retrying in {breaker.retry_in:.0f}s")
+        self.requests[host] += 1
+        parser = JsonArrayStream(key)
+        try:
+            async with self._request(url, host) as resp:
+                decoder = getincrementaldecoder(resp.charset or "utf-8")(errors="replace")
+                async for chunk in resp.content.iter_chunked(STREAM_CHUNK):
+                    for item in parser.feed(decoder.decode(chunk)):
+                        handle(item)
+                for item in parser.feed(decoder.decode(b"", final=True)):
+                    handle(item)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except UpstreamError as error:
+            self._record_failure(host, error)
+            raise
+        except BaseException:
+            # Anything else (a bad body, or `handle` failing) says nothing about the host's health, but a probe's
+            # slot still has to be given back, or the breaker would never let another request through.
+            breaker.record_cancelled()
+            raise
+        self._record_success(host)
+        if parser.found and not parser.done:
+            raise ValueError(f"The JSON array {key!r} from {host} was cut off")
+        return parser.count if parser.found else None
+
+    def _request_done(self, key: str, task: asyncio.Task):
+        del self._in_flight[key]
+        if not task.cancelled():
+            task.exception()  # Marks it retrieved, in case every caller was cancelled before it finished
+
+    def _fall_back(self, key: str, host: str, stale: float, error: UpstreamError) -> str:
+        entry = self._last_good.get(key)
+        if stale <= 0 or entry is None or monotonic() - entry[0] > stale:
+            raise error
+        self.stale[host] += 1
+        log.info("Serving stale response", host=host, age=round(monotonic() - entry[0]), reason=error.reason)
+        return entry[1]
+
+    async def _fetch(self, url: str, key: str, host: str, keep: bool) -> str:
+        breaker = self.breaker(host)
+        try:
+            text = await self._hedged(url, host)
+        except asyncio.CancelledError:
+            breaker.record_cancelled()
+            raise
+        except UpstreamError as error:
+            self._record_failure(host, error)
+            raise
+        except BaseException:
+            # _hedged turns the host's own failures into UpstreamError, so anything else is unexpected (a body that
+            # won't decode as text, or a bug) and says nothing about the host's health. A probe's slot still has to
+            # be given back, or the breaker would never let another request through.
+            breaker.record_cancelled()
+            raise
+        self._record_success(host)
+        if keep:
+            self._last_good[key] = (monotonic(), text)
+            self._last_good.move_to_end(key)
+            while len(self._last_good) > STALE_ENTRIES:
+                self._last_good.popitem(last=False)
+        return text
+
+    def _record_success(self, host: str):
+        breaker = self.breaker(host)
+        if breaker.failures:
+            log.info("Upstream healthy again", host=host)
+        breaker.record_success()
+
+    def _record_failure(self, host: str, error: UpstreamError):
+        breaker = self.breaker(host)
+        was_open = breaker.state == OPEN
+        breaker.record_failure(error.reason)
+        if breaker.state == OPEN and not was_open:
+            log.warning("Upstream marked unhealthy", host=host, failures=breaker.failures, reason=error.reason,
+                        retry_in=round(breaker.retry_in))
+
+    async def _hedged(self, url: str, host: str) -> str:
+        # Sends a second request if the first is slow (when the host has hedge_after set), taking whichever
+        # succeeds first. It only fails if every request sent does.
+        hedge_after = self.hosts.get(host, {}).get("hedge_after")
+        attempts = {asyncio.ensure_future(self._attempt(url, host))}
+        try:
+            if hedge_after is not None:
+                done, _ = await asyncio.wait(attempts, timeout=hedge_after)
+                if not done:
+                    self.hedged[host] += 1
+                    attempts.add(asyncio.ensure_future(self._attempt(url, host)))
+            error = None
+            while attempts:
+                done, attempts = await asyncio.wait(attempts, return_when=asyncio.FIRST_COMPLETED)
+                for attempt in done:
+                    if attempt.exception() is None:
+                        return attempt.result()
+                    error = error or attempt.exception()
+            raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+
+    async def _attempt(self, url: str, host: str) -> str:
+        async with self._request(url, host) as resp:
+            return await resp.text()
+
+    @asynccontextmanager
+    async def _request(self, url: str, host: str):
+        # Sends a GET, yielding the response to read. Timed in the stats and traced, and raises UpstreamError for
+        # anything that says the host is in trouble.
+        parts = urlsplit(url)
+        settings = self.hosts.get(host, {})
+        timeout = self.timeout
+        if "timeout" in settings:
+            timeout = ClientTimeout(total=settings["timeout"], connect=self.connect_timeout)
+        start = perf_counter()
+        ok = False
+        try:
+            with tracer.child(host + parts.path, "http"):
+                async with self.session.get(url, timeout=timeout) as resp:
+                    log.debug("HTTP response", host=resp.url.host, status=resp.status, every=10)
+                    if resp.status >= 500 or resp.status == 429:
+                        raise UpstreamError(host, f"HTTP {resp.status}")
+                    yield resp
+            ok = True
+        except asyncio.TimeoutError:
+            raise UpstreamError(host, "timed out") from None
+        except ClientError as error:
+            # On newer Pythons, where TimeoutError is an OSError, aiohttp wraps timeouts in a ClientOSError.
+            reason = "timed out" if isinstance(error.__cause__, asyncio.TimeoutError) else type(error).__name__
+            raise UpstreamError(host, reason) from error
+        except asyncio.CancelledError:
+            start = None  # A hedged request that lost, or a caller that gave up - neither says anything about the host
+            raise
+        finally:
+            if start is not None:
+                stats.observe("http", host, perf_counter() - start, ok=ok)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None